@@ -8,17 +8,34 @@ import os
 import warnings
 import logging
 
+import mann.lens_output
+import mann.weight_store
+
 logger = logging.getLogger(__name__)
 
+# variables copied from os.environ into the environment of a LENS process,
+# everything else LENS needs is passed in explicitly for each call
+LENS_BASE_ENV_KEYS = ('PATH', 'HOME', 'USER', 'LANG', 'LC_ALL', 'TMPDIR',
+                      'LENSDIR', 'HOSTTYPE', 'LD_LIBRARY_PATH', 'DISPLAY',
+                      'TCL_LIBRARY', 'TK_LIBRARY', 'SYSTEMROOT')
+
+
+def get_base_lens_env():
+    """Returns a new dict with the :py:data:`LENS_BASE_ENV_KEYS` that are
+    set in os.environ
+    """
+    return dict((key, os.environ[key]) for key in LENS_BASE_ENV_KEYS
+                if key in os.environ)
+
 
 def setup_logger(fh, formatter):
+    global logger
     logger.setLevel(logging.DEBUG)
     fh = fh
     # fh.setLevel(logging.DEBUG)
     fh.setLevel(logging.CRITICAL)
     formatter = formatter
     fh.setFormatter(formatter)
-    global logger
     logger.addHandler(fh)
     logger.debug('Setup logger in network_agent.py')
     return logger
@@ -122,6 +139,15 @@ class Agent(object):
     def get_state(self):
         raise BaseAgentStateError('Base agent class has no state')
 
+    def get_agent_scratch_path(self, file_path):
+        """Returns file_path with the padded agent id added to the file name
+
+        Used to give each agent its own copy of a scratch file, e.g.
+        Infl.ex becomes Infl000012.ex for agent 12
+        """
+        root, extension = os.path.splitext(file_path)
+        return root + self.get_padded_agent_id() + extension
+
     def set_predecessors(self, list_of_predecessors):
         '''
         Takes a list of predecessors and assigns the list to self.predecessors
@@ -151,6 +177,8 @@ class Agent(object):
 class LensAgent(Agent):
     agent_count = 0
     prototypes = []
+    # command used to start LENS, see mann.lens_worker.FAKE_LENS_COMMAND
+    lens_command = ('lens',)
 
     def __init__(self, num_state_vars):
         """Creates a LensAgent instance
@@ -224,7 +252,7 @@ class LensAgent(Agent):
         LensAgent.prototypes = list_of_prototypes[:]
         print('list of prototypes created: ', str(list_of_prototypes))
 
-    def call_lens(self, lens_in_file_dir, lens_env={}):
+    def call_lens(self, lens_in_file_dir, lens_env={}, lens_worker=None):
         """Calls LENS
 
         :param lens_in_file_dir: file dir of .in file to use for LENS
@@ -233,18 +261,33 @@ class LensAgent(Agent):
         :param lens_env: values to be passed into the lens environment
         :type lens_env: dict
 
+        :param lens_worker: a running :py:class:`mann.lens_worker.LensWorker`
+            or :py:class:`mann.lens_worker.LensWorkerPool`, when None a new
+            `lens -batch` process is started
+        :type lens_worker: LensWorker
+
         the lens_env contains all the enviornment variables needed
-        for lens to run the .in file properly
+        for lens to run the .in file properly, they are added to a minimal
+        environment (see :py:func:`get_base_lens_env`), os.environ is not
+        changed
         """
-        env = os.environ
+        logger.debug('Lens env: {}'.format(str(lens_env.items())))
+
+        if lens_worker is not None:
+            logger.debug('Calling lens worker')
+            lens_worker.call(lens_in_file_dir, lens_env)
+            logger.debug('Finished calling lens worker')
+            return
+
+        # agents on different threads call LENS with their own env
+        env = get_base_lens_env()
 
         for key, value in lens_env.items():
             env[key] = str(value)
 
-        logger.debug('Lens env: {}'.format(str(lens_env.items())))
-
         logger.debug('Calling lens')
-        subprocess.call(['lens', '-batch', lens_in_file_dir], env=env)
+        subprocess.call(list(self.lens_command) + ['-batch', lens_in_file_dir],
+                        env=env)
         logger.debug('Finished calling lens')
 
         # subprocess.call(['lens', '-batch', lens_in_file],
@@ -284,22 +327,16 @@ class LensAgent(Agent):
     def get_new_state_values_from_out_file(self, lens_output_dir,
                                            num_processing_unts=10,
                                            column=0):
-        num_lines = sum(1 for line in open(lens_output_dir))
-        final_lens_output = []
-        start_line = num_lines - (num_processing_unts + 3)
-        print(start_line)
-        with open(lens_output_dir, 'r') as f:
-            for line_num, line in enumerate(f):
-                if line_num >= start_line:
-                    final_lens_output.append(line.strip())
-        assert num_processing_unts % 2 == 0, 'num_processing_unts not even'
-        per_bank = int(num_processing_unts / 2)
-        new_state = final_lens_output[2:(2+per_bank)]
-        new_state.extend(final_lens_output[2+per_bank+1:])
-        new_state = [float(x) for x in new_state]
-        assert len(new_state) == num_processing_unts, \
-            'final number of output units not equal to num processing units'
-        return(new_state)
+        """Returns the unit outputs of the last tick in a LENS .out file
+
+        Only the end of the file is read, see
+        :py:func:`mann.lens_output.read_final_state`
+
+        :rtype: list
+        """
+        new_state = mann.lens_output.read_final_state(lens_output_dir,
+                                                      num_processing_unts)
+        return(new_state.tolist())
 
     # def _get_new_state_values_from_out_file(self, file_dir, type, column=0):
     #     """Get new state values from .out file_d
@@ -364,13 +401,15 @@ class LensAgent(Agent):
 
     def _update_agent_state_default(self, lens_in_file, agent_ex_file,
                                     infl_ex_file, agent_state_out_file,
-                                    criterion):
+                                    criterion, lens_worker=None):
         if len(self.predecessors) > 0:
             predecessor_picked = random.sample(list(self.predecessors), 1)[0]
             predecessor_picked.write_to_ex(infl_ex_file)
-            state_env = self.get_env_for_pos_neg_bank_values()
+            state_env = self.get_env_for_state_file(
+                self.get_state_file_path(agent_state_out_file))
             state_env['c'] = str(criterion)
-            self._call_lens(lens_in_file, env=state_env)
+            self.call_lens(lens_in_file, lens_env=state_env,
+                           lens_worker=lens_worker)
             self.new_state_values = self._get_new_state_values_from_out_file(
                 agent_state_out_file)
             self.set_state(self.new_state_values)
@@ -398,7 +437,7 @@ class LensAgent(Agent):
 
     def calculate_new_state_default_i(self, lens_in_file, agent_ex_file,
                                       infl_ex_file, agent_state_out_file,
-                                      criterion):
+                                      criterion, lens_worker=None):
         """Calculates a new state using the default influencing agent algorithm.
 
         The default influencing agent algorithm picks an influencing agent
@@ -410,10 +449,11 @@ class LensAgent(Agent):
         if len(self.predecessors) > 0:
             predecessor_picked = random.sample(list(self.predecessors), 1)[0]
             predecessor_picked.write_to_ex(infl_ex_file)
-            state_env = self.get_env_for_pos_neg_bank_values()
-            state_env['a'] = self.get_padded_agent_id()
+            state_env = self.get_env_for_state_file(
+                self.get_state_file_path(agent_state_out_file))
             state_env['c'] = str(criterion)
-            self._call_lens(lens_in_file, env=state_env)
+            self.call_lens(lens_in_file, lens_env=state_env,
+                           lens_worker=lens_worker)
             # self.new_state_values = self._get_new_state_values_from_out_file(
             #     agent_state_out_file)
             # self.set_state(self.new_state_values)
@@ -452,7 +492,8 @@ class LensAgent(Agent):
                 kwargs.get('agent_ex_file'),
                 kwargs.get('infl_ex_file'),
                 kwargs.get('agent_state_out_file'),
-                kwargs.get('criterion'))
+                kwargs.get('criterion'),
+                lens_worker=kwargs.get('lens_worker'))
             return new_state
 
         else:
@@ -461,7 +502,8 @@ class LensAgent(Agent):
 
     def create_weight_file(self, weight_in_file, weight_output_dir,
                            base_example, num_train_examples,
-                           prototype_mutation_prob, criterion):
+                           prototype_mutation_prob, criterion,
+                           weight_store=None, weight_seed=None):
         """Creates the weight file for the :py:class:`LensAgent`
 
         The weights are needed for LENS, as it defines the weights between each
@@ -490,6 +532,15 @@ class LensAgent(Agent):
         :param criterion:criterion to stop weight training
         :type criterion: int
 
+        :param weight_store: store of weight files trained in earlier runs,
+            the stored file is reused when the training examples, criterion
+            and seed are the same
+        :type weight_store: mann.weight_store.WeightStore
+
+        :param weight_seed: random seed for the training, passed to LENS as
+            the seed environment variable
+        :type weight_seed: int
+
         :returns: None
         :rtype: None
 
@@ -514,8 +565,7 @@ class LensAgent(Agent):
         if not os.path.exists(weight_output_dir):
             os.makedirs(weight_output_dir)
 
-        # copy current envvironment
-        lens_env = os.environ
+        lens_env = get_base_lens_env()
 
         lens_env["a"] = padded_agent_number
         lens_env["c"] = str(criterion)
@@ -535,10 +585,30 @@ class LensAgent(Agent):
                          write_type='sit',
                          weight_ex_list=list_ex)
 
+        weight_file_path = os.path.join(weight_output_dir,
+                                        'wgt' + padded_agent_number + '.wt')
+        if weight_seed is not None:
+            lens_env['seed'] = str(weight_seed)
+        if weight_store is not None:
+            with open(weight_ex_dir, 'r') as f:
+                weight_ex_content = f.read()
+            store_key = weight_store.make_key(weight_ex_content,
+                                              {'c': criterion},
+                                              seed=weight_seed,
+                                              in_file_path=weight_in_file)
+            if weight_store.fetch(store_key, weight_file_path):
+                return
+        # the file can be a hard link to a weight store entry
+        mann.weight_store.detach_weight_file(weight_file_path)
+
         # list of 'words' passed into the subprocess call
-        lens_weight_command = ['lens', '-batch',  weight_in_file]
+        lens_weight_command = list(self.lens_command) + ['-batch',
+                                                         weight_in_file]
         subprocess.call(lens_weight_command, env=lens_env)
 
+        if weight_store is not None and os.path.exists(weight_file_path):
+            weight_store.store(store_key, weight_file_path)
+
     def get_state(self):
         """Return the state of the agent
 
@@ -615,9 +685,10 @@ class LensAgent(Agent):
         '''
         self.write_to_ex(self_ex_file_location, write_type='state')
         # run lens
-        state_env = self.get_env_for_pos_neg_bank_values()
+        state_env = self.get_env_for_state_file(
+            self.get_state_file_path(self_state_out_file))
         state_env['c'] = str(criterion)
-        self._call_lens(lens_in_file, env=state_env)
+        self.call_lens(lens_in_file, lens_env=state_env)
         # capture output and set as state
         self.new_state_values = self._get_new_state_values_from_out_file(
             self_state_out_file)
@@ -712,24 +783,45 @@ class LensAgent(Agent):
     #     return format_string.format(self.get_key())
 
 
-    def get_env_for_pos_neg_bank_values(self):
-        # TODO this should be a hidden function
-        current_env = os.environ
-        padded_agent_number = "{0:06d}".format(self.get_key())
-        current_env['a'] = padded_agent_number
-        for idx_bank, bank in enumerate(('p', 'n')):
-            bank_values = self.get_pos_neg_bank_values()[idx_bank]
-            # print(bank_values, file=sys.stderr)
-            for idx_pu, j in enumerate(bank_values):
-                var_key = str(bank) + str(idx_pu)
-                var_value = str(bank_values[idx_pu])
-                # print('key: ', var_key, '; value: ', var_value)
-                # setattr(current_env, var_to_export, var_to_export)
-                # current_env.putenv(var_key, var_value)
-                current_env[var_key] = var_value
-                # print(current_env.get(var_to_export))
-                # print(current_env.get(var_key))
-        return current_env
+    def write_state_file(self, file_path):
+        """Writes the agent state for LENS, the positive bank values on the
+        first line and the negative bank values on the second line
+
+        :param file_path: path of the state file
+        :type file_path: str
+        """
+        with open(file_path, 'w') as f:
+            for bank_values in self.get_pos_neg_bank_values():
+                f.write(' '.join(str(value) for value in bank_values))
+                f.write('\n')
+
+    def get_state_file_path(self, out_file_path):
+        """Returns the path of the state file of an update, next to the .out
+        file LENS writes, with the padded agent id added to the file name
+
+        :param out_file_path: path of the .out file of the update
+        :type out_file_path: str
+        """
+        return self.get_agent_scratch_path(
+            os.path.splitext(out_file_path)[0] + '.state')
+
+    def get_env_for_state_file(self, file_path):
+        """Writes the state file and returns the LENS environment that points
+        to it
+
+        The .in file reads the state from $env(state_file), see
+        :py:meth:`mann.lens_in_writer.LensInWriterHelper.generate_state_file_reader`,
+        so the environment has the same two variables however many
+        processing units the agent has
+
+        :param file_path: path of the state file
+        :type file_path: str
+
+        :rtype: dict
+        """
+        self.write_state_file(file_path)
+        return {'a': self.get_padded_agent_id(),
+                'state_file': file_path}
 
     def mutate(self, list_to_mutate, mutation_prob):
         '''Mutates each element of a list by the mutation_prob
@@ -774,8 +866,9 @@ class LensAgent(Agent):
                                              kwargs.get('infl_ex_file'),
                                              kwargs.get(
                                                  'agent_state_out_file'),
-                                             kwargs.get('criterion')
-                                             )
+                                             kwargs.get('criterion'),
+                                             lens_worker=kwargs.get(
+                                                 'lens_worker'))
             self.num_update += 1
         else:
             raise ValueError('Algorithm used for pick unknown')
@@ -1,23 +1,27 @@
 #!/usr/bin/env python
 import logging
+import os
 import random
 import numpy.random
 
 from mann import agent
 import mann.helper
+import mann.lens_cache
 import mann.lens_in_writer
+import mann.lens_numpy
+import mann.weight_store
 
 logger = logging.getLogger(__name__)
 
 
 def setup_logger(fh, formatter):
+    global logger
     logger.setLevel(logging.DEBUG)
     fh = fh
     # fh.setLevel(logging.DEBUG)
     fh.setLevel(logging.CRITICAL)
     formatter = formatter
     fh.setFormatter(formatter)
-    global logger
     logger.addHandler(fh)
     logger.debug('Setup logger in agent_lens_recurrent.py')
     return logger
@@ -42,10 +46,15 @@ class LensAgentRecurrent(agent.LensAgent):
 
         self._agent_type = "_".join([type(self).__name__, 'attitude'])
         self._state = [0] * num_state_vars
-        self._temp_new_state = None
+        self.temp_new_state = None
         self._len_per_bank = int(len(self.state) / 2)
         self._predecessors = []
         self._num_update = 0
+        # weight matrix used by the numpy backend
+        self.weights = None
+        # LENS weight file, and its digest used as a result cache key
+        self.weight_file_path = None
+        self._weight_digest = None
 
     def __hash__(self):
         return(hash(self.agent_id))
@@ -88,9 +97,46 @@ class LensAgentRecurrent(agent.LensAgent):
         This involves creating an .ex file (Typically Infl.ex)
         calling lens (which will generate weights,
         read in the .ex file, and train)
+
+        When backend='numpy' is passed in the kwargs, no LENS weight file is
+        created, the weights are drawn in memory instead, see
+        :py:meth:`create_weights_numpy`
+
+        When a :py:class:`mann.weight_store.WeightStore` is passed in as the
+        `weight_store` kwarg, weights trained earlier from the same .ex file,
+        parameters and `weight_seed` are reused instead of calling LENS
+        """
+        if kwargs.get('backend', 'lens') == 'numpy':
+            self.create_weights_numpy(**kwargs)
+            return
+
+        weight_training = self.prepare_weight_training(
+            weight_in_file_path, weight_directory, ex_file_path, **kwargs)
+        if weight_training is None:
+            return
+
+        logger.debug('Calling lens from agent_lens_recurrent.create_weight_file')
+        self.call_lens(lens_in_file_dir=weight_in_file_path,
+                       lens_env=weight_training['lens_env'],
+                       lens_worker=kwargs.get('lens_worker'))
+        logger.debug('Finished alling lens from agent_lens_recurrent.create_weight_file')
+
+        self.finish_weight_training(weight_training)
+
+    def prepare_weight_training(self, weight_in_file_path, weight_directory,
+                                ex_file_path, **kwargs):
+        """Writes the training .ex file of :py:meth:`create_weight_file`
+
+        :returns: the LENS environment of the training and the weight store
+            key, None when the weights were fetched from the weight store
+        :rtype: dict
         """
         logger.debug("creating weight file")
         padded_agent_number = self.get_padded_agent_id()
+        if weight_directory is not None:
+            self.weight_file_path = os.path.join(
+                weight_directory, 'AgentWgt{}.wt'.format(padded_agent_number))
+        self._weight_digest = None
 
         # write a LENS ex file before calling lens to create weights
 
@@ -98,19 +144,70 @@ class LensAgentRecurrent(agent.LensAgent):
         np = len(self.predecessors)
         logger.debug("Number of predecessors: {}".format(str(np)))
 
+        lens_ex_file_strings = self.sample_predecessor_values(np)
         self.write_lens_ex_file(
             ex_file_path,
-            list_to_write_into_string=self.sample_predecessor_values(np))
+            list_to_write_into_string=lens_ex_file_strings)
+
+        lens_env = {'a': padded_agent_number,
+                    'bm': kwargs['between_mean'],
+                    'bs': kwargs['between_sd'],
+                    'wm': kwargs['within_mean'],
+                    'ws': kwargs['within_sd'],
+                    'cs': kwargs['clamp_strength'],
+                    'ex_file': ex_file_path}
+        if kwargs.get('weight_seed') is not None:
+            lens_env['seed'] = kwargs['weight_seed']
+
+        weight_training = {'lens_env': lens_env,
+                           'weight_store': kwargs.get('weight_store'),
+                           'store_key': None}
+        weight_store = weight_training['weight_store']
+        if weight_store is not None and self.weight_file_path is not None:
+            lens_parameters = dict(lens_env)
+            del lens_parameters['a']
+            del lens_parameters['ex_file']
+            store_key = weight_store.make_key(
+                '\n'.join(lens_ex_file_strings), lens_parameters,
+                seed=kwargs.get('weight_seed'),
+                in_file_path=weight_in_file_path)
+            if weight_store.fetch(store_key, self.weight_file_path):
+                logger.debug('Reusing stored weights for agent {}'.
+                             format(self.agent_id))
+                return None
+            weight_training['store_key'] = store_key
+        if self.weight_file_path is not None:
+            # the file can be a hard link to a weight store entry, LENS
+            # would write the new weights into the stored file
+            mann.weight_store.detach_weight_file(self.weight_file_path)
+        return weight_training
+
+    def finish_weight_training(self, weight_training):
+        """Adds the weight file trained by LENS to the weight store
+        """
+        # a digest taken while LENS was training is of the old weights
+        self._weight_digest = None
+        weight_store = weight_training['weight_store']
+        if weight_store is not None and self.weight_file_path is not None:
+            if os.path.exists(self.weight_file_path):
+                weight_store.store(weight_training['store_key'],
+                                   self.weight_file_path)
+            else:
+                logger.warning('LENS did not create {}, not stored'.
+                               format(self.weight_file_path))
 
-        logger.debug('Calling lens from agent_lens_recurrent.create_weight_file')
-        self.call_lens(lens_in_file_dir=weight_in_file_path,
-                       lens_env={'a': padded_agent_number,
-                                 'bm': kwargs['between_mean'],
-                                 'bs': kwargs['between_sd'],
-                                 'wm': kwargs['within_mean'],
-                                 'ws': kwargs['within_sd'],
-                                 'cs': kwargs['clamp_strength']})
-        logger.debug('Finished alling lens from agent_lens_recurrent.create_weight_file')
+    def create_weights_numpy(self, between_mean, between_sd,
+                             within_mean, within_sd, **kwargs):
+        """Draw the weights used by the numpy backend
+
+        :param **kwargs: 'random_state' can be passed as a seed
+        """
+        self.weights = mann.lens_numpy.create_weights(
+            self._len_per_bank,
+            float(between_mean), float(between_sd),
+            float(within_mean), float(within_sd),
+            random_state=kwargs.get('random_state'))
+        return self.weights
 
     # def get_new_state_values_from_out_file(self, file_dir, agent_type,
     #                                        column=0):
@@ -267,11 +364,117 @@ class LensAgentRecurrent(agent.LensAgent):
             lens_ex_file_strings = self._pick_network(n)
         return(lens_ex_file_strings)
 
-    def _update_random_n(self, update_type, n, manual_predecessor_inputs,
-                         **kwargs):
-        """Uses `n` neighbors to update
+    def sample_predecessor_states(self, n, manual_predecessor_inputs=None):
+        """Returns the inputs of n predecessors as an array
+
+        The array has the same rows as the .ex file written by
+        :py:meth:`sample_predecessor_values`, the agent's own state first,
+        followed by the state of each predecessor picked
+        """
+        if n > len(self.predecessors):
+            raise(ValueError, "n is greater than number of predecessors")
+
+        if manual_predecessor_inputs is not None:
+            predecessors_picked = manual_predecessor_inputs[
+                numpy.random.choice(manual_predecessor_inputs.shape[0],
+                                    size=n,
+                                    replace=False),
+                :]
+        else:
+            predecessors_picked = [predecessor.state for predecessor in
+                                   random.sample(self.predecessors, n)]
+        rows = [self.state]
+        rows.extend(predecessors_picked)
+        return numpy.array(rows, dtype=float)
+
+    def _update_random_n_numpy(self, update_type, n,
+                               manual_predecessor_inputs, **kwargs):
+        """Uses `n` neighbors to update, settling the network in numpy
+        instead of calling LENS
+        """
+        lens_parameters = kwargs['lens_parameters']
+        if self.weights is None:
+            self.create_weights_numpy(**lens_parameters)
+
+        inputs = self.sample_predecessor_states(
+            n,
+            manual_predecessor_inputs=manual_predecessor_inputs)
+        new_state = mann.lens_numpy.settle(
+            self.weights, inputs,
+            float(lens_parameters['clamp_strength']),
+            ticks=lens_parameters.get('ticks', mann.lens_numpy.DEFAULT_TICKS),
+            dt=lens_parameters.get('dt', mann.lens_numpy.DEFAULT_DT))
+
+        self._set_new_state(update_type, new_state.tolist())
+
+    def get_weight_digest(self):
+        """Digest of the agent's LENS weight file
+
+        The digest is computed once the weight file exists and kept until
+        :py:meth:`create_weight_file` trains new weights.  Until then the
+        padded agent id is used, since LENS picks the weights by id, and it
+        is not kept so the digest of the file is used as soon as it is
+        written
+        """
+        if self._weight_digest is not None:
+            return self._weight_digest
+        if self.weight_file_path is not None and \
+           os.path.exists(self.weight_file_path):
+            self._weight_digest = mann.lens_cache.file_digest(
+                self.weight_file_path)
+            return self._weight_digest
+        return 'agent{}'.format(self.get_padded_agent_id())
+
+    def get_lens_update_env(self, lens_parameters):
+        """Environment passed to LENS for an update
         """
+        return {'a': self.get_padded_agent_id(),
+                'bm': lens_parameters['between_mean'],
+                'bs': lens_parameters['between_sd'],
+                'wm': lens_parameters['within_mean'],
+                'ws': lens_parameters['within_sd'],
+                'cs': lens_parameters['clamp_strength']}
+
+    def commit_state(self, new_state):
+        """Assign the new state of an update and count the update
+
+        Every update path (sequential, simultaneous, single LENS process,
+        batch) commits its states here, so num_update counts the states
+        assigned
+        """
+        self.state = new_state
+        self.num_update += 1
+
+    def _set_new_state(self, update_type, new_state):
+        if update_type == 'sequential':
+            self.commit_state(new_state)
+        elif update_type == 'simultaneous':
+            self.temp_new_state = new_state
+        else:
+            raise ValueError('Unknown update type')
 
+    def prepare_lens_update(self, n, manual_predecessor_inputs,
+                            per_agent_files=False, workspace=None, **kwargs):
+        """Samples the inputs of a LENS update
+
+        The inputs are sampled when this is called, so in a simultaneous
+        update every agent reads the states from the start of the step even
+        when LENS runs later.
+
+        :param per_agent_files: use the agent's own scratch copy of the .ex
+            and .out files (see
+            :py:meth:`mann.agent.LensAgent.get_agent_scratch_path`), the
+            paths are passed to LENS as the ex_file and out_file environment
+            variables.  Needed when agents call LENS at the same time
+        :type per_agent_files: bool
+
+        :param workspace: scratch directory for the .ex and .out files,
+            passed to LENS the same way as per_agent_files
+        :type workspace: mann.lens_workspace.LensWorkspace
+
+        :returns: everything :py:meth:`run_lens_update` needs
+        :rtype: dict
+        """
         lens_ex_file_strings = self.sample_predecessor_values(
             n,
             manual_predecessor_inputs=manual_predecessor_inputs)
@@ -285,28 +488,130 @@ class LensAgentRecurrent(agent.LensAgent):
         #     logger.debug('Picking from self.predecessors')
         #     lens_ex_file_strings = self._pick_network(n)
 
-        ex_file_strings = '\n'.join(lens_ex_file_strings)
-        ex_file_path = kwargs['lens_parameters']['ex_file_path']
-
-        self.write_lens_ex_file(ex_file_path, string_to_write=ex_file_strings)
+        lens_parameters = kwargs['lens_parameters']
+        ex_file_path = lens_parameters['ex_file_path']
+        new_state_path = lens_parameters['new_state_path']
+        lens_env = self.get_lens_update_env(lens_parameters)
+        if workspace is not None:
+            ex_file_path = workspace.ex_file_path
+            new_state_path = workspace.out_file_path
+            lens_env.update(workspace.env())
+        elif per_agent_files:
+            ex_file_path = self.get_agent_scratch_path(ex_file_path)
+            new_state_path = self.get_agent_scratch_path(new_state_path)
+            lens_env['ex_file'] = ex_file_path
+            lens_env['out_file'] = new_state_path
+        return {'ex_file_strings': '\n'.join(lens_ex_file_strings),
+                'ex_file_path': ex_file_path,
+                'new_state_path': new_state_path,
+                'in_file_path': lens_parameters['in_file_path'],
+                'network_in_file_path':
+                    lens_parameters.get('network_in_file_path'),
+                'lens_env': lens_env}
+
+    def run_lens_update(self, lens_update, **kwargs):
+        """Calls LENS for an update from :py:meth:`prepare_lens_update`
+
+        When a :py:class:`mann.lens_cache.LensResultCache` is passed in as
+        the `result_cache` kwarg, LENS is only called for inputs that are not
+        in the cache
+
+        When a :py:class:`mann.lens_worker.LensWorker` is passed in as the
+        `lens_worker` kwarg and the lens_parameters have a
+        `network_in_file_path`, the worker builds the network from that file
+        once and the update only loads the agent weights and .ex file into
+        it (see :py:meth:`mann.lens_worker.LensWorker.update`), otherwise the
+        in_file_path .in file is run
+
+        :returns: new state values
+        :rtype: list
+        """
+        ex_file_strings = lens_update['ex_file_strings']
+        lens_env = lens_update['lens_env']
+
+        result_cache = kwargs.get('result_cache')
+        if result_cache is not None:
+            cache_key = result_cache.make_key(self.get_weight_digest(),
+                                              ex_file_strings, lens_env)
+            new_state = result_cache.get(cache_key)
+            if new_state is not None:
+                logger.debug('Agent {} LENS result cache hit'.
+                             format(self.agent_id))
+                return new_state
+
+        self.write_lens_ex_file(lens_update['ex_file_path'],
+                                string_to_write=ex_file_strings)
         # with open(ex_file_path, 'w') as f:
         #     f.write(ex_file_strings)
-        print('kwargs: ', kwargs['lens_parameters'])
-        print(kwargs['lens_parameters']['between_mean'])
-        lens_in_file_path = kwargs['lens_parameters']['in_file_path']
-        self.call_lens(lens_in_file_path,
-                       lens_env={'a': self.get_padded_agent_id(),
-                                 'bm': kwargs['lens_parameters']['between_mean'],
-                                 'bs': kwargs['lens_parameters']['between_sd'],
-                                 'wm': kwargs['lens_parameters']['within_mean'],
-                                 'ws': kwargs['lens_parameters']['within_sd'],
-                                 'cs': kwargs['lens_parameters']['clamp_strength']})
-        if update_type == 'sequential':
-            new_state_path = kwargs['lens_parameters']['new_state_path']
-            new_state = self.get_new_state_values_from_out_file(new_state_path)
-            self.state = new_state
+        lens_worker = kwargs.get('lens_worker')
+        network_in_file_path = lens_update.get('network_in_file_path')
+        if lens_worker is not None and network_in_file_path is not None and \
+           self.weight_file_path is not None:
+            logger.debug('Updating agent {} on the lens worker network'.
+                         format(self.agent_id))
+            lens_worker.update(self.weight_file_path,
+                               lens_update['ex_file_path'],
+                               lens_update['new_state_path'],
+                               lens_env=lens_env,
+                               network_in_file=network_in_file_path)
         else:
-            raise ValueError('Only implemented sequential updating so far')
+            self.call_lens(lens_update['in_file_path'],
+                           lens_env=lens_env,
+                           lens_worker=lens_worker)
+        new_state = self.get_new_state_values_from_out_file(
+            lens_update['new_state_path'],
+            num_processing_unts=len(self.state))
+        if result_cache is not None:
+            result_cache.put(cache_key, new_state)
+        return new_state
+
+    def _update_random_n(self, update_type, n, manual_predecessor_inputs,
+                         **kwargs):
+        """Uses `n` neighbors to update
+
+        In a 'simultaneous' update the new state is kept in temp_new_state
+        until the network commits it at the end of the step.  When a
+        :py:class:`mann.lens_workspace.LensWorkspaceManager` is passed in as
+        the `workspace_manager` kwarg, the LENS files are written to a
+        workspace instead of the lens_parameters paths
+        """
+        if kwargs.get('backend', 'lens') == 'numpy':
+            self._update_random_n_numpy(update_type, n,
+                                        manual_predecessor_inputs, **kwargs)
+            return
+
+        workspace_manager = kwargs.get('workspace_manager')
+        if workspace_manager is None:
+            lens_update = self.prepare_lens_update(
+                n, manual_predecessor_inputs, **kwargs)
+            new_state = self.run_lens_update(lens_update, **kwargs)
+        else:
+            workspace = workspace_manager.acquire()
+            try:
+                lens_update = self.prepare_lens_update(
+                    n, manual_predecessor_inputs, workspace=workspace,
+                    **kwargs)
+                new_state = self.run_lens_update(lens_update, **kwargs)
+            finally:
+                workspace_manager.release(workspace)
+        self._set_new_state(update_type, new_state)
+
+    def num_predecessors_to_pick(self, update_algorithm,
+                                 manual_predecessor_inputs=None):
+        """Number of predecessors used by an update algorithm
+
+        :param update_algorithm: 'random_1', 'random_all'
+        :type update_algorithm: str
+        """
+        if update_algorithm == 'random_1':
+            return 1
+        elif update_algorithm == 'random_all':
+            if manual_predecessor_inputs is not None:
+                return len(manual_predecessor_inputs)
+            else:
+                return len(self.predecessors)
+        else:
+            raise ValueError("update algorithm unknown")
 
     def update_agent_state(self, update_type, update_algorithm,
                            manual_predecessor_inputs, **kwargs):
@@ -317,22 +622,16 @@ class LensAgentRecurrent(agent.LensAgent):
 
         :param update_algorithm: 'random_1', 'random_all'
         :type update_algorithm: str
+
+        :param **kwargs: backend='numpy' settles the network in process with
+            :py:mod:`mann.lens_numpy` instead of calling LENS, the default
+            backend is 'lens'
         """
         if self.has_predecessor():
-            if update_algorithm == 'random_1':
-                self._update_random_n(update_type, 1,
-                                      manual_predecessor_inputs, **kwargs)
-            elif update_algorithm == 'random_all':
-                if manual_predecessor_inputs is not None:
-                    n = len(manual_predecessor_inputs)
-                elif manual_predecessor_inputs is None:
-                    n = len(self.predecessors)
-                else:
-                    raise ValueError
-                self._update_random_n(update_type, n,
-                                      manual_predecessor_inputs, **kwargs)
-            else:
-                raise ValueError("update algorithm unknown")
+            n = self.num_predecessors_to_pick(update_algorithm,
+                                              manual_predecessor_inputs)
+            self._update_random_n(update_type, n,
+                                  manual_predecessor_inputs, **kwargs)
         else:
             logger.debug('Agent {} has no precessors.'.
                           format(self.agent_id))
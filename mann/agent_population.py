@@ -0,0 +1,272 @@
+#! /usr/bin/env python
+"""Struct of arrays store for a population of agents
+
+Every agent object keeps its own `__dict__`, python list state and property
+setters.  An :py:class:`AgentPopulation` keeps the values of all its agents
+in numpy arrays instead, one row per agent, and hands out view objects that
+read and write their row.  The views use `__slots__` and borrow the methods
+of the agent class they stand in for, so they can be used as the nodes of a
+:py:class:`mann.network_agent.NetworkAgent` graph, while the engines in
+:py:mod:`mann.binary_engine` work on the arrays directly.
+"""
+
+import types
+
+import numpy as np
+
+import mann.agent_binary
+import mann.agent_lens_recurrent
+
+# step_update_status and binary temp_new_state stored for None
+NONE_VALUE = -1
+
+
+def _borrow_methods(view_class, agent_class):
+    """Copy the methods of agent_class and its bases onto view_class,
+    except the ones view_class defines itself
+    """
+    own_names = set(vars(view_class))
+    for klass in reversed(agent_class.__mro__[:-1]):
+        for name, value in vars(klass).items():
+            if name in own_names or name in ('__init__', '__dict__',
+                                             '__weakref__', '__module__',
+                                             '__doc__'):
+                continue
+            if isinstance(value, (types.FunctionType, staticmethod,
+                                  classmethod)):
+                setattr(view_class, name, value)
+    return view_class
+
+
+class AgentView(object):
+    __slots__ = ('_population', '_index')
+    agent_class = None
+
+    def __init__(self, population, index):
+        self._population = population
+        self._index = index
+
+    def __getattr__(self, name):
+        # class attributes of the agent class, e.g. lens_command
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.agent_class, name)
+
+    @property
+    def agent_id(self):
+        return int(self._population.agent_id[self._index])
+
+    @property
+    def predecessors(self):
+        return self._population.predecessors[self._index]
+
+    @predecessors.setter
+    def predecessors(self, predecessors_list):
+        self._population.predecessors[self._index] = predecessors_list
+
+    @property
+    def num_update(self):
+        return int(self._population.num_update[self._index])
+
+    @num_update.setter
+    def num_update(self, num):
+        assert num == 0 or num == self.num_update + 1,\
+            "Tried to increment num_update by {}, which is not 1".\
+            format(str(num))
+        self._population.num_update[self._index] = num
+
+
+class BinaryAgentView(AgentView):
+    """A :py:class:`mann.agent_binary.BinaryAgent` stored in an
+    :py:class:`AgentPopulation`
+    """
+    __slots__ = ()
+    agent_class = mann.agent_binary.BinaryAgent
+
+    @property
+    def state(self):
+        return int(self._population.state[self._index, 0])
+
+    @state.setter
+    def state(self, new_state):
+        assert new_state in [0, 1], \
+            "New state for BinaryAgent must be 0 or 1.  "\
+            "Tried to set a value of {}".format(str(new_state))
+        self._population.state[self._index, 0] = new_state
+
+    @property
+    def temp_new_state(self):
+        if not self._population.has_temp_new_state[self._index]:
+            return None
+        return int(self._population.temp_new_state[self._index, 0])
+
+    @temp_new_state.setter
+    def temp_new_state(self, value):
+        if value is None:
+            self._population.has_temp_new_state[self._index] = False
+        else:
+            self._population.temp_new_state[self._index, 0] = value
+            self._population.has_temp_new_state[self._index] = True
+
+    @property
+    def step_update_status(self):
+        status = self._population.step_update_status[self._index]
+        return None if status == NONE_VALUE else int(status)
+
+    @step_update_status.setter
+    def step_update_status(self, value):
+        self._population.step_update_status[self._index] = \
+            NONE_VALUE if value is None else value
+
+    @property
+    def num_flipped(self):
+        return int(self._population.num_flipped[self._index])
+
+    @num_flipped.setter
+    def num_flipped(self, value):
+        self._population.num_flipped[self._index] = value
+
+    @property
+    def max_flips(self):
+        return float(self._population.max_flips[self._index])
+
+    @max_flips.setter
+    def max_flips(self, value):
+        assert value >= 0,\
+            "Max flip needs to be greater than 0, {} given".format(value)
+        self._population.max_flips[self._index] = value
+
+    @property
+    def threshold(self):
+        return float(self._population.threshold[self._index])
+
+    @threshold.setter
+    def threshold(self, threshold):
+        self._population.threshold[self._index] = threshold
+
+
+class LensAgentRecurrentView(AgentView):
+    """A :py:class:`mann.agent_lens_recurrent.LensAgentRecurrent` stored in
+    an :py:class:`AgentPopulation`, the state is a row of the state matrix
+    """
+    __slots__ = ('weights', 'weight_file_path', '_weight_digest')
+    agent_class = mann.agent_lens_recurrent.LensAgentRecurrent
+
+    def __init__(self, population, index):
+        super(LensAgentRecurrentView, self).__init__(population, index)
+        self.weights = None
+        self.weight_file_path = None
+        self._weight_digest = None
+
+    @property
+    def state(self):
+        return self._population.state[self._index].tolist()
+
+    @state.setter
+    def state(self, new_state_values):
+        assert len(new_state_values) == self._population.num_state_vars
+        self._population.state[self._index] = new_state_values
+
+    @property
+    def temp_new_state(self):
+        if not self._population.has_temp_new_state[self._index]:
+            return None
+        return self._population.temp_new_state[self._index].tolist()
+
+    @temp_new_state.setter
+    def temp_new_state(self, value):
+        if value is None:
+            self._population.has_temp_new_state[self._index] = False
+        else:
+            self._population.temp_new_state[self._index] = value
+            self._population.has_temp_new_state[self._index] = True
+
+    @property
+    def agent_type(self):
+        return '_'.join([self.agent_class.__name__, 'attitude'])
+
+    @property
+    def _len_per_bank(self):
+        return self._population.num_state_vars // 2
+
+    @property
+    def len_per_bank(self):
+        return self._len_per_bank
+
+    @property
+    def num_update(self):
+        return int(self._population.num_update[self._index])
+
+    @num_update.setter
+    def num_update(self, value):
+        if value <= self.num_update:
+            raise ValueError(
+                "Number update cannot be lower or equal to current count")
+        self._population.num_update[self._index] = value
+
+
+_borrow_methods(BinaryAgentView, mann.agent_binary.BinaryAgent)
+_borrow_methods(LensAgentRecurrentView,
+                mann.agent_lens_recurrent.LensAgentRecurrent)
+
+
+class AgentPopulation(object):
+    def __init__(self, num_agents, view_class, num_state_vars=1,
+                 state_dtype=np.uint8, first_agent_id=0):
+        """Arrays holding the values of num_agents agents
+
+        :param view_class: :py:class:`BinaryAgentView` or
+            :py:class:`LensAgentRecurrentView`
+        :type view_class: type
+
+        :param num_state_vars: number of values in an agent state
+        :type num_state_vars: int
+
+        :param first_agent_id: agent id of the first agent, the agents are
+            numbered in order
+        :type first_agent_id: int
+        """
+        self.num_state_vars = num_state_vars
+        self.agent_id = np.arange(first_agent_id, first_agent_id + num_agents)
+        self.state = np.zeros((num_agents, num_state_vars), dtype=state_dtype)
+        self.temp_new_state = np.zeros((num_agents, num_state_vars),
+                                       dtype=state_dtype)
+        self.has_temp_new_state = np.zeros(num_agents, dtype=bool)
+        self.num_update = np.zeros(num_agents, dtype=np.int64)
+        self.num_flipped = np.zeros(num_agents, dtype=np.int64)
+        self.threshold = np.zeros(num_agents, dtype=float)
+        self.max_flips = np.zeros(num_agents, dtype=float)
+        self.step_update_status = np.full(num_agents, NONE_VALUE,
+                                          dtype=np.int8)
+        self.predecessors = [[] for _ in range(num_agents)]
+        self._views = [view_class(self, idx) for idx in range(num_agents)]
+
+    @classmethod
+    def binary(cls, num_agents, threshold, max_flips, first_agent_id=0):
+        """Population of binary agents, the arguments of
+        :py:class:`mann.agent_binary.BinaryAgent` are used for every agent
+        """
+        population = cls(num_agents, BinaryAgentView,
+                         first_agent_id=first_agent_id)
+        population.threshold[:] = threshold
+        population.max_flips[:] = max_flips
+        return population
+
+    @classmethod
+    def lens_recurrent(cls, num_agents, num_state_vars, first_agent_id=0):
+        """Population of recurrent attitude agents with float states
+        """
+        assert num_state_vars % 2 == 0,\
+            'num_state_vars needs to be an even value'
+        return cls(num_agents, LensAgentRecurrentView,
+                   num_state_vars=num_state_vars, state_dtype=float,
+                   first_agent_id=first_agent_id)
+
+    def __len__(self):
+        return len(self._views)
+
+    def __getitem__(self, idx):
+        return self._views[idx]
+
+    def __iter__(self):
+        return iter(self._views)
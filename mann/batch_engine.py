@@ -0,0 +1,432 @@
+#! /usr/bin/env python
+"""Engines that run many binary simulations of the same network at once
+
+Sweeps run `num_sims_per` replicates of the same binary network, each in
+its own process.  :py:class:`ReplicateEngine` runs the replicates of a
+threshold_watts cascade together: the state of an agent in 64 replicates is
+packed in one uint64 word, and the active predecessor counts are bit-sliced
+counters over the predecessor CSR of
+:py:func:`mann.binary_engine.network_csr`, so every word operation of a step
+works on 64 replicates.
+
+:py:class:`ParameterBatchEngine` runs one network with K settings of the
+threshold and max_flips, the states are an (agents x K) matrix and all the
+columns share the agents sampled for each step.
+"""
+
+import logging
+import random
+
+import numpy as np
+
+import mann.binary_engine
+
+logger = logging.getLogger(__name__)
+
+WORD_BITS = 64
+
+
+def pack_replicates(bits):
+    """Pack an (agents x replicates) 0/1 array into uint64 words
+
+    :returns: (agents x words) array, replicate r is bit r % 64 of word
+        r // 64
+    :rtype: numpy.ndarray
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    num_agents, num_replicates = bits.shape
+    num_words = -(-num_replicates // WORD_BITS)
+    padded = np.zeros((num_agents, num_words * WORD_BITS), dtype=np.uint8)
+    padded[:, :num_replicates] = bits
+    packed = np.packbits(padded, axis=1, bitorder='little')
+    return packed.view('<u8').reshape(num_agents, num_words)
+
+
+def unpack_replicates(words, num_replicates):
+    """Inverse of :py:func:`pack_replicates`
+
+    :rtype: numpy.ndarray
+    """
+    words = np.ascontiguousarray(words, dtype='<u8')
+    bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :num_replicates]
+
+
+def csr_column_sums(indptr, indices, values):
+    """Sum the rows of values picked by every CSR row
+
+    :param values: (agents x columns) array
+    :type values: numpy.ndarray
+
+    :returns: (agents x columns) array, row i is the sum of
+        values[indices[indptr[i]:indptr[i + 1]]]
+    :rtype: numpy.ndarray
+    """
+    num_agents = len(indptr) - 1
+    sums = np.zeros((num_agents, values.shape[1]), dtype=np.int64)
+    rows = np.flatnonzero(np.diff(indptr) > 0)
+    if len(rows) > 0:
+        # rows without predecessors are left out, reduceat would return the
+        # value at their start instead of 0
+        sums[rows] = np.add.reduceat(values[indices].astype(np.int64),
+                                     indptr[rows], axis=0)
+    return sums
+
+
+def sample_columns(num_agents, num_columns, num_agents_update,
+                   random_state):
+    """Pick num_agents_update agents without replacement in every column
+
+    :returns: (agents x columns) boolean mask
+    :rtype: numpy.ndarray
+    """
+    if num_agents_update >= num_agents:
+        return np.ones((num_agents, num_columns), dtype=bool)
+    keys = random_state.random_sample((num_agents, num_columns))
+    picked = np.argpartition(keys, num_agents_update - 1,
+                             axis=0)[:num_agents_update]
+    mask = np.zeros((num_agents, num_columns), dtype=bool)
+    mask[picked, np.arange(num_columns)] = True
+    return mask
+
+
+def threshold_counts(in_degree, threshold):
+    """Smallest number of active predecessors that reaches the threshold,
+    the count c with `c / degree >= threshold` as the binary engines compute
+    it, degree + 1 when no count reaches it or the agent has no
+    predecessors
+
+    :rtype: numpy.ndarray
+    """
+    degree = np.asarray(in_degree, dtype=np.int64)
+    safe_degree = np.maximum(degree, 1).astype(float)
+    needed = np.clip(np.ceil(threshold * safe_degree), 0, degree + 1)
+    needed = needed.astype(np.int64)
+    # the product can round either way, move to the exact boundary
+    lower = (needed > 0) & ((needed - 1) / safe_degree >= threshold)
+    needed[lower] -= 1
+    higher = (needed <= degree) & (needed / safe_degree < threshold)
+    needed[higher] += 1
+    return needed
+
+
+class ReplicateEngine(object):
+    def __init__(self, indptr, indices, threshold, num_replicates,
+                 random_state=None):
+        """Simultaneous threshold_watts runs of num_replicates replicates
+
+        The states, the counters and the flips are all kept packed, 64
+        replicates to a word.  The active predecessor count of an agent is a
+        bit-sliced counter: plane b holds bit b of the count of every
+        replicate, and each predecessor word is added with a ripple carry of
+        `&` and `^` over the planes.  The threshold of an agent becomes the
+        smallest count that reaches it, compared with the counter planes
+        from the top bit down.
+
+        :param indptr: predecessor CSR row pointer
+        :type indptr: numpy.ndarray
+
+        :param indices: predecessor CSR column indices
+        :type indices: numpy.ndarray
+
+        :param threshold: threshold of every agent
+        :type threshold: numpy.ndarray
+
+        :param num_replicates: number of replicates
+        :type num_replicates: int
+
+        :param random_state: seed or numpy RandomState used to seed the
+            replicates and to sample the agents updated in each replicate
+        :type random_state: int
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.in_degree = np.diff(self.indptr)
+        self.threshold = np.asarray(threshold, dtype=float)
+        self.num_agents = len(self.threshold)
+        self.num_replicates = num_replicates
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        self.random_state = random_state
+        num_words = -(-num_replicates // WORD_BITS)
+        self.words = np.zeros((self.num_agents, num_words), dtype=np.uint64)
+        self.flipped_words = np.zeros_like(self.words)
+        # bits of the padding replicates in the last word stay 0
+        self._valid = pack_replicates(np.ones((1, num_replicates)))[0]
+
+        # agents by decreasing in-degree, the agents with more than k
+        # predecessors are the first ones and add their k-th predecessor
+        # into a slice of the counters
+        self._order = np.argsort(-self.in_degree, kind='stable')
+        degree = self.in_degree[self._order]
+        self._kth_predecessors = [
+            self.indices[self.indptr[self._order[:np.sum(degree > k)]] + k]
+            for k in range(int(degree.max()) if len(degree) else 0)]
+        self._num_planes = max(int(degree.max()).bit_length()
+                               if len(degree) else 0, 1)
+        self._needed = threshold_counts(self.in_degree,
+                                        self.threshold)[self._order]
+        self._can_flip = (degree > 0) & (self._needed <= degree)
+
+    @classmethod
+    def from_network(cls, network_agent, num_replicates, random_state=None):
+        """Replicates of a network of binary agents, every replicate starts
+        from the current agent states
+        """
+        agents, indptr, indices = mann.binary_engine.network_csr(
+            network_agent)
+        engine = cls(indptr, indices,
+                     [agent.threshold for agent in agents],
+                     num_replicates, random_state=random_state)
+        state = np.array([agent.state for agent in agents], dtype=np.uint8)
+        engine.state = np.repeat(state[:, np.newaxis], num_replicates, axis=1)
+        return engine
+
+    @property
+    def state(self):
+        """(agents x replicates) array of 0/1 states
+        """
+        return unpack_replicates(self.words, self.num_replicates)
+
+    @state.setter
+    def state(self, bits):
+        self.words = pack_replicates(bits)
+
+    @property
+    def num_update(self):
+        """(agents x replicates) number of updates, a threshold_watts agent
+        is only updated when it flips to 1, at most once per replicate
+        """
+        return unpack_replicates(self.flipped_words,
+                                 self.num_replicates).astype(np.int64)
+
+    def seed_random(self, num_seeds):
+        """Set num_seeds random agents to 1 in every replicate, each
+        replicate picks its own agents
+        """
+        self.words |= pack_replicates(sample_columns(
+            self.num_agents, self.num_replicates, num_seeds,
+            self.random_state))
+
+    def active_counts(self):
+        """(agents x replicates) number of predecessors with state 1
+        """
+        return csr_column_sums(self.indptr, self.indices, self.state)
+
+    def count_planes(self):
+        """Bit-sliced active predecessor counts, in the order of decreasing
+        in-degree
+
+        :returns: (planes x agents x words) array, bit r of
+            planes[b, i, w] is bit b of the count of agent self._order[i] in
+            replicate 64 * w + r
+        :rtype: numpy.ndarray
+        """
+        planes = np.zeros((self._num_planes,) + self.words.shape,
+                          dtype=np.uint64)
+        for predecessors in self._kth_predecessors:
+            rows = len(predecessors)
+            carry = self.words[predecessors]
+            for plane in planes:
+                counter = plane[:rows]
+                next_carry = counter & carry
+                counter ^= carry
+                carry = next_carry
+        return planes
+
+    def reached_words(self):
+        """Packed mask of the agents whose count reaches their threshold,
+        in the order of decreasing in-degree
+
+        :rtype: numpy.ndarray
+        """
+        planes = self.count_planes()
+        ones = np.uint64(0xFFFFFFFFFFFFFFFF)
+        greater = np.zeros_like(self.words)
+        equal = np.full_like(self.words, ones)
+        for bit in range(self._num_planes - 1, -1, -1):
+            needed = np.where((self._needed >> bit) & 1, ones,
+                              np.uint64(0))[:, np.newaxis]
+            greater |= equal & planes[bit] & ~needed
+            equal &= ~(planes[bit] ^ needed)
+        reached = greater | equal
+        reached[~self._can_flip] = 0
+        return reached
+
+    def update(self, num_agents_update):
+        """Run one simultaneous threshold_watts step in every replicate,
+        each replicate samples its own num_agents_update agents
+
+        :returns: boolean array of the replicates where an agent flipped
+        :rtype: numpy.ndarray
+        """
+        flip = np.empty_like(self.words)
+        flip[self._order] = self.reached_words()
+        flip &= ~self.words & self._valid
+        if num_agents_update < self.num_agents:
+            flip &= pack_replicates(sample_columns(
+                self.num_agents, self.num_replicates, num_agents_update,
+                self.random_state))
+        self.words |= flip
+        self.flipped_words |= flip
+        changed = np.bitwise_or.reduce(flip, axis=0)
+        return unpack_replicates(changed[np.newaxis],
+                                 self.num_replicates)[0].astype(bool)
+
+    def cascade_sizes(self):
+        """Number of agents with state 1 in every replicate
+
+        :rtype: numpy.ndarray
+        """
+        return self.state.sum(axis=0, dtype=np.int64)
+
+    def run(self, num_steps, num_agents_update):
+        """Run up to num_steps steps, stopping when no replicate changes
+        while every agent is updated each step
+
+        :returns: cascade size of every replicate
+        :rtype: numpy.ndarray
+        """
+        for step in range(num_steps):
+            flipped = self.update(num_agents_update)
+            if num_agents_update >= self.num_agents and not flipped.any():
+                logger.debug('Replicates settled after {} steps'.
+                             format(step))
+                break
+        return self.cascade_sizes()
+
+
+class ParameterBatchEngine(object):
+    def __init__(self, indptr, indices, state, threshold, max_flips):
+        """Binary runs of one network for K threshold / max_flips settings
+
+        Every column follows :py:class:`mann.binary_engine.BinaryEngine` with
+        its own threshold and max_flips, the agents updated in a step are
+        sampled once for all the columns.
+
+        :param indptr: predecessor CSR row pointer
+        :type indptr: numpy.ndarray
+
+        :param indices: predecessor CSR column indices
+        :type indices: numpy.ndarray
+
+        :param state: starting state of every agent, the same in all columns
+        :type state: numpy.ndarray
+
+        :param threshold: K thresholds, or an (agents x K) array when the
+            agents have different thresholds
+        :type threshold: numpy.ndarray
+
+        :param max_flips: K max_flips values, or an (agents x K) array
+        :type max_flips: numpy.ndarray
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.in_degree = np.diff(self.indptr)
+        state = np.asarray(state, dtype=np.uint8)
+        self.num_agents = len(state)
+        threshold = np.atleast_1d(np.asarray(threshold, dtype=float))
+        max_flips = np.atleast_1d(np.asarray(max_flips, dtype=float))
+        self.num_columns = max(threshold.shape[-1], max_flips.shape[-1])
+        shape = (self.num_agents, self.num_columns)
+        self.threshold = np.broadcast_to(threshold, shape)
+        self.max_flips = np.broadcast_to(max_flips, shape)
+        self.state = np.repeat(state[:, np.newaxis], self.num_columns, axis=1)
+        self.num_flipped = np.zeros(shape, dtype=np.int64)
+        self.num_update = np.zeros(shape, dtype=np.int64)
+        self.step_update_status = np.full(
+            shape, mann.binary_engine.NO_STATUS, dtype=np.int8)
+
+    @classmethod
+    def from_network(cls, network_agent, threshold, max_flips):
+        """Parameter batch of a network of binary agents, every column
+        starts from the current agent states
+        """
+        agents, indptr, indices = mann.binary_engine.network_csr(
+            network_agent)
+        return cls(indptr, indices, [agent.state for agent in agents],
+                   threshold, max_flips)
+
+    def active_counts(self):
+        """(agents x K) number of predecessors with state 1
+        """
+        return csr_column_sums(self.indptr, self.indices, self.state)
+
+    def update(self, num_agents_update, update_algorithm,
+               update_type='simultaneous'):
+        """Run one step in every column
+
+        The agents are drawn the same way as
+        :py:meth:`mann.binary_engine.BinaryEngine.sample_agents`
+
+        :returns: positions of the agents sampled
+        :rtype: numpy.ndarray
+        """
+        assert isinstance(num_agents_update, int)
+        selected = np.array(random.sample(range(self.num_agents),
+                                          num_agents_update), dtype=np.int64)
+        if update_type == 'simultaneous':
+            self.update_simultaneous(selected, update_algorithm)
+        elif update_type == 'sequential':
+            self.update_sequential(selected, update_algorithm)
+        else:
+            raise ValueError('Unknown update type')
+        return selected
+
+    def update_simultaneous(self, selected, update_algorithm):
+        """Simultaneous update of the agents at the positions in selected,
+        with the same rules as
+        :py:meth:`mann.binary_engine.BinaryEngine.update_simultaneous`
+        """
+        selected = selected[self.in_degree[selected] > 0]
+        counts = self.active_counts()[selected]
+        degree = self.in_degree[selected][:, np.newaxis]
+        state = self.state[selected]
+        threshold = self.threshold[selected]
+        if update_algorithm == 'threshold_watts':
+            new_one = (state == 0) & (counts / degree >= threshold)
+            status = self.step_update_status[selected]
+            status[new_one] = 1
+            self.step_update_status[selected] = status
+        elif update_algorithm == 'threshold_watts_flip':
+            opposite = np.where(state == 1, degree - counts, counts)
+            flip = (opposite / degree >= threshold) & \
+                (self.num_flipped[selected] < self.max_flips[selected])
+            self.num_flipped[selected] += flip
+            new_one = np.where(flip, 1 - state, state) == 1
+        else:
+            raise ValueError("Algorithm used for pick unknown")
+        self.state[selected] = np.where(new_one, 1, state)
+        self.num_update[selected] += new_one
+
+    def update_sequential(self, selected, update_algorithm):
+        """Sequential update of the agents at the positions in selected, in
+        order, with the same rules as
+        :py:meth:`mann.binary_engine.BinaryEngine.update_sequential`
+        """
+        for idx in selected:
+            degree = self.in_degree[idx]
+            if degree == 0:
+                continue
+            predecessors = self.indices[self.indptr[idx]:self.indptr[idx + 1]]
+            counts = self.state[predecessors].sum(axis=0, dtype=np.int64)
+            state = self.state[idx]
+            if update_algorithm == 'threshold_watts':
+                flip = (state == 0) & \
+                    (counts / float(degree) >= self.threshold[idx])
+                self.step_update_status[idx][flip] = 1
+            elif update_algorithm == 'threshold_watts_flip':
+                opposite = np.where(state == 1, degree - counts, counts)
+                flip = (opposite / float(degree) >= self.threshold[idx]) & \
+                    (self.num_flipped[idx] < self.max_flips[idx])
+                self.num_flipped[idx] += flip
+            else:
+                raise ValueError("Algorithm used for pick unknown")
+            self.state[idx] = np.where(flip, 1 - state, state)
+
+    def cascade_sizes(self):
+        """Number of agents with state 1 in every column
+
+        :rtype: numpy.ndarray
+        """
+        return self.state.sum(axis=0, dtype=np.int64)
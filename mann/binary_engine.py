@@ -0,0 +1,536 @@
+#! /usr/bin/env python
+"""Vectorized update engine for networks of binary agents
+
+:py:class:`BinaryEngine` keeps the state of every
+:py:class:`mann.agent_binary.BinaryAgent` of a network in numpy arrays and
+the predecessors in a compressed sparse row (CSR) layout, taken from the
+:py:class:`mann.graph_core.CompactGraph` of the network when it has one.  The number of
+active predecessors of all the agents is computed with one sparse
+matrix-vector product per step, instead of a python loop over the
+predecessors of every agent.
+
+The engine follows :py:meth:`mann.network_agent.NetworkAgent.update_simultaneous`
+exactly, including which agents are sampled for a step (the same number of
+values are drawn from :py:mod:`random`), so a seeded run gives the same step
+info file.  Use :py:meth:`BinaryEngine.sync_to_agents` to copy the arrays
+back into the agent objects.
+
+:py:class:`WattsCascadeEngine` runs threshold_watts cascades event driven,
+the active predecessor counts are only updated when an agent flips.
+
+:py:class:`FrontierScheduler` skips the agents whose inputs did not change
+since they were last evaluated, and stops a run at a fixed point.
+"""
+
+import logging
+import random
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# step_update_status of an agent that was not flipped by a threshold_watts
+# update, written as None to the step info file
+NO_STATUS = -1
+
+
+def predecessor_csr(agents):
+    """Returns the CSR row pointer and column indices of the predecessors
+
+    Row i holds the positions in agents of the predecessors of agents[i],
+    predecessors that appear more than once are counted once, the same as
+    :py:meth:`mann.network_agent.NetworkAgent.set_predecessors_for_each_node`
+
+    :param agents: agents with their predecessors set
+    :type agents: list
+
+    :rtype: tuple
+    """
+    position = dict((id(agent), idx) for idx, agent in enumerate(agents))
+    indptr = np.zeros(len(agents) + 1, dtype=np.int64)
+    indices = []
+    for idx, agent in enumerate(agents):
+        row = sorted(set(position[id(predecessor)]
+                         for predecessor in agent.predecessors
+                         if predecessor is not None))
+        indices.extend(row)
+        indptr[idx + 1] = indptr[idx] + len(row)
+    return (indptr, np.array(indices, dtype=np.int64))
+
+
+def successor_csr(indptr, indices):
+    """Returns the CSR row pointer and column indices of the successors,
+    the transpose of the predecessor CSR from :py:func:`predecessor_csr`
+
+    :rtype: tuple
+    """
+    num_agents = len(indptr) - 1
+    rows = np.repeat(np.arange(num_agents), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    out_indptr = np.zeros(num_agents + 1, dtype=np.int64)
+    out_indptr[1:] = np.cumsum(np.bincount(indices, minlength=num_agents))
+    return (out_indptr, rows[order])
+
+
+def network_csr(network_agent):
+    """Returns the agents and predecessor CSR of a
+    :py:class:`mann.network_agent.NetworkAgent`, taken from its
+    :py:class:`mann.graph_core.CompactGraph` when it has one
+
+    :rtype: tuple
+    """
+    agents = network_agent.get_agents()
+    if network_agent.graph is not None:
+        graph = network_agent.graph
+        return (agents, graph.in_indptr, graph.in_indices)
+    indptr, indices = predecessor_csr(agents)
+    return (agents, indptr, indices)
+
+
+class BinaryEngine(object):
+    def __init__(self, agents, indptr=None, indices=None):
+        """
+        :param agents: binary agents of the network, in the order of
+            `network_agent.get_agents()`, with their predecessors set
+        :type agents: list
+
+        :param indptr: predecessor CSR row pointer, computed from the agent
+            predecessors when None
+        :type indptr: numpy.ndarray
+
+        :param indices: predecessor CSR column indices
+        :type indices: numpy.ndarray
+        """
+        self.agents = list(agents)
+        if indptr is None:
+            indptr, indices = predecessor_csr(self.agents)
+        self.indptr, self.indices = indptr, indices
+        self.in_degree = np.diff(self.indptr)
+        # row of every entry in indices, used for the mat-vec product
+        self._rows = np.repeat(np.arange(len(self.agents)), self.in_degree)
+
+        self.state = np.array([agent.state for agent in self.agents],
+                              dtype=np.uint8)
+        self.threshold = np.array([agent.threshold for agent in self.agents],
+                                  dtype=float)
+        self.max_flips = np.array([agent.max_flips for agent in self.agents],
+                                  dtype=float)
+        self.num_flipped = np.array(
+            [agent.num_flipped for agent in self.agents], dtype=np.int64)
+        self.num_update = np.array(
+            [agent.num_update for agent in self.agents], dtype=np.int64)
+        self.step_update_status = np.array(
+            [NO_STATUS if agent.step_update_status is None
+             else agent.step_update_status for agent in self.agents],
+            dtype=np.int8)
+
+    @classmethod
+    def from_network(cls, network_agent):
+        """Engine for the agents of a :py:class:`mann.network_agent.NetworkAgent`
+        """
+        return cls(*network_csr(network_agent))
+
+    @classmethod
+    def from_population(cls, population):
+        """Engine that works on the arrays of a
+        :py:class:`mann.agent_population.AgentPopulation` of binary agents,
+        changes made by the engine are seen by the agent views without
+        :py:meth:`sync_to_agents`
+        """
+        engine = cls(list(population))
+        engine.state = population.state[:, 0]
+        engine.threshold = population.threshold
+        engine.max_flips = population.max_flips
+        engine.num_flipped = population.num_flipped
+        engine.num_update = population.num_update
+        engine.step_update_status = population.step_update_status
+        return engine
+
+    def __len__(self):
+        return len(self.agents)
+
+    def active_counts(self, state=None):
+        """Number of predecessors with state 1 for every agent
+
+        :rtype: numpy.ndarray
+        """
+        if state is None:
+            state = self.state
+        return np.bincount(self._rows, weights=state[self.indices],
+                           minlength=len(self.agents))
+
+    def sample_agents(self, num_agents_update):
+        """Positions of the agents picked for a step, drawn the same way as
+        :py:meth:`mann.network_agent.NetworkAgent.sample_network`
+        """
+        return np.array(random.sample(range(len(self.agents)),
+                                      num_agents_update), dtype=np.int64)
+
+    def update(self, num_agents_update, update_algorithm,
+               update_type='simultaneous'):
+        """Run one step
+
+        :param num_agents_update: number of agents sampled for the step
+        :type num_agents_update: int
+
+        :param update_algorithm: 'threshold_watts' or 'threshold_watts_flip'
+        :type update_algorithm: str
+
+        :param update_type: 'simultaneous' or 'sequential'
+        :type update_type: str
+
+        :returns: positions of the agents sampled
+        :rtype: numpy.ndarray
+        """
+        assert isinstance(num_agents_update, int)
+        selected = self.sample_agents(num_agents_update)
+        if update_type == 'simultaneous':
+            self.update_simultaneous(selected, update_algorithm)
+        elif update_type == 'sequential':
+            self.update_sequential(selected, update_algorithm)
+        else:
+            raise ValueError('Unknown update type')
+        return selected
+
+    def update_simultaneous(self, selected, update_algorithm):
+        """Simultaneous update of the agents at the positions in selected
+
+        As in NetworkAgent.update_simultaneous, only the agents whose new
+        state is 1 are assigned, and their num_update is incremented
+        """
+        selected = selected[self.in_degree[selected] > 0]
+        counts = self.active_counts()[selected]
+        degree = self.in_degree[selected]
+        state = self.state[selected]
+        if update_algorithm == 'threshold_watts':
+            flip = (state == 0) & (counts / degree >= self.threshold[selected])
+            self.step_update_status[selected[flip]] = 1
+            new_one = selected[flip]
+        elif update_algorithm == 'threshold_watts_flip':
+            opposite = np.where(state == 1, degree - counts, counts)
+            flip = (opposite / degree >= self.threshold[selected]) & \
+                (self.num_flipped[selected] < self.max_flips[selected])
+            self.num_flipped[selected[flip]] += 1
+            new_state = np.where(flip, 1 - state, state)
+            new_one = selected[new_state == 1]
+        else:
+            raise ValueError("Algorithm used for pick unknown")
+        self.state[new_one] = 1
+        self.num_update[new_one] += 1
+        logger.debug('Simultaneous update: {} of {} agents set to 1'.
+                     format(len(new_one), len(selected)))
+
+    def update_sequential(self, selected, update_algorithm):
+        """Sequential update of the agents at the positions in selected, in
+        order, each agent sees the states assigned before it
+        """
+        indptr, indices = self.indptr, self.indices
+        for idx in selected:
+            degree = self.in_degree[idx]
+            if degree == 0:
+                continue
+            count = int(self.state[indices[indptr[idx]:indptr[idx + 1]]].sum())
+            if update_algorithm == 'threshold_watts':
+                if self.state[idx] == 0 and \
+                   count / float(degree) >= self.threshold[idx]:
+                    self.step_update_status[idx] = 1
+                    self.state[idx] = 1
+            elif update_algorithm == 'threshold_watts_flip':
+                if self.state[idx] == 1:
+                    count = degree - count
+                if count / float(degree) >= self.threshold[idx] and \
+                   self.num_flipped[idx] < self.max_flips[idx]:
+                    self.num_flipped[idx] += 1
+                    self.state[idx] = 1 - self.state[idx]
+            else:
+                raise ValueError("Algorithm used for pick unknown")
+
+    def reset_step_variables(self):
+        self.step_update_status[:] = NO_STATUS
+
+    def write_step_info(self, time_step, file_to_write, file_mode='a'):
+        """Write the binary agent lines of
+        :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+        from the arrays, then reset the step variables
+        """
+        lines = []
+        for idx, agent in enumerate(self.agents):
+            status = self.step_update_status[idx]
+            lines.append(','.join([
+                str(time_step),
+                str(agent.agent_id),
+                str(self.num_update[idx]),
+                'None' if status == NO_STATUS else str(status),
+                str(self.state[idx])]) + '\n')
+        with open(file_to_write, mode=file_mode, encoding='utf-8') as f:
+            f.writelines(lines)
+        self.reset_step_variables()
+
+    def record_step_info(self, time_step, step_writer):
+        """Write the arrays with a :py:class:`mann.step_output.StepWriter`,
+        then reset the step variables
+        """
+        step_writer.write_step(time_step, self.num_update, self.state,
+                               self.step_update_status)
+        self.reset_step_variables()
+
+    def sync_to_agents(self):
+        """Copy the arrays back into the agent objects
+        """
+        for idx, agent in enumerate(self.agents):
+            agent.state = int(self.state[idx])
+            agent.num_flipped = int(self.num_flipped[idx])
+            # num_update can only be set to 0 or incremented by 1
+            agent._num_update = int(self.num_update[idx])
+            status = self.step_update_status[idx]
+            agent.step_update_status = None if status == NO_STATUS \
+                else int(status)
+
+
+class WattsCascadeEngine(BinaryEngine):
+    def __init__(self, agents, indptr=None, indices=None):
+        """Event driven threshold_watts engine
+
+        In threshold_watts agents never flip back to 0, so the number of
+        active predecessors of an agent only changes when one of its
+        predecessors flips.  The counts are kept between steps and pushed to
+        the successors of the agents flipped in a step, an agent whose
+        fraction reaches its threshold is marked ready.  A step flips the
+        sampled agents that are ready, so a run costs the edges out of the
+        flipped agents instead of every edge in every step.
+
+        The steps are the same as :py:meth:`BinaryEngine.update_simultaneous`
+        with threshold_watts, including the agents sampled for each step.
+        """
+        super(WattsCascadeEngine, self).__init__(agents, indptr, indices)
+        self.out_indptr, self.out_indices = successor_csr(self.indptr,
+                                                          self.indices)
+        self.counts = self.active_counts().astype(np.int64)
+        self.ready = np.zeros(len(self.agents), dtype=bool)
+        self._mark_ready(np.arange(len(self.agents)))
+
+    def _mark_ready(self, candidates):
+        candidates = candidates[(self.state[candidates] == 0) &
+                                (self.in_degree[candidates] > 0)]
+        reached = self.counts[candidates] / \
+            self.in_degree[candidates].astype(float) >= \
+            self.threshold[candidates]
+        self.ready[candidates[reached]] = True
+
+    def update(self, num_agents_update, update_algorithm='threshold_watts',
+               update_type='simultaneous'):
+        """Run one simultaneous threshold_watts step
+
+        :returns: positions of the agents flipped
+        :rtype: numpy.ndarray
+        """
+        assert isinstance(num_agents_update, int)
+        if update_algorithm != 'threshold_watts' or \
+           update_type != 'simultaneous':
+            raise ValueError('WattsCascadeEngine only runs simultaneous '
+                             'threshold_watts updates')
+        selected = self.sample_agents(num_agents_update)
+        flipped = selected[self.ready[selected]]
+        self.flip(flipped)
+        return flipped
+
+    def flip(self, flipped):
+        """Flip agents to 1 and push the new counts to their successors
+        """
+        self.state[flipped] = 1
+        self.num_update[flipped] += 1
+        self.step_update_status[flipped] = 1
+        self.ready[flipped] = False
+
+        if len(flipped) == 0:
+            return
+        successors = [self.out_indices[self.out_indptr[idx]:
+                                       self.out_indptr[idx + 1]]
+                      for idx in flipped]
+        successors = np.concatenate(successors)
+        np.add.at(self.counts, successors, 1)
+        self._mark_ready(np.unique(successors))
+        logger.debug('Cascade step: {} flipped, {} ready'.
+                     format(len(flipped), np.count_nonzero(self.ready)))
+
+    def is_settled(self):
+        """True when no agent can flip anymore
+        """
+        return not self.ready.any()
+
+    def cascade_size(self):
+        """Number of agents with state 1
+        """
+        return int(np.count_nonzero(self.state))
+
+
+class FrontierScheduler(object):
+    def __init__(self, engine):
+        """Runs a :py:class:`BinaryEngine` re-evaluating only the agents
+        whose inputs changed
+
+        The decision of an agent depends on its state, its num_flipped and
+        the states of its predecessors.  An agent is dirty until it is
+        evaluated without any change, and becomes dirty again when one of
+        these changes.  Sampled agents that are not dirty are skipped, the
+        steps are the same as without the scheduler.  When no agent is
+        dirty the network is at a fixed point, nothing can change anymore
+        (this includes agents stopped by max_flips) and the run stops.
+
+        :param engine: engine to run, its arrays are updated in place
+        :type engine: BinaryEngine
+        """
+        self.engine = engine
+        self.out_indptr, self.out_indices = successor_csr(engine.indptr,
+                                                          engine.indices)
+        self.dirty = engine.in_degree > 0
+        self.stop_step = None
+        self.stop_reason = None
+        self._history = []
+
+    def _mark_changed(self, evaluated, old_state, old_flipped):
+        engine = self.engine
+        changed_state = evaluated[engine.state[evaluated] != old_state]
+        changed_flips = evaluated[engine.num_flipped[evaluated] !=
+                                  old_flipped]
+        self.dirty[evaluated] = False
+        self.dirty[changed_flips] = True
+        self.dirty[changed_state] = True
+        for idx in changed_state:
+            self.dirty[self.out_indices[self.out_indptr[idx]:
+                                        self.out_indptr[idx + 1]]] = True
+        # agents without predecessors are never updated
+        self.dirty &= engine.in_degree > 0
+
+    def update(self, num_agents_update, update_algorithm,
+               update_type='simultaneous'):
+        """Run one step, the same step as :py:meth:`BinaryEngine.update`
+
+        :returns: positions of the agents sampled
+        :rtype: numpy.ndarray
+        """
+        assert isinstance(num_agents_update, int)
+        engine = self.engine
+        selected = engine.sample_agents(num_agents_update)
+        if update_type == 'simultaneous':
+            evaluated = selected[self.dirty[selected]]
+            skipped = selected[~self.dirty[selected]]
+            old_state = engine.state[evaluated].copy()
+            old_flipped = engine.num_flipped[evaluated].copy()
+            engine.update_simultaneous(evaluated, update_algorithm)
+            if update_algorithm == 'threshold_watts_flip':
+                # an agent with state 1 that does not flip gets a new state
+                # of 1, which counts as an update
+                skipped = skipped[(engine.state[skipped] == 1) &
+                                  (engine.in_degree[skipped] > 0)]
+                engine.num_update[skipped] += 1
+            self._mark_changed(evaluated, old_state, old_flipped)
+        elif update_type == 'sequential':
+            for idx in selected:
+                # an earlier agent of the step can make idx clean or dirty,
+                # the mask is read when idx's turn comes
+                if not self.dirty[idx]:
+                    continue
+                evaluated = np.array([idx])
+                old_state = engine.state[evaluated].copy()
+                old_flipped = engine.num_flipped[evaluated].copy()
+                engine.update_sequential(evaluated, update_algorithm)
+                self._mark_changed(evaluated, old_state, old_flipped)
+        else:
+            raise ValueError('Unknown update type')
+        return selected
+
+    def _flip_decision(self, state, counts):
+        """threshold_watts_flip decision of every agent from its own state
+        and its number of active predecessors, agents out of flips or
+        without predecessors do not flip
+        """
+        engine = self.engine
+        degree = engine.in_degree
+        opposite = np.where(state == 1, degree - counts, counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flip = opposite / degree.astype(float) >= engine.threshold
+        return flip & (degree > 0) & (engine.num_flipped < engine.max_flips)
+
+    def _sweep(self, state):
+        """State after a sequential threshold_watts_flip step of every agent
+        from state, None when it depends on the order of the agents
+
+        In a sweep an agent sees each predecessor either before or after
+        its update.  The decision only depends on the number of active
+        predecessors, so it does not depend on the order when it is the
+        same for the fewest and the most active predecessors it can see.
+        """
+        engine = self.engine
+        flip = self._flip_decision(state, engine.active_counts(state))
+        new_state = np.where(flip, 1 - state, state)
+        fewest = engine.active_counts(state & new_state)
+        most = engine.active_counts(state | new_state)
+        if ((self._flip_decision(state, fewest) != flip) |
+                (self._flip_decision(state, most) != flip)).any():
+            return None
+        return new_state
+
+    def _period_2(self, num_agents_update, update_algorithm, update_type):
+        """True when the states repeat every 2 steps from now on
+
+        Only sequential threshold_watts_flip steps can oscillate, the
+        simultaneous steps and threshold_watts only set agents to 1.  Each
+        step is a full sweep of the agents in a new random order, so after
+        the states of the last 3 steps alternate, the next 2 sweeps are
+        checked to give the same states in any order.  The agents that
+        keep flipping need an unlimited max_flips, otherwise num_flipped
+        stops them.
+        """
+        if update_algorithm != 'threshold_watts_flip' or \
+           update_type != 'sequential' or \
+           num_agents_update < len(self.engine) or len(self._history) < 3:
+            return False
+        before, previous, current = self._history[-3:]
+        if not (current == before).all() or (current == previous).all():
+            return False
+        changing = current != previous
+        if not np.isinf(self.engine.max_flips[changing]).all():
+            return False
+        following = self._sweep(current)
+        if following is None or not (following == previous).all():
+            return False
+        after = self._sweep(following)
+        return after is not None and bool((after == current).all())
+
+    def run(self, num_steps, num_agents_update, update_algorithm,
+            update_type='simultaneous', step_file=None):
+        """Run up to num_steps steps, stopping at a fixed point or a period
+        2 oscillation
+
+        The step where the run stopped is kept in stop_step, and the reason
+        ('fixed_point', 'period_2' or 'num_steps') in stop_reason
+
+        :param step_file: when given, the step info of every step is
+            appended to this file, see :py:meth:`BinaryEngine.write_step_info`
+        :type step_file: str
+
+        :returns: step the run stopped at
+        :rtype: int
+        """
+        self._history = []
+        self.stop_reason = 'num_steps'
+        self.stop_step = num_steps - 1
+        for step in range(num_steps):
+            self.update(num_agents_update, update_algorithm, update_type)
+            if step_file is not None:
+                self.engine.write_step_info(step, step_file)
+            self._history = (self._history +
+                             [self.engine.state.copy()])[-3:]
+            if not self.dirty.any():
+                self.stop_reason = 'fixed_point'
+            elif self._period_2(num_agents_update, update_algorithm,
+                                update_type):
+                self.stop_reason = 'period_2'
+            else:
+                continue
+            self.stop_step = step
+            logger.debug('Run stopped at step {}: {}'.
+                         format(step, self.stop_reason))
+            break
+        return self.stop_step
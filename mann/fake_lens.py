@@ -0,0 +1,457 @@
+#! /usr/bin/env python
+"""A scriptable stand-in for LENS
+
+The fake understands the small subset of Tcl and LENS commands that MANN
+scripts and :py:mod:`mann.lens_worker` send to LENS, so the worker pool and
+the agents can be tested and benchmarked on machines without LENS.
+
+Run it the same way as LENS::
+
+    python fake_lens.py -batch UpdateFromInfl.in
+    python fake_lens.py -nogui < commands.tcl
+
+Commands that build or configure the network (addNet, connectGroups, setObj,
+...) are accepted and ignored.  The commands that move data in and out of
+LENS behave as follows:
+
+- loadExamples: reads the ``I:`` / ``B:`` rows of the example file
+- openNetOutputFile / closeNetOutputFile: opens and closes the output file
+- train / test: writes one output record per tick to the open output file,
+  moving the first example row linearly to the mean of all the rows
+- addNet / resetNet: draw the weights of the network from the random number
+  generator, seed reseeds it and deleteNets deletes the networks
+- saveWeights: writes a small text file recording the weights of the current
+  network, the agent environment variables and the loaded examples
+- loadWeights: fails if the weight file does not exist
+
+``--boot-delay`` and ``--command-delay`` simulate the time it takes LENS to
+start the Tcl interpreter and to run a train/test command.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+_VAR_RE = re.compile(r'\$\{(\w+)\}|\$(\w+)(?:\(([^()]*)\))?')
+_EXAMPLE_RE = re.compile(r'^\s*[IB]:\s*(.*?)\s*;?\s*$')
+
+
+class FakeLensError(Exception):
+    '''Raised when a command in the fake LENS interpreter fails'''
+
+
+class _FakeExit(Exception):
+    '''Raised when the exit command is evaluated'''
+
+
+class _FakeReturn(Exception):
+    '''Raised when exit is evaluated after the worker has redefined it'''
+
+
+def _matching(text, start, open_char, close_char):
+    """Returns the index of the character that closes text[start]
+    """
+    depth = 0
+    for idx in range(start, len(text)):
+        if text[idx] == open_char:
+            depth += 1
+        elif text[idx] == close_char:
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise FakeLensError('unbalanced {} in: {}'.format(open_char, text))
+
+
+def split_commands(script):
+    """Split a script into complete commands
+
+    Commands are separated by newlines or semicolons outside of braces,
+    commands spanning several lines (braces left open) are kept together.
+    Comments and blank commands are dropped.
+
+    :param script: Tcl script text
+    :type script: str
+
+    :returns: list of command strings
+    :rtype: list
+    """
+    commands = []
+    current = []
+    depth = 0
+    in_quotes = False
+    in_comment = False
+    for char in script:
+        if in_comment:
+            in_comment = char != '\n'
+            continue
+        if char == '#' and depth <= 0 and ''.join(current).strip() == '':
+            in_comment = True
+            continue
+        if char in '{[' and not in_quotes:
+            depth += 1
+        elif char in '}]' and not in_quotes:
+            depth -= 1
+        elif char == '"' and depth == 0:
+            in_quotes = not in_quotes
+        if char in '\n;' and depth <= 0 and not in_quotes:
+            commands.append(''.join(current).strip())
+            current = []
+            depth = 0
+        else:
+            current.append(char)
+    commands.append(''.join(current).strip())
+    return [c for c in commands if c != '']
+
+
+def read_example_rows(file_path):
+    """Returns the input rows of a LENS .ex file as lists of floats
+    """
+    rows = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            match = _EXAMPLE_RE.match(line)
+            if match:
+                rows.append([float(x) for x in match.group(1).split()])
+    return rows
+
+
+class FakeLens(object):
+    def __init__(self, env=None, ticks=9, command_delay=0.0,
+                 stdout=sys.stdout):
+        """
+        :param env: environment variables visible as $env(...)
+        :type env: dict
+
+        :param ticks: number of ticks written for each train/test
+        :type ticks: int
+
+        :param command_delay: seconds each train/test command sleeps
+        :type command_delay: float
+        """
+        self.env = dict(os.environ if env is None else env)
+        self.variables = {}
+        self.ticks = ticks
+        self.command_delay = command_delay
+        self.stdout = stdout
+        self.exit_returns = False
+        self.examples = []
+        self.examples_path = None
+        # like LENS, the generator is seeded from the clock until seed runs
+        self.random = random.Random()
+        self.nets = {}
+        self.net = None
+        self.out_file = None
+
+    def _substitute(self, word):
+        def replace(match):
+            if match.group(1) is not None:
+                return self._get_variable(match.group(1))
+            if match.group(3) is not None:
+                index = self._substitute(match.group(3))
+                return self._get_variable(match.group(2), index)
+            return self._get_variable(match.group(2))
+        return _VAR_RE.sub(replace, word)
+
+    def _get_variable(self, name, index=None):
+        name = name.lstrip(':')
+        if index is None:
+            try:
+                return self.variables[name]
+            except KeyError:
+                raise FakeLensError('can\'t read "{}"'.format(name))
+        if name == 'env':
+            try:
+                return self.env[index]
+            except KeyError:
+                raise FakeLensError('can\'t read "env({})"'.format(index))
+        try:
+            return self.variables['{}({})'.format(name, index)]
+        except KeyError:
+            raise FakeLensError('can\'t read "{}({})"'.format(name, index))
+
+    def _set_variable(self, name, value):
+        name = self._substitute(name.lstrip(':'))
+        match = re.match(r'^:*env\((.*)\)$', name)
+        if match:
+            self.env[match.group(1)] = value
+        else:
+            self.variables[name] = value
+
+    def words(self, command):
+        """Split a single command into its words, applying substitutions
+        """
+        words = []
+        idx = 0
+        while idx < len(command):
+            char = command[idx]
+            if char.isspace():
+                idx += 1
+            elif char == '{':
+                end = _matching(command, idx, '{', '}')
+                words.append(command[idx + 1:end])
+                idx = end + 1
+            elif char == '[':
+                end = _matching(command, idx, '[', ']')
+                words.append(self.evaluate(command[idx + 1:end]))
+                idx = end + 1
+            elif char == '"':
+                end = command.index('"', idx + 1)
+                words.append(self._substitute(command[idx + 1:end]))
+                idx = end + 1
+            else:
+                end = idx
+                while end < len(command) and not command[end].isspace():
+                    end += 1
+                words.append(self._substitute(command[idx:end]))
+                idx = end
+        return words
+
+    def run_script(self, script):
+        """Evaluates every command in a script, returns the last result
+        """
+        result = ''
+        for command in split_commands(script):
+            result = self.evaluate(command)
+        return result
+
+    def evaluate(self, command):
+        """Evaluate a single command and return its result as a string
+        """
+        words = self.words(command)
+        if not words:
+            return ''
+        name, args = words[0], words[1:]
+        handler = getattr(self, '_cmd_' + name, None)
+        if handler is None:
+            # network building and configuration commands are accepted
+            return ''
+        return handler(*args)
+
+    def _cmd_set(self, name, *value):
+        if value:
+            self._set_variable(name, value[0])
+            return value[0]
+        return self._get_variable(name)
+
+    def _cmd_unset(self, *names):
+        for name in names:
+            if name == '-nocomplain':
+                continue
+            name = self._substitute(name.lstrip(':'))
+            match = re.match(r'^:*env\((.*)\)$', name)
+            if match:
+                self.env.pop(match.group(1), None)
+            else:
+                self.variables.pop(name, None)
+        return ''
+
+    def _cmd_puts(self, *args):
+        end = '' if '-nonewline' in args else '\n'
+        self.stdout.write(args[-1] + end)
+        return ''
+
+    def _cmd_flush(self, *args):
+        self.stdout.flush()
+        return ''
+
+    def _cmd_cd(self, path):
+        os.chdir(path)
+        return ''
+
+    def _cmd_rename(self, old, new):
+        if old == 'exit':
+            self.exit_returns = True
+        return ''
+
+    def _cmd_proc(self, *args):
+        return ''
+
+    def _cmd_exit(self, *args):
+        if self.exit_returns:
+            raise _FakeReturn()
+        raise _FakeExit()
+
+    def _cmd_source(self, path):
+        if not os.path.exists(path):
+            raise FakeLensError(
+                'couldn\'t read file "{}": no such file'.format(path))
+        with open(path, 'r') as f:
+            script = f.read()
+        try:
+            return self.run_script(script)
+        except _FakeReturn:
+            return ''
+
+    def _cmd_catch(self, body, *result_var):
+        try:
+            result = self.run_script(body)
+            status = '0'
+        except FakeLensError as e:
+            result = str(e)
+            status = '1'
+        if result_var:
+            self._set_variable(result_var[0], result)
+        return status
+
+    def _cmd_if(self, condition, body, *args):
+        if self._substitute(condition).strip() not in ('', '0'):
+            return self.run_script(body)
+        return ''
+
+    def _cmd_foreach(self, names, values, body):
+        names = names.split()
+        values = values.split()
+        for start in range(0, len(values), len(names)):
+            for offset, name in enumerate(names):
+                self._set_variable(name, values[start + offset])
+            self.run_script(body)
+        return ''
+
+    def _cmd_loadExamples(self, path, *args):
+        if not os.path.exists(path):
+            raise FakeLensError(
+                'couldn\'t read examples "{}"'.format(path))
+        self.examples = read_example_rows(path)
+        self.examples_path = path
+        return ''
+
+    def _cmd_loadWeights(self, path, *args):
+        if not os.path.exists(path):
+            raise FakeLensError('couldn\'t read weights "{}"'.format(path))
+        return ''
+
+    def _cmd_seed(self, *value):
+        self.random.seed(int(value[0]) if value else None)
+        return ''
+
+    def _random_weights(self):
+        return [self.random.uniform(-1, 1) for _ in range(4)]
+
+    def _cmd_addNet(self, name, *args):
+        self.nets[name] = self._random_weights()
+        self.net = name
+        return ''
+
+    def _cmd_resetNet(self, *args):
+        if self.net is None:
+            raise FakeLensError('there is no current network')
+        self.nets[self.net] = self._random_weights()
+        return ''
+
+    def _cmd_deleteNets(self, *names):
+        for name in names:
+            if name == '*':
+                self.nets.clear()
+            else:
+                self.nets.pop(name, None)
+        if self.net not in self.nets:
+            self.net = None
+        return ''
+
+    def _cmd_saveWeights(self, path, *args):
+        with open(path, 'w') as f:
+            f.write('fake lens weights\n')
+            if self.net is not None:
+                f.write('net {} {}\n'.format(self.net, ' '.join(
+                    repr(weight) for weight in self.nets[self.net])))
+            for key in ('a', 'bm', 'bs', 'wm', 'ws', 'cs', 'c'):
+                if key in self.env:
+                    f.write('{} {}\n'.format(key, self.env[key]))
+            for row in self.examples:
+                f.write(' '.join(str(x) for x in row) + '\n')
+        return ''
+
+    def _cmd_openNetOutputFile(self, path, *args):
+        mode = 'a' if '-append' in args else 'w'
+        self.out_file = open(path, mode)
+        return ''
+
+    def _cmd_closeNetOutputFile(self, *args):
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+        return ''
+
+    def _cmd_train(self, *args):
+        return self._run_examples()
+
+    def _cmd_test(self, *args):
+        return self._run_examples()
+
+    def _run_examples(self):
+        if self.command_delay:
+            time.sleep(self.command_delay)
+        if self.out_file is None or not self.examples:
+            return ''
+        first = self.examples[0]
+        num_rows = len(self.examples)
+        mean = [sum(column) / num_rows for column in zip(*self.examples)]
+        per_bank = len(first) // 2
+        self.out_file.write('{} 0\n'.format(len(first)))
+        for tick in range(self.ticks + 1):
+            fraction = tick / float(self.ticks)
+            values = [f + (m - f) * fraction for f, m in zip(first, mean)]
+            self.out_file.write('{} 0\n'.format(tick))
+            for bank in (values[:per_bank], values[per_bank:]):
+                self.out_file.write('{} 0\n'.format(len(bank)))
+                for value in bank:
+                    self.out_file.write('{:g}\n'.format(value))
+        return ''
+
+
+def run_interactive(lens, stdin):
+    """Read commands from stdin until EOF or exit, like `lens -nogui`
+    """
+    buffered = []
+    depth = 0
+    for line in stdin:
+        buffered.append(line)
+        depth += line.count('{') - line.count('}')
+        if depth > 0:
+            continue
+        script = ''.join(buffered)
+        buffered = []
+        depth = 0
+        for command in split_commands(script):
+            try:
+                lens.evaluate(command)
+            except (_FakeExit, _FakeReturn):
+                return 0
+            except FakeLensError as e:
+                sys.stderr.write('Error: {}\n'.format(e))
+        lens.stdout.flush()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-batch', dest='batch_file', default=None)
+    parser.add_argument('-nogui', action='store_true')
+    parser.add_argument('--boot-delay', type=float, default=0.0)
+    parser.add_argument('--command-delay', type=float, default=0.0)
+    parser.add_argument('--ticks', type=int, default=9)
+    args = parser.parse_args(argv)
+
+    if args.boot_delay:
+        time.sleep(args.boot_delay)
+    lens = FakeLens(ticks=args.ticks, command_delay=args.command_delay)
+
+    if args.batch_file is None:
+        return run_interactive(lens, sys.stdin)
+    try:
+        lens._cmd_source(args.batch_file)
+    except _FakeExit:
+        pass
+    except FakeLensError as e:
+        sys.stderr.write('Error: {}\n'.format(e))
+        return 1
+    finally:
+        lens._cmd_closeNetOutputFile()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#! /usr/bin/env python
+"""Compact integer indexed directed multigraph
+
+The networks of :py:class:`mann.network_agent.NetworkAgent` are networkx
+MultiDiGraphs with the agent objects as nodes, every lookup hashes an agent
+and every edge is a python dict.  A :py:class:`CompactGraph` numbers the
+nodes 0 to n - 1 and keeps the distinct edges twice, once grouped by target
+(in-edges) and once grouped by source (out-edges), in compressed sparse row
+(CSR) arrays of int32 node ids.  Parallel edges are stored once with their
+multiplicity.  The predecessors of a node are a slice of the in-edge array,
+:py:class:`NodeSequence` hands them out as node objects.
+
+Within a row the neighbours are in the order their first edge was added,
+the same order networkx gives for `G.predecessors` and `G.successors` of a
+graph built from the same edge list.  The order the distinct edges were
+first added in is kept as well, :py:meth:`CompactGraph.edges` and the graphs
+built from them list the edges in that order.
+"""
+
+import collections.abc
+import logging
+
+import networkx as nx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NODE_DTYPE = np.int32
+
+
+def _grouped_csr(num_nodes, rows, cols, first_seen):
+    """CSR of the (rows, cols) edges, each row ordered by first_seen
+    """
+    order = np.lexsort((first_seen, rows))
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=num_nodes))
+    return (indptr, order)
+
+
+class NodeSequence(collections.abc.Sequence):
+    __slots__ = ('_nodes', '_indices')
+
+    def __init__(self, nodes, indices):
+        """Read only sequence of the nodes at an array of positions, e.g.
+        the predecessors of a node from :py:meth:`CompactGraph.predecessors`,
+        without a list of its own
+
+        :param nodes: node objects, node i is nodes[i]
+        :type nodes: list
+
+        :param indices: positions of the nodes in the sequence
+        :type indices: numpy.ndarray
+        """
+        self._nodes = nodes
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._nodes[node] for node in self._indices[idx].tolist()]
+        return self._nodes[int(self._indices[idx])]
+
+    def __iter__(self):
+        nodes = self._nodes
+        for node in self._indices.tolist():
+            yield nodes[node]
+
+    def __repr__(self):
+        return 'NodeSequence({!r})'.format(list(self))
+
+
+class CompactGraph(object):
+    def __init__(self, num_nodes, sources, targets):
+        """Directed multigraph on the nodes 0 to num_nodes - 1
+
+        :param num_nodes: number of nodes
+        :type num_nodes: int
+
+        :param sources: source node of every edge
+        :type sources: numpy.ndarray
+
+        :param targets: target node of every edge, same length as sources
+        :type targets: numpy.ndarray
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        assert sources.shape == targets.shape,\
+            'sources and targets need to be the same length'
+        if len(sources) > 0 and \
+           (min(sources.min(), targets.min()) < 0 or
+                max(sources.max(), targets.max()) >= num_nodes):
+            raise ValueError('Edge node not in 0 to {}'.format(num_nodes - 1))
+        self.num_nodes = num_nodes
+
+        keys, first_seen, multiplicity = np.unique(
+            sources * num_nodes + targets, return_index=True,
+            return_counts=True)
+        edge_sources = keys // num_nodes if num_nodes else keys
+        edge_targets = keys % num_nodes if num_nodes else keys
+
+        self.in_indptr, order = _grouped_csr(num_nodes, edge_targets,
+                                             edge_sources, first_seen)
+        self.in_indices = edge_sources[order].astype(NODE_DTYPE)
+        self.in_multiplicity = multiplicity[order].astype(np.int32)
+
+        self.out_indptr, order = _grouped_csr(num_nodes, edge_sources,
+                                              edge_targets, first_seen)
+        self.out_indices = edge_targets[order].astype(NODE_DTYPE)
+        self.out_multiplicity = multiplicity[order].astype(np.int32)
+        # positions of the out-edges in the order they were first added
+        self.out_edge_order = np.argsort(first_seen[order], kind='stable')
+
+    @classmethod
+    def from_edge_list(cls, num_nodes, edge_list, add_reverse_edge=False):
+        """Graph of an edge list of (u, v) node pairs
+
+        :param add_reverse_edge: add a (v, u) edge after every (u, v) edge
+        :type add_reverse_edge: bool
+        """
+        edges = np.array(list(edge_list), dtype=np.int64).reshape(-1, 2)
+        if add_reverse_edge:
+            edges = np.stack([edges, edges[:, ::-1]], axis=1).reshape(-1, 2)
+        return cls(num_nodes, edges[:, 0], edges[:, 1])
+
+    @classmethod
+    def from_networkx(cls, G):
+        """Graph of a networkx graph, node i is `list(G.nodes())[i]`
+
+        Undirected graphs get an edge in both directions
+
+        :returns: the graph and the list of networkx nodes
+        :rtype: tuple
+        """
+        nodes = list(G.nodes())
+        position = dict((node, idx) for idx, node in enumerate(nodes))
+        edges = []
+        for u, v in G.edges():
+            edges.append((position[u], position[v]))
+            if not G.is_directed():
+                edges.append((position[v], position[u]))
+        return (cls.from_edge_list(len(nodes), edges), nodes)
+
+    def to_networkx(self, nodes=None):
+        """MultiDiGraph with every edge repeated by its multiplicity
+
+        :param nodes: objects used as the nodes, node i is nodes[i], the
+            integers 0 to n - 1 when None
+        :type nodes: list
+
+        :rtype: networkx.MultiDiGraph
+        """
+        if nodes is None:
+            nodes = range(self.num_nodes)
+        nodes = list(nodes)
+        assert len(nodes) == self.num_nodes
+        G = nx.MultiDiGraph()
+        G.add_nodes_from(nodes)
+        for u, v, multiplicity in self.edges():
+            for _ in range(multiplicity):
+                G.add_edge(nodes[u], nodes[v])
+        return G
+
+    def __len__(self):
+        return self.num_nodes
+
+    @property
+    def num_edges(self):
+        """Number of edges, counting parallel edges
+        """
+        return int(self.in_multiplicity.sum())
+
+    @property
+    def num_distinct_edges(self):
+        return len(self.in_indices)
+
+    @property
+    def in_degree(self):
+        """Number of distinct predecessors of every node
+        """
+        return np.diff(self.in_indptr)
+
+    @property
+    def out_degree(self):
+        """Number of distinct successors of every node
+        """
+        return np.diff(self.out_indptr)
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays
+        """
+        return sum(array.nbytes for array in
+                   [self.in_indptr, self.in_indices, self.in_multiplicity,
+                    self.out_indptr, self.out_indices,
+                    self.out_multiplicity, self.out_edge_order])
+
+    def predecessors(self, node):
+        """Distinct predecessors of node, a view into the in-edge array
+
+        :rtype: numpy.ndarray
+        """
+        return self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]
+
+    def successors(self, node):
+        """Distinct successors of node, a view into the out-edge array
+
+        :rtype: numpy.ndarray
+        """
+        return self.out_indices[self.out_indptr[node]:
+                                self.out_indptr[node + 1]]
+
+    def _ordered_edges(self):
+        """Source, target and multiplicity of the distinct edges, in the
+        order they were first added
+        """
+        sources = np.repeat(np.arange(self.num_nodes, dtype=NODE_DTYPE),
+                            self.out_degree)
+        order = self.out_edge_order
+        return (sources[order], self.out_indices[order],
+                self.out_multiplicity[order])
+
+    def edge_arrays(self):
+        """Returns the source and target arrays of every edge, in the order
+        the distinct edges were first added, parallel edges repeated next
+        to each other
+
+        :rtype: tuple
+        """
+        sources, targets, multiplicity = self._ordered_edges()
+        return (np.repeat(sources, multiplicity),
+                np.repeat(targets, multiplicity))
+
+    def with_reverse_edges(self):
+        """Graph with a (v, u) edge added after every (u, v) edge, the
+        same as the add_reverse_edge option of :py:meth:`from_edge_list`
+        on the edge list the graph was built from, the neighbours are in
+        the same order
+
+        :rtype: CompactGraph
+        """
+        sources, targets = self.edge_arrays()
+        return CompactGraph(
+            self.num_nodes,
+            np.stack([sources, targets], axis=1).ravel(),
+            np.stack([targets, sources], axis=1).ravel())
+
+    def edges(self):
+        """Distinct (u, v, multiplicity) edges, in the order they were
+        first added
+
+        :rtype: iterator
+        """
+        sources, targets, multiplicity = self._ordered_edges()
+        return zip(sources.tolist(), targets.tolist(),
+                   multiplicity.tolist())
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+"""Cache of LENS update results
+
+Once :py:meth:`create_weight_file` has run, the weights of an agent do not
+change, so LENS always returns the same new state for the same weights,
+.ex file and bm/bs/wm/ws/cs environment.  Agent states are binary or take a
+few values, so the same inputs come up again and again over a simulation.
+:py:class:`LensResultCache` keeps the results of recent LENS calls so a
+repeated update can skip the subprocess.
+"""
+
+import collections
+import hashlib
+import threading
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+# environment variables that change what the LENS update computes, the agent
+# number 'a' only selects the weight file, which is hashed instead
+RESULT_ENV_KEYS = ('bm', 'bs', 'wm', 'ws', 'cs')
+
+
+def file_digest(file_path, block_size=65536):
+    """Returns the sha1 hex digest of the contents of a file
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LensResultCache(object):
+    def __init__(self, maxsize=4096):
+        """Least recently used cache of LENS results
+
+        :param maxsize: number of results kept before the least recently
+            used result is evicted
+        :type maxsize: int
+        """
+        assert maxsize > 0, 'maxsize needs to be greater than 0'
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    @staticmethod
+    def make_key(weight_digest, ex_payload, lens_env):
+        """Returns the cache key of a LENS update
+
+        :param weight_digest: digest of the agent's weight file,
+            see :py:func:`file_digest`
+        :type weight_digest: str
+
+        :param ex_payload: exact contents of the .ex file
+        :type ex_payload: str
+
+        :param lens_env: environment passed to LENS, only the
+            :py:data:`RESULT_ENV_KEYS` are part of the key
+        :type lens_env: dict
+
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+        digest.update(str(weight_digest).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(ex_payload.encode('utf-8'))
+        for env_key in RESULT_ENV_KEYS:
+            digest.update('\0{}={}'.format(
+                env_key, lens_env.get(env_key)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached result for key, None if it is not cached
+        """
+        with self._lock:
+            try:
+                result = self._results[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return list(result)
+
+    def put(self, key, result):
+        """Cache a result, evicting the least recently used result if full
+        """
+        with self._lock:
+            self._results[key] = tuple(result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._results))
@@ -71,3 +71,143 @@ class LensInWriterHelper(object):
         """
         with open(file_dir, 'w') as f:
             f.write(string)
+
+    def generate_state_file_reader(self, pos_group='Input',
+                                   neg_group='InputMirror'):
+        """Generate the .in file lines that set the unit outputs from the
+        state file written by :py:meth:`mann.agent.LensAgent.write_state_file`
+
+        Replaces the per unit $env(p$u) and $env(n$u) variables, the path of
+        the state file is passed in as $env(state_file)
+
+        :param pos_group: LENS group of the positive bank
+        :type pos_group: str
+
+        :param neg_group: LENS group of the negative bank
+        :type neg_group: str
+
+        :returns: lines of a .in file
+        :rtype: str
+        """
+        string = ("set state_file [open $env(state_file)]\n"
+                  "set pos_values [gets $state_file]\n"
+                  "set neg_values [gets $state_file]\n"
+                  "close $state_file\n"
+                  "repeat u [getObj {pos}.numUnits] {{\n"
+                  "   setObj {pos}:$u.output [lindex $pos_values $u]\n"
+                  "}}\n"
+                  "repeat u [getObj {neg}.numUnits] {{\n"
+                  "   setObj {neg}:$u.output [lindex $neg_values $u]\n"
+                  "}}\n").format(pos=pos_group, neg=neg_group)
+        return(string)
+
+    def generate_final_tick_output(self, pos_group='Input',
+                                   neg_group='InputMirror',
+                                   out_file='$env(out_file)'):
+        """Generate the .in file lines that write only the unit outputs at
+        the end of the update, instead of every tick written by
+        openNetOutputFile
+
+        The file has the layout of the last tick of a .out file, so it is
+        read by :py:func:`mann.lens_output.read_final_state`.  The lines go
+        after the update is run, e.g. after `test`
+
+        :param out_file: path of the file to write, by default the path in
+            $env(out_file)
+        :type out_file: str
+
+        :returns: lines of a .in file
+        :rtype: str
+        """
+        string = ("set out [open {out} w]\n"
+                  "puts $out \"0 0\"\n"
+                  "foreach group {{{pos} {neg}}} {{\n"
+                  "   puts $out \"[getObj $group.numUnits] 0\"\n"
+                  "   repeat u [getObj $group.numUnits] {{\n"
+                  "      puts $out [getObj $group:$u.output]\n"
+                  "   }}\n"
+                  "}}\n"
+                  "close $out\n").format(out=out_file, pos=pos_group,
+                                         neg=neg_group)
+        return(string)
+
+    def generate_step_script(self, update_in_file, agent_runs):
+        """Generate a .in file that updates several agents in one LENS
+        process
+
+        The update .in file is sourced once for every agent, with the a,
+        ex_file and out_file environment variables set to the agent's
+        values, so it needs to read its examples from $env(ex_file) and
+        write its outputs to $env(out_file).  exit is redefined so the exit
+        at the end of the update .in file only stops that agent's update.
+
+        :param update_in_file: path of the .in file that updates one agent
+        :type update_in_file: str
+
+        :param agent_runs: padded agent id, .ex file path and .out file path
+            of every agent to update, in update order
+        :type agent_runs: list
+
+        :returns: contents of the .in file
+        :rtype: str
+        """
+        return(self.generate_source_script(
+            update_in_file,
+            [{'a': agent_id_str, 'ex_file': ex_file, 'out_file': out_file}
+             for agent_id_str, ex_file, out_file in agent_runs]))
+
+    def generate_weight_training_script(self, weight_in_file, agent_runs):
+        """Generate a .in file that trains the weights of several agents
+        in one LENS process
+
+        The weight .in file is sourced once for every agent with the a,
+        ex_file and seed environment variables set to the agent's values.
+        It needs to train on $env(ex_file) and save the weights to
+        AgentWgt$env(a).wt.  Each agent starts the way it would in its own
+        `lens -batch` process: `deleteNets *` removes the network of the
+        previous agent and the variables of the previous agent are unset, so
+        a weight .in file that seeds with $env(seed) trains the same weights
+        as :py:meth:`mann.agent_lens_recurrent.LensAgentRecurrent.create_weight_file`
+
+        :param weight_in_file: path of the .in file that trains one agent
+        :type weight_in_file: str
+
+        :param agent_runs: environment of every agent, a dict with 'a',
+            'ex_file' and optionally 'seed'
+        :type agent_runs: list
+
+        :returns: contents of the .in file
+        :rtype: str
+        """
+        return(self.generate_source_script(
+            weight_in_file, agent_runs,
+            setup=lambda agent_env: ['deleteNets *']))
+
+    def generate_source_script(self, in_file, agent_envs, setup=None):
+        """Generate a .in file that sources in_file once per agent, after
+        setting the environment variables in the agent's dict
+
+        The variables of the previous agent that are not in the agent's dict
+        are unset.  exit is redefined so the exit at the end of in_file only
+        stops that agent's run, the real exit runs at the end of the script
+
+        :param setup: function of an agent's dict returning the Tcl lines
+            run before its source
+        :type setup: function
+
+        :rtype: str
+        """
+        lines = ['rename exit _mann_exit',
+                 'proc exit {args} {return -code return}']
+        previous_env = {}
+        for agent_env in agent_envs:
+            for key in sorted(set(previous_env) - set(agent_env)):
+                lines.append('unset -nocomplain env({})'.format(key))
+            for key in sorted(agent_env):
+                lines.append('set env({}) {{{}}}'.format(key, agent_env[key]))
+            if setup is not None:
+                lines.extend(setup(agent_env))
+            lines.append('source {{{}}}'.format(in_file))
+            previous_env = agent_env
+        lines.append('_mann_exit')
+        return('\n'.join(lines) + '\n')
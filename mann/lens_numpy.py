@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+"""NumPy implementation of the LENS recurrent attitude network
+
+The recurrent attitude network has a positive and a negative bank of
+processing units.  Every unit is connected to all the other units of its own
+bank (within-bank weights) and to the unit with the same index in the other
+bank (between-bank weights).  Weights are drawn from normal distributions
+with the `between_mean/between_sd/within_mean/within_sd` parameters that are
+passed to LENS as the bm/bs/wm/ws environment variables.
+
+Settling follows a LENS CONTINUOUS network with SOFT_CLAMP inputs: the net
+input of each unit is integrated over ticks with step size `dt`, the output
+is the logistic of the integrated input, and the output is then pulled
+towards the external input by `clamp_strength` (the cs variable).  The
+examples of an update (the agent's own state followed by the predecessors
+picked) are presented in order without resetting the network, and the new
+state is the output after the last tick of the last example.
+"""
+
+import numpy as np
+
+# LENS networks in MANN are built with `-i 3.0 -t 3`:
+# 3 intervals of 3 ticks each
+DEFAULT_TICKS = 9
+DEFAULT_DT = 1.0 / 3
+
+
+def logistic(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def create_weights(num_units_per_bank, between_mean, between_sd,
+                   within_mean, within_sd, random_state=None):
+    """Draw the weights of a recurrent attitude network
+
+    :param num_units_per_bank: number of units in each bank
+    :type num_units_per_bank: int
+
+    :param random_state: seed or RandomState used to draw the weights, the
+        global numpy.random state is used when None
+    :type random_state: int
+
+    :returns: weight matrix, weights[target, source], positive bank units
+        first, then the negative bank units
+    :rtype: numpy.ndarray
+    """
+    if random_state is None:
+        rng = np.random
+    elif isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    n = num_units_per_bank
+    weights = np.zeros((2 * n, 2 * n))
+
+    within = rng.normal(within_mean, within_sd, size=(2, n, n))
+    weights[:n, :n] = within[0]
+    weights[n:, n:] = within[1]
+    # no self connections
+    np.fill_diagonal(weights, 0.0)
+
+    between = rng.normal(between_mean, between_sd, size=(2, n))
+    units = np.arange(n)
+    weights[units, n + units] = between[0]
+    weights[n + units, units] = between[1]
+    return weights
+
+
+def settle(weights, inputs, clamp_strength,
+           ticks=DEFAULT_TICKS, dt=DEFAULT_DT):
+    """Settle the network on a sequence of examples
+
+    :param weights: weight matrix from :py:func:`create_weights`
+    :type weights: numpy.ndarray
+
+    :param inputs: one row per example, in the order they are presented
+    :type inputs: numpy.ndarray
+
+    :param clamp_strength: soft clamp strength, between 0 and 1
+    :type clamp_strength: float
+
+    :param ticks: number of ticks each example is presented for
+    :type ticks: int
+
+    :param dt: integration step size
+    :type dt: float
+
+    :returns: unit outputs after the last tick
+    :rtype: numpy.ndarray
+    """
+    inputs = np.atleast_2d(np.asarray(inputs, dtype=float))
+    net_input = np.zeros(weights.shape[0])
+    output = logistic(net_input)
+    for external in inputs:
+        for _ in range(ticks):
+            net_input += dt * (weights.dot(output) - net_input)
+            output = logistic(net_input)
+            output += clamp_strength * (external - output)
+    return output
+
+
+def settle_batch(weights, inputs, clamp_strength, mask=None,
+                 ticks=DEFAULT_TICKS, dt=DEFAULT_DT):
+    """Settle the networks of many agents at once
+
+    Same as :py:func:`settle`, but every tick is a single stacked matrix
+    product over all the agents.
+
+    :param weights: stacked weight matrices, shape (agents, units, units)
+    :type weights: numpy.ndarray
+
+    :param inputs: examples of each agent, shape (agents, examples, units)
+    :type inputs: numpy.ndarray
+
+    :param clamp_strength: soft clamp strength, between 0 and 1
+    :type clamp_strength: float
+
+    :param mask: shape (agents, examples), False marks padding for agents
+        with fewer examples, padded examples leave the agent unchanged
+    :type mask: numpy.ndarray
+
+    :returns: unit outputs after the last tick, shape (agents, units)
+    :rtype: numpy.ndarray
+    """
+    weights = np.asarray(weights, dtype=float)
+    inputs = np.asarray(inputs, dtype=float)
+    num_agents, num_examples, num_units = inputs.shape
+    net_input = np.zeros((num_agents, num_units))
+    output = logistic(net_input)
+    for example in range(num_examples):
+        external = inputs[:, example, :]
+        if mask is None:
+            presented = None
+        else:
+            presented = np.asarray(mask)[:, example, np.newaxis]
+        for _ in range(ticks):
+            net = np.matmul(weights, output[:, :, np.newaxis])[:, :, 0]
+            new_net_input = net_input + dt * (net - net_input)
+            new_output = logistic(new_net_input)
+            new_output += clamp_strength * (external - new_output)
+            if presented is None:
+                net_input, output = new_net_input, new_output
+            else:
+                net_input = np.where(presented, new_net_input, net_input)
+                output = np.where(presented, new_output, output)
+    return output
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+"""Read the final unit outputs from a LENS .out file
+
+LENS appends every tick of an update to the .out file, but only the last
+tick is used as the new agent state.  The functions here read the end of the
+file only, instead of reading the whole file to count its lines.
+
+The last tick of the file looks like this, for 3 units per bank::
+
+    8 0
+    3 0
+    0.61
+    0.59
+    0.62
+    3 0
+    0.58
+    0.57
+    0.56
+"""
+
+import io
+
+import numpy
+
+
+def tail_lines(file_path, num_lines, block_size=4096):
+    """Returns the last num_lines lines of a file
+
+    The file is read backwards from the end in blocks of block_size bytes,
+    until enough lines have been read
+
+    :rtype: list
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(0, io.SEEK_END)
+        position = f.tell()
+        data = b''
+        # one more newline than lines wanted, the file ends with a newline
+        while position > 0 and data.count(b'\n') <= num_lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.decode('utf-8').splitlines()
+    return lines[-num_lines:]
+
+
+def read_final_state(file_path, num_processing_units):
+    """Returns the positive and negative bank outputs of the last tick
+
+    :param file_path: path of the LENS .out file
+    :type file_path: str
+
+    :param num_processing_units: units in both banks
+    :type num_processing_units: int
+
+    :rtype: numpy.ndarray
+    """
+    assert num_processing_units % 2 == 0, 'num_processing_unts not even'
+    per_bank = num_processing_units // 2
+    lines = tail_lines(file_path, num_processing_units + 1)
+    if len(lines) != num_processing_units + 1:
+        raise ValueError('{} is too short for {} units'.
+                         format(file_path, num_processing_units))
+    values = lines[:per_bank] + lines[per_bank + 1:]
+    return numpy.array(values, dtype=float)
+
@@ -0,0 +1,364 @@
+#! /usr/bin/env python
+"""Long-lived LENS processes that agents send commands to over a pipe
+
+Starting `lens -batch` boots a new Tcl interpreter for every agent update.
+A :py:class:`LensWorker` starts LENS once (`lens -nogui`) and then writes Tcl
+commands to its stdin, reading its stdout until a sentinel line is printed.
+The network is built once per worker and an agent update only loads the
+agent weights and examples into it, see :py:meth:`LensWorker.update`.
+A :py:class:`LensWorkerPool` hands out idle workers to callers, so several
+threads can use LENS at the same time.  A worker that does not print the
+sentinel within its timeout is killed.
+
+Set the command to :py:data:`FAKE_LENS_COMMAND` to use the
+:py:mod:`mann.fake_lens` stand-in on machines without LENS.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import mann.agent
+
+logger = logging.getLogger(__name__)
+
+LENS_COMMAND = ('lens',)
+FAKE_LENS_COMMAND = (sys.executable,
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'fake_lens.py'))
+
+# scripts written for `lens -batch` end with `exit`, in a worker that would
+# kill the interpreter, so exit is redefined to stop the script being sourced
+_BOOT_COMMANDS = ('rename exit _mann_exit',
+                  'proc exit {args} {return -code return}')
+
+_SENTINEL = '__MANN_LENS_DONE__'
+
+# seconds a worker gets to finish the commands of one send
+DEFAULT_TIMEOUT = 600
+
+
+class LensWorkerError(mann.agent.Error):
+    '''Raised when a LENS worker dies or a command sent to it fails'''
+
+
+def tcl_quote(value):
+    """Return value as a brace quoted Tcl word
+    """
+    return '{' + str(value) + '}'
+
+
+class LensWorker(object):
+    def __init__(self, lens_command=LENS_COMMAND, cwd=None,
+                 network_in_file=None, timeout=DEFAULT_TIMEOUT):
+        """Start a LENS process that reads commands from stdin
+
+        :param lens_command: command used to start LENS, without arguments
+        :type lens_command: tuple
+
+        :param cwd: working directory of the LENS process, relative paths in
+            the .in files are relative to this directory
+        :type cwd: str
+
+        :param network_in_file: optional .in file that builds the network,
+            sourced once when the worker starts, see :py:meth:`load_network`
+        :type network_in_file: str
+
+        :param timeout: seconds to wait for the commands of a
+            :py:meth:`send`, the worker is killed when they take longer, None
+            waits forever
+        :type timeout: float
+        """
+        self.lens_command = tuple(lens_command)
+        self.cwd = cwd
+        self.env = {}
+        self.network_in_file = None
+        self.timeout = timeout
+        self._call_count = itertools.count()
+        self.process = subprocess.Popen(
+            list(self.lens_command) + ['-nogui'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            cwd=cwd, env=mann.agent.get_base_lens_env(),
+            universal_newlines=True, bufsize=1)
+        logger.debug('Started LENS worker pid {}'.format(self.process.pid))
+        # readline can not time out, a thread reads stdout into a queue and
+        # _read_until waits on the queue with a deadline
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_stdout)
+        self._reader.daemon = True
+        self._reader.start()
+        self.send(_BOOT_COMMANDS)
+        if network_in_file is not None:
+            self.load_network(network_in_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def send(self, commands):
+        """Send Tcl commands to LENS and wait for them to finish
+
+        The commands are evaluated inside one catch, the first failing
+        command stops the rest and raises a :py:class:`LensWorkerError`.
+
+        :param commands: Tcl commands, one command per element
+        :type commands: iterable
+
+        :returns: lines LENS printed while running the commands
+        :rtype: list
+        """
+        if not self.is_alive():
+            raise LensWorkerError('LENS worker is not running')
+        sentinel = '{}{}'.format(_SENTINEL, next(self._call_count))
+        lines = ['set _mann_status [catch {} _mann_result]'.format(
+            tcl_quote('\n'.join(commands))),
+            'if {$_mann_status} {puts stdout "' + sentinel +
+            ' ERROR $_mann_result"; flush stdout}']
+        lines.append('puts stdout {} ; flush stdout'.format(
+            tcl_quote(sentinel + ' OK')))
+        try:
+            self.process.stdin.write('\n'.join(lines) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise LensWorkerError('Could not write to LENS worker: {}'.
+                                  format(e))
+        return self._read_until(sentinel)
+
+    def _read_stdout(self):
+        for line in iter(self.process.stdout.readline, ''):
+            self._lines.put(line)
+        self._lines.put('')
+
+    def _read_until(self, sentinel):
+        """Collect the lines LENS prints until the sentinel
+
+        Output written without a newline ends up in front of the sentinel
+        on the same line, it is kept as an output line.
+        """
+        output = []
+        error = None
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            try:
+                line = self._lines.get(
+                    timeout=None if deadline is None else
+                    max(deadline - time.time(), 0))
+            except queue.Empty:
+                self.process.kill()
+                self.process.wait()
+                raise LensWorkerError(
+                    'LENS worker pid {} killed after {} seconds'.format(
+                        self.process.pid, self.timeout))
+            if line == '':
+                raise LensWorkerError('LENS worker exited with code {}'.
+                                      format(self.process.wait()))
+            line = line.rstrip('\n')
+            if sentinel + ' ERROR ' in line:
+                line, _, error = line.partition(sentinel + ' ERROR ')
+            elif line.endswith(sentinel + ' OK'):
+                line = line[:-len(sentinel + ' OK')]
+                if line:
+                    output.append(line)
+                break
+            if line:
+                output.append(line)
+        if error is not None:
+            raise LensWorkerError('LENS command failed: {}'.format(error))
+        return output
+
+    def set_env(self, lens_env):
+        """Set the environment variables read by the .in files as $env(...)
+
+        The variables replace the ones of the previous call, keys that are
+        not in lens_env are unset so an agent never reads the values left
+        behind by another agent
+        """
+        commands = ['unset -nocomplain ::env({})'.format(key)
+                    for key in sorted(set(self.env) - set(lens_env))]
+        commands.extend('set ::env({}) {}'.format(key, tcl_quote(value))
+                        for key, value in lens_env.items())
+        self.send(commands)
+        self.env = dict((key, str(value)) for key, value in lens_env.items())
+
+    def load_network(self, network_in_file):
+        """Source an .in file that builds the network
+
+        The network is built once per worker, loading the file that is
+        already loaded does nothing
+        """
+        if network_in_file == self.network_in_file:
+            return
+        self.send(['source {}'.format(tcl_quote(network_in_file))])
+        self.network_in_file = network_in_file
+
+    def call(self, lens_in_file_dir, lens_env={}):
+        """Run an .in file the same way `lens -batch` would
+
+        This is the drop in replacement for
+        :py:meth:`mann.agent.LensAgent.call_lens`.  The .in file can build a
+        new network, so a network loaded with :py:meth:`load_network` has to
+        be loaded again afterwards
+        """
+        self.set_env(lens_env)
+        self.network_in_file = None
+        return self.send(['source {}'.format(tcl_quote(lens_in_file_dir))])
+
+    def update(self, weight_file, ex_file, out_file, lens_env=None,
+               run_command='test', network_in_file=None):
+        """Load weights and examples into the loaded network and dump outputs
+
+        The network is built by network_in_file the first time the worker
+        runs an update, or beforehand with :py:meth:`load_network`
+
+        :param weight_file: .wt file of the agent
+        :type weight_file: str
+
+        :param ex_file: .ex file with the agent and predecessor states
+        :type ex_file: str
+
+        :param out_file: file the network outputs are written to
+        :type out_file: str
+
+        :param lens_env: environment variables to set before running, None
+            keeps the environment of the previous call
+        :type lens_env: dict
+
+        :param run_command: LENS command that runs the examples
+        :type run_command: str
+
+        :param network_in_file: .in file that builds the network
+        :type network_in_file: str
+        """
+        if lens_env is not None:
+            self.set_env(lens_env)
+        if network_in_file is not None:
+            self.load_network(network_in_file)
+        self.send([
+            'loadWeights {}'.format(tcl_quote(weight_file)),
+            'catch {deleteExampleSets mann_update}',
+            'loadExamples {} -s mann_update'.format(tcl_quote(ex_file)),
+            'useTestingSet mann_update',
+            'openNetOutputFile {}'.format(tcl_quote(out_file)),
+            run_command,
+            'closeNetOutputFile'])
+
+    def close(self):
+        if self.is_alive():
+            try:
+                self.process.stdin.write('_mann_exit\n')
+                self.process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._reader.join()
+        self.process.stdout.close()
+
+
+class LensWorkerPool(object):
+    def __init__(self, num_workers, **worker_kwargs):
+        """Pool of :py:class:`LensWorker`
+
+        :param num_workers: number of LENS processes to start
+        :type num_workers: int
+
+        :param **worker_kwargs: passed into each :py:class:`LensWorker`
+        """
+        assert num_workers >= 1, 'a LENS worker pool needs at least 1 worker'
+        self.worker_kwargs = worker_kwargs
+        self.workers = [LensWorker(**worker_kwargs)
+                        for _ in range(num_workers)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.workers)
+
+    def acquire(self):
+        """Take an idle worker, blocks until one is available
+        """
+        return self._idle.get()
+
+    def release(self, worker):
+        """Give a worker back to the pool, dead workers are replaced
+        """
+        if not worker.is_alive():
+            logger.warning('Replacing dead LENS worker pid {}'.
+                           format(worker.process.pid))
+            with self._lock:
+                self.workers.remove(worker)
+                worker = LensWorker(**self.worker_kwargs)
+                self.workers.append(worker)
+        self._idle.put(worker)
+
+    def call(self, lens_in_file_dir, lens_env={}):
+        """Run an .in file on the next idle worker
+        """
+        worker = self.acquire()
+        try:
+            return worker.call(lens_in_file_dir, lens_env)
+        finally:
+            self.release(worker)
+
+    def update(self, *args, **kwargs):
+        """Run :py:meth:`LensWorker.update` on the next idle worker
+        """
+        worker = self.acquire()
+        try:
+            return worker.update(*args, **kwargs)
+        finally:
+            self.release(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def benchmark(lens_in_file_dir, num_calls, lens_command=LENS_COMMAND,
+              lens_env={}, cwd=None):
+    """Time `lens -batch` calls against calls to a single LENS worker
+
+    :returns: seconds taken by the batch calls and by the worker calls
+    :rtype: tuple
+    """
+    env = mann.agent.get_base_lens_env()
+    env.update((key, str(value)) for key, value in lens_env.items())
+
+    start = time.time()
+    for _ in range(num_calls):
+        subprocess.call(list(lens_command) + ['-batch', lens_in_file_dir],
+                        env=env, cwd=cwd)
+    batch_seconds = time.time() - start
+
+    start = time.time()
+    with LensWorker(lens_command=lens_command, cwd=cwd) as worker:
+        for _ in range(num_calls):
+            worker.call(lens_in_file_dir, lens_env)
+    worker_seconds = time.time() - start
+
+    logger.info('{} LENS calls: batch {:.3f}s, worker {:.3f}s'.
+                format(num_calls, batch_seconds, worker_seconds))
+    return (batch_seconds, worker_seconds)
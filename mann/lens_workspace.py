@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+"""Scratch directories for LENS input and output files
+
+Every LENS update writes an .ex file and reads back an .out file, and the
+weight training writes an .ex file.  When these paths are shared, only one
+LENS call can run at a time.  A :py:class:`LensWorkspaceManager` hands out a
+scratch directory to each agent or worker.  The directories are on a tmpfs
+(/dev/shm) when there is one, so the round trip through the files does not
+touch the disk.
+
+The paths are passed to LENS as the ex_file and out_file environment
+variables, so the .in files need to use $env(ex_file) and $env(out_file)
+instead of fixed file names.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+SHM_DIR = '/dev/shm'
+
+
+def default_root():
+    """Returns /dev/shm if it exists, None (the system temp dir) otherwise
+    """
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return None
+
+
+class LensWorkspace(object):
+    def __init__(self, path):
+        """Scratch directory used by one LENS call at a time
+
+        :param path: directory of the workspace
+        :type path: str
+        """
+        self.path = path
+
+    def __repr__(self):
+        return 'LensWorkspace({!r})'.format(self.path)
+
+    def path_for(self, file_name):
+        return os.path.join(self.path, file_name)
+
+    @property
+    def ex_file_path(self):
+        return self.path_for('Infl.ex')
+
+    @property
+    def out_file_path(self):
+        return self.path_for('Out.out')
+
+    @property
+    def weight_ex_path(self):
+        return self.path_for('Wgt.ex')
+
+    def env(self):
+        """Environment variables passed to LENS for this workspace
+        """
+        return {'ex_file': self.ex_file_path,
+                'out_file': self.out_file_path}
+
+    def clear(self):
+        """Remove the files left by the last LENS call
+        """
+        for name in os.listdir(self.path):
+            file_path = os.path.join(self.path, name)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+            else:
+                os.remove(file_path)
+
+
+class LensWorkspaceManager(object):
+    def __init__(self, root=None, prefix='mann_lens_'):
+        """Hands out and recycles :py:class:`LensWorkspace` directories
+
+        All workspaces live in a directory created under root, removed by
+        :py:meth:`cleanup`
+
+        :param root: directory the workspaces are created in, see
+            :py:func:`default_root` when None
+        :type root: str
+        """
+        if root is None:
+            root = default_root()
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+        self._free = []
+        self._num_created = 0
+        self._lock = threading.Lock()
+        logger.debug('LENS workspaces in {}'.format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def acquire(self):
+        """Returns an empty workspace, recycled if one was released
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            workspace_path = os.path.join(
+                self.path, 'ws{0:06d}'.format(self._num_created))
+            self._num_created += 1
+        os.makedirs(workspace_path)
+        return LensWorkspace(workspace_path)
+
+    def release(self, workspace):
+        """Empty a workspace and keep it for the next :py:meth:`acquire`
+        """
+        workspace.clear()
+        with self._lock:
+            self._free.append(workspace)
+
+    def cleanup(self):
+        """Remove all the workspaces
+        """
+        with self._lock:
+            self._free = []
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,11 +1,22 @@
 #! /usr/bin/env python
+"""Random graphs for the agent networks
+
+The graph classes wrap networkx generators.  The *_compact_graph functions
+draw the same kinds of graphs with numpy and return a
+:py:class:`mann.graph_core.CompactGraph`, which can be passed as the edge
+list of
+:py:meth:`mann.network_agent.NetworkAgent.create_multidigraph_of_agents_from_edge_list`.
+"""
 
 import networkx as nx
+import numpy as np
 
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
+import mann.graph_core
+
 
 class Network(object):
     def __init__(self):
@@ -36,3 +47,162 @@ class BidirectionalBarabasiAlbertGraph(MannGraph):
 class WattsStrogatzGraph(MannGraph):
     def __init__(self, n, k, p, seed=None):
         self.G = nx.watts_strogatz_graph(n, k, p, seed=None)
+
+
+def _random_state(seed):
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def _geometric_positions(num_slots, p, random_state):
+    """Sorted positions in 0 to num_slots - 1, each kept with probability p,
+    drawn by skipping a geometric number of slots between positions
+    """
+    chunk_size = int(num_slots * p * 1.05) + 1024
+    positions = []
+    last = -1
+    while last < num_slots:
+        gaps = random_state.geometric(p, size=chunk_size)
+        chunk = last + np.cumsum(gaps)
+        positions.append(chunk)
+        last = chunk[-1]
+    positions = np.concatenate(positions)
+    return positions[:np.searchsorted(positions, num_slots)]
+
+
+def gnp_compact_graph(n, p, seed=None, directed=True):
+    """G(n, p) random graph without self loops, a numpy version of
+    `networkx.fast_gnp_random_graph`
+
+    Instead of a coin flip for every node pair, the edges are found by
+    skipping a geometric number of pairs, the cost is the number of edges.
+
+    :param seed: seed or numpy RandomState
+    :type seed: int
+
+    :param directed: when False, every edge is returned once as (u, v) with
+        u < v, pass add_reverse_edge to
+        :py:meth:`mann.network_agent.NetworkAgent.create_multidigraph_of_agents_from_edge_list`
+        for both directions
+    :type directed: bool
+
+    :rtype: mann.graph_core.CompactGraph
+    """
+    random_state = _random_state(seed)
+    num_slots = n * (n - 1) if directed else n * (n - 1) // 2
+    if p <= 0 or num_slots == 0:
+        positions = np.zeros(0, dtype=np.int64)
+    elif p >= 1:
+        positions = np.arange(num_slots, dtype=np.int64)
+    else:
+        positions = _geometric_positions(num_slots, p, random_state)
+
+    if directed:
+        sources = positions // (n - 1)
+        targets = positions % (n - 1)
+        targets += targets >= sources
+    else:
+        # position k is the pair (u, v) with v < u, k = u (u - 1) / 2 + v
+        targets = ((1 + np.sqrt(1 + 8 * positions.astype(float))) // 2).\
+            astype(np.int64)
+        targets -= targets * (targets - 1) // 2 > positions
+        targets += (targets + 1) * targets // 2 <= positions
+        sources = positions - targets * (targets - 1) // 2
+    return mann.graph_core.CompactGraph(n, sources, targets)
+
+
+def _resolve_attachment(slot_nodes, num_known, picks):
+    """Node in each picked slot of the preferential attachment list
+
+    Slot 2 i is the source and slot 2 i + 1 the target of edge i.  The
+    first num_known edges are known, the target of a later edge i is the
+    node in slot picks[i - num_known], which can be the target of another
+    later edge, so the pointers are followed until they land in a known
+    slot.
+    """
+    pointers = picks.copy()
+    while True:
+        edge = pointers // 2
+        unknown = (pointers % 2 == 1) & (edge >= num_known)
+        if not unknown.any():
+            break
+        pointers[unknown] = picks[edge[unknown] - num_known]
+    return slot_nodes[pointers]
+
+
+def barabasi_albert_compact_graph(n, m, seed=None):
+    """Barabási-Albert preferential attachment graph, a numpy version of
+    `networkx.barabasi_albert_graph`
+
+    The graph starts as a star of m + 1 nodes, every later node is joined to
+    m distinct earlier nodes picked with probability proportional to their
+    degree.  A pick is a random slot of the list of edge ends, the same
+    list networkx keeps (repeated_nodes), and all picks are drawn at once.
+    Every edge is returned once as (new node, earlier node), pass
+    add_reverse_edge for both directions.
+
+    :rtype: mann.graph_core.CompactGraph
+    """
+    if m < 1 or m >= n:
+        raise ValueError('Barabási-Albert network must have m >= 1 and '
+                         'm < n, m = {}, n = {}'.format(m, n))
+    random_state = _random_state(seed)
+    num_new = n - m - 1
+    sources = np.concatenate([np.arange(1, m + 1),
+                              np.repeat(np.arange(m + 1, n), m)])
+    targets = np.zeros(len(sources), dtype=np.int64)
+
+    # edge ends before the first edge of each new node
+    first_edge = m + np.arange(num_new) * m
+    num_slots = np.repeat(2 * first_edge, m)
+    slot_nodes = np.stack([sources, targets], axis=1).ravel()
+    picks = np.zeros(num_new * m, dtype=np.int64)
+    new_targets = picks
+    redraw = np.ones(num_new * m, dtype=bool)
+    while redraw.any():
+        picks[redraw] = (random_state.random_sample(redraw.sum()) *
+                         num_slots[redraw]).astype(np.int64)
+        new_targets = _resolve_attachment(slot_nodes, m, picks)
+        # the targets of a node need to be distinct
+        rows = new_targets.reshape(num_new, m)
+        order = np.argsort(rows, axis=1, kind='stable')
+        sorted_rows = np.take_along_axis(rows, order, axis=1)
+        duplicate = np.zeros(rows.shape, dtype=bool)
+        np.put_along_axis(
+            duplicate, order[:, 1:],
+            sorted_rows[:, 1:] == sorted_rows[:, :-1], axis=1)
+        redraw = duplicate.ravel()
+    targets[m:] = new_targets
+    return mann.graph_core.CompactGraph(n, sources, targets)
+
+
+def watts_strogatz_compact_graph(n, k, p, seed=None):
+    """Watts-Strogatz small world graph, a numpy version of
+    `networkx.watts_strogatz_graph`
+
+    Every node is joined to its k // 2 neighbours on each side of a ring,
+    then every edge (u, v) is rewired to (u, w) with probability p, w drawn
+    at random.  All edges are rewired at once, rewired edges that make a
+    self loop or an edge that is already there are drawn again.  Every edge
+    is returned once, pass add_reverse_edge for both directions.
+
+    :rtype: mann.graph_core.CompactGraph
+    """
+    if k >= n:
+        raise ValueError('k >= n, choose smaller k or larger n')
+    random_state = _random_state(seed)
+    sources = np.repeat(np.arange(n), k // 2)
+    targets = (sources + np.tile(np.arange(1, k // 2 + 1), n)) % n
+    if k < n - 1:
+        rewire = random_state.random_sample(len(sources)) < p
+        redraw = rewire
+        while redraw.any():
+            targets[redraw] = random_state.randint(0, n, size=redraw.sum())
+            keys = np.minimum(sources, targets) * n + \
+                np.maximum(sources, targets)
+            _, inverse, counts = np.unique(keys, return_inverse=True,
+                                           return_counts=True)
+            redraw = rewire & ((targets == sources) |
+                               (counts[inverse] > 1))
+    return mann.graph_core.CompactGraph(n, sources, targets)
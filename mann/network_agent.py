@@ -1,6 +1,9 @@
 #! /usr/bin/env python
 
+import concurrent.futures
+import os
 import random
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 import re
@@ -9,18 +12,22 @@ import logging
 import mann.agent
 import mann.agent_binary
 import mann.agent_lens_recurrent
+import mann.graph_core
+import mann.lens_in_writer
+import mann.lens_numpy
+import mann.step_output
 
 logger = logging.getLogger(__name__)
 
 
 def setup_logger(fh, formatter):
+    global logger
     logger.setLevel(logging.DEBUG)
     fh = fh
     # fh.setLevel(logging.DEBUG)
     fh.setLevel(logging.CRITICAL)
     formatter = formatter
     fh.setFormatter(formatter)
-    global logger
     logger.addHandler(fh)
     logger.debug('Setup logger in network_agent.py')
     return logger
@@ -28,43 +35,133 @@ def setup_logger(fh, formatter):
 
 class NetworkAgent(object):
     def __init__(self):
-        pass
+        self._G = None
+        # integer indexed graph of the network, node i is agents[i].  When
+        # it is set it is the network, and G is only built from it when it
+        # is used, e.g. for plotting or export
+        self.graph = None
+        self.agents = None
+        # agents sampled for update since the step info was last written,
+        # by agent_id so steps that are not recorded do not add up
+        self.step_sampled_agents = {}
 
     def __eq__(self, x, y):
         return x.agent_id == y.agent_id
 
+    @property
+    def G(self):
+        """networkx MultiDiGraph of the agents
+
+        When the network was created with :py:meth:`create_agents_from_edge_list`
+        the graph is built from :py:attr:`graph` the first time it is used.
+        Assigning a new G replaces :py:attr:`graph`.  When nodes or edges
+        are added to or removed from a G built from :py:attr:`graph`,
+        :py:attr:`graph` is dropped and G is used from then on; an edit that
+        keeps the number of nodes and edges is not noticed, assign G instead.
+        """
+        if self._G is None and self.graph is not None:
+            self._G = self.graph.to_networkx(self.agents)
+        return self._G
+
+    @G.setter
+    def G(self, G):
+        self._G = G
+        self.graph = None
+        self.agents = None
+
+    def _check_graph(self):
+        """Drop the compact graph when G was edited after it was built
+        """
+        if self.graph is None or self._G is None:
+            return
+        if len(self._G) != len(self.graph) or \
+           self._G.number_of_edges() != self.graph.num_edges:
+            logger.warning('G was edited, the compact graph is not used')
+            self.graph = None
+            self.agents = None
+
+    def get_agents(self):
+        """Agents of the network, in the order of the nodes of
+        :py:attr:`graph`, or of `G.nodes()` when there is no compact graph
+
+        :rtype: list
+        """
+        self._check_graph()
+        if self.graph is not None:
+            return self.agents
+        return list(self._G.nodes())
+
     def create_multidigraph_of_agents_from_edge_list(
             self, number_of_agents, edge_list, fig_path,
             agent_type=tuple(['None']), add_reverse_edge=False,
-            **kwargs):
+            num_weight_workers=1, num_weight_batches=None, **kwargs):
         """Create multi directed networkx graph of agents from an edge list
 
+        Creates the network with :py:meth:`create_agents_from_edge_list`,
+        then plots and returns G, which is built from the compact graph.
+        Use :py:meth:`create_agents_from_edge_list` directly to keep large
+        networks out of networkx.
+
+        :param fig_path: figure path of output network image, no image is
+            drawn when None
+        :type fig_path: str
+
+        See :py:meth:`create_agents_from_edge_list` for the other parameters
+        """
+        self.create_agents_from_edge_list(
+            number_of_agents, edge_list, agent_type=agent_type,
+            add_reverse_edge=add_reverse_edge,
+            num_weight_workers=num_weight_workers,
+            num_weight_batches=num_weight_batches, **kwargs)
+
+        if fig_path is not None:
+            logger.debug('Saving plot of mann copied graph')
+            nx.draw_circular(self.G)
+            # plt.show()
+            plt.savefig(fig_path)
+
+        return self.G
+
+    def create_agents_from_edge_list(
+            self, number_of_agents, edge_list, agent_type=tuple(['None']),
+            add_reverse_edge=False, num_weight_workers=1,
+            num_weight_batches=None, **kwargs):
+        """Create the agents of a network and its
+        :py:class:`mann.graph_core.CompactGraph` from an edge list, without
+        a networkx graph
+
         :param num_of_agents: number of agents in the network
         :type num_of_agents: int
 
-        :param edge_list: edge list of network
+        :param edge_list: edge list of network, or a
+            :py:class:`mann.graph_core.CompactGraph` such as the ones from
+            :py:mod:`mann.network`, node i is the i-th agent created
         :type edge_list: iterable
 
-        :param fig_path: figure path of output network image
-        :type fig_path: str
-
         :param agent_type: type of agent, binary or lens
         :type agent_type: tuple
 
         :param logger: logger object, not used
         :type logger: None
 
+        :param num_weight_workers: number of LENS agent weight files created
+            at the same time, see :py:meth:`create_weight_files_parallel`
+        :type num_weight_workers: int
+
+        :param num_weight_batches: when set, the LENS agent weights are
+            trained in this many LENS processes, see
+            :py:meth:`create_weight_files_batched`
+        :type num_weight_batches: int
+
         :param **kwargs: kwargs used for lens agent creation
         :type **kwargs: dict
         """
-        logger.debug('In mann.network_agent.'
-                     'create_multidigraph_of_agents_from_edge_list()')
-
-        # create the graph
-        self.G = nx.MultiDiGraph()
+        logger.debug('In mann.network_agent.create_agents_from_edge_list()')
 
         # dictonary container for agents, key values will be the agent.get_key
         all_agents = {}
+        # agents whose weight files are created in parallel after the loop
+        weight_file_agents = []
         logger.debug("creating agents of type {}".format(agent_type))
         for i in range(number_of_agents):
             logger.debug("creating agent # {}".format(i))
@@ -87,11 +184,15 @@ class NetworkAgent(object):
                 elif agent_type[2] == 'recurrent_attitude':
                     new_agent = mann.agent_lens_recurrent.LensAgentRecurrent(
                         agent_type[1])
-                    new_agent.create_weight_file(
-                        kwargs.get('weight_in_file'),
-                        kwargs.get('weight_dir'),
-                        kwargs.get('weight_ex_path'),
-                        **kwargs)
+                    if num_weight_workers > 1 or \
+                       num_weight_batches is not None:
+                        weight_file_agents.append(new_agent)
+                    else:
+                        new_agent.create_weight_file(
+                            kwargs.get('weight_in_file'),
+                            kwargs.get('weight_dir'),
+                            kwargs.get('weight_ex_path'),
+                            **kwargs)
                 else:
                     s = 'Unknown Lens Agent Type'
                     logger.fatal(s)
@@ -118,33 +219,180 @@ class NetworkAgent(object):
         logger.debug('total number of agents created: {}'.
                      format(new_agent.agent_count))
 
-        self.G.add_nodes_from(all_agents.values())
-        logger.debug('number of nodes created: {}'.format(len(self.G)))
+        if len(weight_file_agents) > 0 and num_weight_batches is not None:
+            self.create_weight_files_batched(weight_file_agents,
+                                             num_weight_batches, **kwargs)
+        elif len(weight_file_agents) > 0:
+            self.create_weight_files_parallel(weight_file_agents,
+                                              num_weight_workers, **kwargs)
+
+        agents = list(all_agents.values())
+        logger.debug('number of agents created: {}'.format(len(agents)))
 
         logger.debug('Creating edges')
         logger.debug('Add reverse edge: {}'.format(str(add_reverse_edge)))
-        for edge in edge_list:
-            u, v = edge
-            self.G.add_edge(all_agents[u], all_agents[v])
+        if isinstance(edge_list, mann.graph_core.CompactGraph):
+            # node i of the graph is the i-th agent created
+            assert len(edge_list) == number_of_agents
+            graph = edge_list
             if add_reverse_edge is True:
-                self.G.add_edge(all_agents[v], all_agents[u])
+                graph = graph.with_reverse_edges()
+        else:
+            position = dict((agent_id, idx)
+                            for idx, agent_id in enumerate(all_agents))
+            graph = mann.graph_core.CompactGraph.from_edge_list(
+                number_of_agents,
+                [(position[u], position[v]) for u, v in edge_list],
+                add_reverse_edge=add_reverse_edge is True)
+
+        self._G = None
+        self.graph = graph
+        self.agents = agents
+        return self.graph
+
+    def create_weight_files_parallel(self, agents, num_workers, **kwargs):
+        """Create the LENS weight files of agents on a thread pool
+
+        Each LENS training run is a blocking subprocess, so threads are
+        enough to keep num_workers LENS processes running.  Every agent
+        writes its training examples to its own scratch .ex file (see
+        :py:meth:`mann.agent.LensAgent.get_agent_scratch_path`), the path
+        is passed to LENS as the ex_file environment variable.  When a
+        :py:class:`mann.lens_workspace.LensWorkspaceManager` is passed in as
+        the `workspace_manager` kwarg, the .ex file is written to a
+        workspace instead.
+
+        A :py:class:`mann.lens_worker.LensWorkerPool` can be passed in as the
+        `lens_worker` kwarg, a single LensWorker can not be shared by threads
+
+        :param agents: agents that need a weight file
+        :type agents: list
+
+        :param num_workers: number of weight files created at the same time
+        :type num_workers: int
+
+        :param **kwargs: kwargs passed into each agent's create_weight_file
+        """
+        logger.debug('Creating {} weight files with {} workers'.
+                     format(len(agents), num_workers))
+
+        workspace_manager = kwargs.get('workspace_manager')
+
+        def create_weight_file(new_agent):
+            if workspace_manager is None:
+                new_agent.create_weight_file(
+                    kwargs.get('weight_in_file'),
+                    kwargs.get('weight_dir'),
+                    new_agent.get_agent_scratch_path(
+                        kwargs.get('weight_ex_path')),
+                    **kwargs)
+                return
+            workspace = workspace_manager.acquire()
+            try:
+                new_agent.create_weight_file(
+                    kwargs.get('weight_in_file'),
+                    kwargs.get('weight_dir'),
+                    workspace.weight_ex_path,
+                    **kwargs)
+            finally:
+                workspace_manager.release(workspace)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=num_workers) as executor:
+            # iterating over the results re-raises errors from the workers
+            for _ in executor.map(create_weight_file, agents):
+                pass
 
-        logger.debug('Saving plot of mann copied graph')
-        nx.draw_circular(self.G)
-        # plt.show()
-        plt.savefig(fig_path)
+    def create_weight_files_batched(self, agents, num_batches=1, **kwargs):
+        """Create the LENS weight files of agents with a few LENS processes
 
-        return self.G
+        The agents are split into num_batches batches.  For each batch one
+        .in file is written (see
+        :py:meth:`mann.lens_in_writer.LensInWriterHelper.generate_weight_training_script`)
+        that runs the weight_in_file training for every agent in the batch,
+        the batches run in parallel.  Each agent writes its training
+        examples to its own scratch .ex file, agents whose weights are in
+        the `weight_store` kwarg are not trained.
+
+        :param agents: agents that need a weight file
+        :type agents: list
+
+        :param num_batches: number of LENS processes
+        :type num_batches: int
+
+        :param **kwargs: kwargs passed into each agent's
+            prepare_weight_training, the batch .in files are written next to
+            the weight_in_file as WgtMakeBatchXXX.in
+        """
+        assert num_batches > 0, 'num_batches needs to be greater than 0'
+        weight_in_file = kwargs.get('weight_in_file')
+        weight_trainings = []
+        for new_agent in agents:
+            weight_training = new_agent.prepare_weight_training(
+                weight_in_file,
+                kwargs.get('weight_dir'),
+                new_agent.get_agent_scratch_path(kwargs.get('weight_ex_path')),
+                **kwargs)
+            if weight_training is not None:
+                weight_trainings.append((new_agent, weight_training))
+        if len(weight_trainings) == 0:
+            return
+
+        batches = [weight_trainings[idx::num_batches]
+                   for idx in range(num_batches)]
+        batches = [batch for batch in batches if len(batch) > 0]
+        logger.debug('Training {} weight files in {} LENS processes'.
+                     format(len(weight_trainings), len(batches)))
+        writer = mann.lens_in_writer.LensInWriterHelper()
+        batch_dir = os.path.dirname(weight_in_file)
+
+        def train_batch(batch_idx):
+            batch = batches[batch_idx]
+            batch_in_file = os.path.join(
+                batch_dir, 'WgtMakeBatch{0:03d}.in'.format(batch_idx))
+            agent_envs = []
+            for _, weight_training in batch:
+                lens_env = weight_training['lens_env']
+                agent_env = {'a': lens_env['a'],
+                             'ex_file': lens_env['ex_file']}
+                if 'seed' in lens_env:
+                    agent_env['seed'] = lens_env['seed']
+                agent_envs.append(agent_env)
+            writer.write_in_file(
+                batch_in_file,
+                writer.generate_weight_training_script(weight_in_file,
+                                                       agent_envs))
+            # bm/bs/wm/ws/cs are the same for every agent
+            first_agent, first_training = batch[0]
+            first_agent.call_lens(batch_in_file,
+                                  lens_env=first_training['lens_env'],
+                                  lens_worker=kwargs.get('lens_worker'))
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(batches)) as executor:
+            # iterating over the results re-raises errors from the workers
+            for _ in executor.map(train_batch, range(len(batches))):
+                pass
+
+        for new_agent, weight_training in weight_trainings:
+            new_agent.finish_weight_training(weight_training)
 
     def export_edge_list(self, export_file_dir, **kwargs):
         nx.write_edgelist(self.G, export_file_dir, **kwargs)
 
     def set_predecessors_for_each_node(self):
         logger.debug('network_agent.set_predecessors_for_each_node()')
+        agents = self.get_agents()
+        if self.graph is not None:
+            # predecessors are slices of the compact graph, no agent hashing
+            for idx, node_agent in enumerate(agents):
+                node_agent.set_predecessors(mann.graph_core.NodeSequence(
+                    agents, self.graph.predecessors(idx)))
+            return
         # iterate through all nodes in network
-        for node_agent in self.G.nodes_iter():
+        for node_agent in agents:
             # look up the predessors for each node
-            predecessors = self.G.predecessors(node_agent)
+            predecessors = list(self.G.predecessors(node_agent))
             # since the nodes are an Agent class we can
             # assign the predecessors agent instance variable to the iter
             node_agent.set_predecessors(predecessors)
@@ -159,8 +407,10 @@ class NetworkAgent(object):
         chosen from the population sequence or set.
         Used for random sampling without replacement.
         '''
-        agents_picked = random.sample(self.G.nodes(),
+        agents_picked = random.sample(self.get_agents(),
                                       number_of_agents_to_sample)
+        for agent in agents_picked:
+            self.step_sampled_agents[agent.agent_id] = agent
         return agents_picked
 
     def str_list_with_out_brackets(self, list_to_str):
@@ -186,7 +436,7 @@ class NetworkAgent(object):
         # assign new temp value
         for selected_agent in agents_for_update:
             logger.debug('Updating: {}'.
-                         format(self.G.nodes()[selected_agent.agent_id]))
+                         format(selected_agent))
             assert selected_agent.temp_new_state is None
             selected_agent.update_agent_state(update_type,
                                               update_algorithm)
@@ -217,14 +467,290 @@ class NetworkAgent(object):
 
         logger.debug('Num agents for update: {}'.
                      format(len(agents_for_update)))
+        if kwargs.get('single_lens_process', False):
+            # later agents of a sequential step need the new states of the
+            # earlier ones, a single LENS process reads them all up front
+            raise ValueError('single_lens_process only works with '
+                             'update_simultaneous_lens')
         # assign new temp value
         for selected_agent in agents_for_update:
             logger.debug('Updating: {}'.
-                         format(self.G.nodes()[selected_agent.agent_id]))
+                         format(selected_agent))
             selected_agent.update_agent_state(update_type, update_algorithm,
                                               manual_predecessor_inputs,
                                               **kwargs)
 
+    def update_lens_step(self, agents_for_update, update_algorithm,
+                         manual_predecessor_inputs, **kwargs):
+        """Update recurrent attitude agents with a single LENS process
+
+        Used by :py:meth:`update_simultaneous_lens` when the
+        `single_lens_process` kwarg is True.  One .in file is written for the whole step (see
+        :py:meth:`mann.lens_in_writer.LensInWriterHelper.generate_step_script`)
+        that runs the lens_parameters['in_file_path'] update for every agent,
+        each agent with its own .ex and .out files.  LENS is started once
+        instead of once per agent.
+
+        The inputs of every agent are written before LENS starts, so the
+        agents read the states from the start of the step, which is why
+        this is only used for simultaneous updates.
+
+        :param agents_for_update: agents to update, in update order
+        :type agents_for_update: list
+
+        :param **kwargs: needs 'lens_parameters'.  The step .in file is
+            written to lens_parameters['step_in_file_path'], by default
+            Step.in next to the update .in file.  A
+            :py:class:`mann.lens_cache.LensResultCache` passed in as the
+            `result_cache` kwarg is used the same way as in a single update
+
+        :returns: agents updated
+        :rtype: list
+        """
+        lens_parameters = kwargs['lens_parameters']
+        result_cache = kwargs.get('result_cache')
+        agents_for_update = [agent for agent in agents_for_update
+                             if agent.has_predecessor()]
+
+        lens_runs = []
+        # assigned with the LENS results, so every agent reads the states
+        # from the start of the step
+        cache_hits = []
+        for selected_agent in agents_for_update:
+            n = selected_agent.num_predecessors_to_pick(
+                update_algorithm, manual_predecessor_inputs)
+            lens_update = selected_agent.prepare_lens_update(
+                n, manual_predecessor_inputs, per_agent_files=True, **kwargs)
+            cache_key = None
+            if result_cache is not None:
+                cache_key = result_cache.make_key(
+                    selected_agent.get_weight_digest(),
+                    lens_update['ex_file_strings'], lens_update['lens_env'])
+                new_state = result_cache.get(cache_key)
+                if new_state is not None:
+                    cache_hits.append((selected_agent, new_state))
+                    continue
+            selected_agent.write_lens_ex_file(
+                lens_update['ex_file_path'],
+                string_to_write=lens_update['ex_file_strings'])
+            lens_runs.append((selected_agent, lens_update, cache_key))
+        logger.debug('Updating {} agents in one LENS process'.
+                     format(len(lens_runs)))
+        if len(lens_runs) == 0:
+            for selected_agent, new_state in cache_hits:
+                selected_agent.commit_state(new_state)
+            return agents_for_update
+
+        step_in_file_path = lens_parameters.get(
+            'step_in_file_path',
+            os.path.join(os.path.dirname(lens_parameters['in_file_path']),
+                         'Step.in'))
+        writer = mann.lens_in_writer.LensInWriterHelper()
+        writer.write_in_file(step_in_file_path, writer.generate_step_script(
+            lens_parameters['in_file_path'],
+            [(selected_agent.get_padded_agent_id(),
+              lens_update['ex_file_path'],
+              lens_update['new_state_path'])
+             for selected_agent, lens_update, _ in lens_runs]))
+
+        # bm/bs/wm/ws/cs are the same for every agent
+        first_agent, first_update, _ = lens_runs[0]
+        first_agent.call_lens(step_in_file_path,
+                              lens_env=first_update['lens_env'],
+                              lens_worker=kwargs.get('lens_worker'))
+
+        for selected_agent, lens_update, cache_key in lens_runs:
+            new_state = selected_agent.get_new_state_values_from_out_file(
+                lens_update['new_state_path'],
+                num_processing_unts=len(selected_agent.state))
+            if result_cache is not None:
+                result_cache.put(cache_key, new_state)
+            selected_agent.commit_state(new_state)
+        for selected_agent, new_state in cache_hits:
+            selected_agent.commit_state(new_state)
+        return agents_for_update
+
+    def update_simultaneous_lens(self, num_agents_update, update_algorithm,
+                                 manual_predecessor_inputs, max_workers=None,
+                                 **kwargs):
+        """Simultaneous update of recurrent attitude agents, calling LENS for
+        the selected agents at the same time
+
+        The inputs of every selected agent are sampled first, so all the
+        agents read the states from the start of the step.  The LENS calls
+        run on a pool of max_workers threads, each agent with its own .ex
+        and .out files.  The new states are collected in temp_new_state and
+        only assigned once every LENS call has finished.
+
+        :param num_agents_update: number of agents to sample for update
+        :type num_agents_update: int
+
+        :param update_algorithm: 'random_1', 'random_all'
+        :type update_algorithm: str
+
+        :param max_workers: number of LENS calls running at the same time,
+            the number of CPUs when None
+        :type max_workers: int
+
+        :param **kwargs: needs 'lens_parameters', the same dictionary used
+            by :py:meth:`update_sequential`.  A
+            :py:class:`mann.lens_worker.LensWorkerPool` can be passed in as
+            the `lens_worker` kwarg.  With a
+            :py:class:`mann.lens_workspace.LensWorkspaceManager` as the
+            `workspace_manager` kwarg each agent gets a workspace for the
+            step instead of the per agent files next to the lens_parameters
+            paths.  With the `single_lens_process` kwarg set to True all
+            the agents are updated in one LENS process, see
+            :py:meth:`update_lens_step`
+
+        :returns: agents updated
+        :rtype: list
+        """
+        assert isinstance(num_agents_update, int)
+        agents_for_update = [agent for agent in
+                             self.sample_network(num_agents_update)
+                             if agent.has_predecessor()]
+        logger.debug('Num agents for simultaneous LENS update: {}'.
+                     format(len(agents_for_update)))
+        if len(agents_for_update) == 0:
+            return agents_for_update
+        if kwargs.get('single_lens_process', False):
+            return self.update_lens_step(agents_for_update, update_algorithm,
+                                         manual_predecessor_inputs, **kwargs)
+
+        workspace_manager = kwargs.get('workspace_manager')
+        workspaces = []
+        lens_updates = []
+        for selected_agent in agents_for_update:
+            assert selected_agent.temp_new_state is None
+            n = selected_agent.num_predecessors_to_pick(
+                update_algorithm, manual_predecessor_inputs)
+            workspace = None
+            if workspace_manager is not None:
+                workspace = workspace_manager.acquire()
+                workspaces.append(workspace)
+            lens_updates.append(selected_agent.prepare_lens_update(
+                n, manual_predecessor_inputs, per_agent_files=True,
+                workspace=workspace, **kwargs))
+
+        def run_lens_update(agent_update):
+            selected_agent, lens_update = agent_update
+            selected_agent.temp_new_state = selected_agent.run_lens_update(
+                lens_update, **kwargs)
+
+        if max_workers is None:
+            # every call is a LENS process, one per agent would start
+            # hundreds of them on a large network
+            max_workers = os.cpu_count() or 1
+        max_workers = min(max_workers, len(agents_for_update))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers) as executor:
+                # iterating over the results re-raises errors from the
+                # workers
+                for _ in executor.map(run_lens_update,
+                                      zip(agents_for_update, lens_updates)):
+                    pass
+        except Exception:
+            for selected_agent in agents_for_update:
+                selected_agent.temp_new_state = None
+            raise
+        finally:
+            for workspace in workspaces:
+                workspace_manager.release(workspace)
+
+        logger.debug('Performing simultaneous update')
+        for selected_agent in agents_for_update:
+            selected_agent.commit_state(selected_agent.temp_new_state)
+            selected_agent.temp_new_state = None
+        return agents_for_update
+
+    def update_batch(self, num_agents_update, update_algorithm,
+                     manual_predecessor_inputs, **kwargs):
+        """Update the selected recurrent attitude agents in one batch
+
+        The inputs of every selected agent are sampled first, then all the
+        agent networks are settled together with
+        :py:func:`mann.lens_numpy.settle_batch`.  All the agents read the
+        states from the start of the step.
+
+        :param num_agents_update: number of agents to sample for update
+        :type num_agents_update: int
+
+        :param update_algorithm: 'random_1', 'random_all'
+        :type update_algorithm: str
+
+        :param **kwargs: needs 'lens_parameters', the same dictionary used
+            by :py:meth:`update_sequential`
+
+        :returns: agents updated and their new states, one row per agent
+        :rtype: tuple
+        """
+        assert isinstance(num_agents_update, int)
+        lens_parameters = kwargs['lens_parameters']
+        agents_for_update = [agent for agent in
+                             self.sample_network(num_agents_update)
+                             if agent.has_predecessor()]
+        logger.debug('Num agents for batch update: {}'.
+                     format(len(agents_for_update)))
+        if len(agents_for_update) == 0:
+            return (agents_for_update, np.empty((0, 0)))
+
+        agent_inputs = []
+        for selected_agent in agents_for_update:
+            if selected_agent.weights is None:
+                selected_agent.create_weights_numpy(**lens_parameters)
+            n = selected_agent.num_predecessors_to_pick(
+                update_algorithm, manual_predecessor_inputs)
+            agent_inputs.append(selected_agent.sample_predecessor_states(
+                n, manual_predecessor_inputs=manual_predecessor_inputs))
+
+        num_examples = max(len(x) for x in agent_inputs)
+        num_units = agent_inputs[0].shape[1]
+        inputs = np.zeros((len(agent_inputs), num_examples, num_units))
+        mask = np.zeros((len(agent_inputs), num_examples), dtype=bool)
+        for idx, agent_input in enumerate(agent_inputs):
+            inputs[idx, :len(agent_input)] = agent_input
+            mask[idx, :len(agent_input)] = True
+
+        weights = np.array([a.weights for a in agents_for_update])
+        new_states = mann.lens_numpy.settle_batch(
+            weights, inputs,
+            float(lens_parameters['clamp_strength']),
+            mask=mask,
+            ticks=lens_parameters.get('ticks', mann.lens_numpy.DEFAULT_TICKS),
+            dt=lens_parameters.get('dt', mann.lens_numpy.DEFAULT_DT))
+
+        for selected_agent, new_state in zip(agents_for_update, new_states):
+            selected_agent.commit_state(new_state.tolist())
+        return (agents_for_update, new_states)
+
+    def record_step_info(self, time_step, step_writer):
+        """Write the step info of every agent with a
+        :py:class:`mann.step_output.StepWriter` (or
+        :py:class:`mann.step_output.CsvStepWriter`), then reset the step
+        variables of the agents sampled for update in this step, the same
+        as :py:meth:`write_network_agent_step_info` without formatting every
+        agent.  A :py:class:`mann.step_output.DeltaStepWriter` only reads
+        the sampled agents.
+
+        :param time_step: time step
+        :type time_step: int
+
+        :param step_writer: open writer for the agents of this network
+        :type step_writer: mann.step_output.StepWriter
+        """
+        if isinstance(step_writer, mann.step_output.DeltaStepWriter):
+            step_writer.write_network(
+                time_step, self,
+                agents=list(self.step_sampled_agents.values()))
+        else:
+            step_writer.write_network(time_step, self)
+        # only the agents sampled for update have step variables set
+        for node in self.step_sampled_agents.values():
+            node.reset_step_variables()
+        self.step_sampled_agents = {}
+
     def write_network_agent_step_info(self, time_step, file_to_write,
                                       file_mode, agent_type, **kwargs):
         """Write agent info for each time step
@@ -246,9 +772,19 @@ class NetworkAgent(object):
         - input agent state
         - lens target
         - prototype
+
+        The file can be compressed with the `compression`,
+        `compression_level` and `block_size` kwargs, see
+        :py:func:`mann.step_output.open_text`.  Every call appends a new
+        compressed stream, use a :py:class:`mann.step_output.CsvStepWriter`
+        to keep one stream open for the whole run.
         """
-        with open(file_to_write, mode=file_mode, encoding='utf-8') as f:
-            for node in self.G.__iter__():
+        with mann.step_output.open_text(
+                file_to_write, file_mode, kwargs.get('compression'),
+                kwargs.get('compression_level'),
+                kwargs.get('block_size',
+                           mann.step_output.DEFAULT_BLOCK_SIZE)) as f:
+            for node in self.get_agents():
                 if agent_type == 'binary':
                     f.write(",".join([
                         str(time_step),  # time step
@@ -303,3 +839,4 @@ class NetworkAgent(object):
                         self.str_list_with_out_brackets(node.prototype)
                     ]) + "\n")
                 node.reset_step_variables()
+        self.step_sampled_agents = {}
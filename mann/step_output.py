@@ -0,0 +1,1070 @@
+#! /usr/bin/env python
+"""Columnar step info output
+
+:py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+writes one csv line per agent per step, formatting every state with `str`
+and a regex.  A :py:class:`StepWriter` keeps its file open and appends one
+fixed width binary block per step instead:
+
+- time_step, int64
+- agent_id, int64 for every agent
+- num_update, int64 for every agent
+- step_update_status, int8 for every agent, -1 for None
+- state, (agents x state values) of the state dtype
+
+The file starts with a header holding the block layout, so
+:py:class:`StepReader` can seek to any step.  The csv lines of
+write_network_agent_step_info can still be written with
+:py:class:`CsvStepWriter`, or exported from a binary file with
+:py:meth:`StepReader.export_csv`.
+
+:py:class:`DeltaStepWriter` writes a full keyframe every few steps and only
+the agents that changed in between, :py:class:`DeltaStepReader` rebuilds
+any step from the last keyframe before it.
+
+The csv output can be compressed with gzip, lzma or zstd (when the
+zstandard package is installed), see :py:func:`open_text`, and read back one
+step at a time with :py:func:`iter_csv_steps`.
+
+:py:class:`RecordingPolicy` picks the steps and agents that are recorded,
+a :py:class:`PolicyStepWriter` applies it in front of any writer, and
+:py:class:`AggregateStepWriter` only writes per step aggregates.
+
+:py:class:`AsyncStepRecorder` copies the arrays of a step into a free buffer
+and leaves the writing to a background thread, so the next step can run
+while the last one is written.
+"""
+
+import gzip
+import io
+import json
+import logging
+import lzma
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MANNSTEP'
+DELTA_MAGIC = b'MANNDELT'
+VERSION = 1
+# step_update_status stored for None
+NO_STATUS = -1
+# time_step, keyframe or delta, number of agents in the record
+RECORD_HEADER = struct.Struct('<qBq')
+KEYFRAME = 0
+DELTA = 1
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.xz': 'lzma', '.lzma': 'lzma',
+                          '.zst': 'zstd'}
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+def infer_compression(file_path):
+    """Compression of a file from its extension, None for plain files
+    """
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(file_path)[1])
+
+
+def open_text(file_path, mode='r', compression=None, level=None,
+              block_size=DEFAULT_BLOCK_SIZE):
+    """Open a text file, compressed or not
+
+    Compressed files are streams: 'a' adds a new gzip member, xz stream or
+    zstd frame, which are read back as one file.
+
+    :param mode: 'r', 'w' or 'a'
+    :type mode: str
+
+    :param compression: None, 'gzip', 'lzma', 'zstd', or 'infer' to use the
+        file extension (.gz, .xz, .lzma, .zst)
+    :type compression: str
+
+    :param level: compression level, the library default when None
+    :type level: int
+
+    :param block_size: bytes collected before they are passed to the
+        compressor and written
+    :type block_size: int
+
+    :rtype: io.TextIOWrapper
+    """
+    if mode not in ('r', 'w', 'a'):
+        raise ValueError('Unknown file mode: {}'.format(mode))
+    if compression == 'infer':
+        compression = infer_compression(file_path)
+    if compression is None:
+        return open(file_path, mode=mode, encoding='utf-8')
+    if compression == 'gzip':
+        binary = gzip.open(file_path, mode + 'b',
+                           compresslevel=9 if level is None else level)
+    elif compression == 'lzma':
+        binary = lzma.open(file_path, mode + 'b',
+                           preset=None if mode == 'r' else level)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        binary = zstandard.open(
+            file_path, mode + 'b',
+            cctx=zstandard.ZstdCompressor(level=3 if level is None
+                                          else level))
+    else:
+        raise ValueError('Unknown compression: {}'.format(compression))
+    if mode == 'r':
+        binary = io.BufferedReader(binary, buffer_size=block_size)
+    else:
+        binary = io.BufferedWriter(binary, buffer_size=block_size)
+    return io.TextIOWrapper(binary, encoding='utf-8')
+
+
+def iter_csv_steps(file_path, compression='infer'):
+    """Read the csv lines of
+    :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+    one step at a time, decompressing as the file is read
+
+    :returns: iterator of (time_step, lines) with the lines of consecutive
+        agents of the same time step
+    :rtype: iterator
+    """
+    with open_text(file_path, 'r', compression) as f:
+        time_step = None
+        lines = []
+        for line in f:
+            line_step = int(line.split(',', 1)[0])
+            if line_step != time_step and lines:
+                yield (time_step, lines)
+                lines = []
+            time_step = line_step
+            lines.append(line)
+        if lines:
+            yield (time_step, lines)
+
+
+def block_dtype(num_agents, num_state_vars, state_dtype):
+    """numpy dtype of the block written for one step
+
+    :rtype: numpy.dtype
+    """
+    return np.dtype([
+        ('time_step', '<i8'),
+        ('agent_id', '<i8', (num_agents,)),
+        ('num_update', '<i8', (num_agents,)),
+        ('step_update_status', 'i1', (num_agents,)),
+        ('state', np.dtype(state_dtype).newbyteorder('<'),
+         (num_agents, num_state_vars))])
+
+
+def snapshot_agents(agents, num_state_vars=None):
+    """Step info arrays of a list of agents
+
+    :param num_state_vars: number of values in an agent state, needed when
+        agents can be empty
+    :type num_state_vars: int
+
+    :returns: agent_id, num_update, step_update_status and state arrays, the
+        state has one row per agent, an object array when int and float
+        states are mixed so every value keeps its type
+    :rtype: tuple
+    """
+    agent_id = np.array([agent.agent_id for agent in agents], dtype=np.int64)
+    num_update = np.array([agent.num_update for agent in agents],
+                          dtype=np.int64)
+    step_update_status = np.array(
+        [NO_STATUS if getattr(agent, 'step_update_status', None) is None
+         else agent.step_update_status for agent in agents], dtype=np.int8)
+    states = [agent.state for agent in agents]
+    state = np.array(states)
+    if state.dtype.kind == 'f' and \
+       not all(isinstance(value, float) for values in states
+               for value in values):
+        # agents not updated yet have int states, a float array would write
+        # them as 0.0 instead of 0 in the csv lines
+        state = np.array(states, dtype=object)
+    return (agent_id, num_update, step_update_status,
+            state.reshape(len(agents), num_state_vars or -1))
+
+
+def snapshot_network(network_agent):
+    """Step info arrays of the agents of a network, in the order of
+    :py:meth:`mann.network_agent.NetworkAgent.get_agents`, see
+    :py:func:`snapshot_agents`
+    """
+    return snapshot_agents(network_agent.get_agents())
+
+
+def format_csv_lines(time_step, agent_id, num_update, step_update_status,
+                     state, agent_type):
+    """Lines of
+    :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+    for one step of binary or recurrent lens agents
+
+    :param agent_type: 'binary' or 'lens'
+    :type agent_type: str
+
+    :rtype: list
+    """
+    lines = []
+    agent_id = agent_id.tolist()
+    num_update = num_update.tolist()
+    if agent_type == 'binary':
+        status = ['None' if value == NO_STATUS else str(value)
+                  for value in step_update_status.tolist()]
+        for idx, value in enumerate(state[:, 0].tolist()):
+            lines.append(','.join([str(time_step), str(agent_id[idx]),
+                                   str(num_update[idx]), status[idx],
+                                   str(value)]) + '\n')
+    elif agent_type == 'lens':
+        for idx, values in enumerate(state.tolist()):
+            lines.append(','.join([str(time_step), str(agent_id[idx]),
+                                   str(num_update[idx]),
+                                   ', '.join(str(value)
+                                             for value in values)]) + '\n')
+    else:
+        raise ValueError('Unknown agent type for step output: {}'.
+                         format(agent_type))
+    return lines
+
+
+class StepWriter(object):
+    def __init__(self, file_path, agent_id, num_state_vars=1,
+                 state_dtype=np.uint8, agent_type='binary', file_mode='w'):
+        """Append only binary step info file
+
+        :param agent_id: ids of the agents, in the order of the state rows
+        :type agent_id: numpy.ndarray
+
+        :param num_state_vars: number of values in an agent state
+        :type num_state_vars: int
+
+        :param state_dtype: dtype of the state values, uint8 for binary
+            agents, float64 for lens agents
+        :type state_dtype: numpy.dtype
+
+        :param agent_type: 'binary' or 'lens', used for the csv export
+        :type agent_type: str
+
+        :param file_mode: 'w' starts a new file, 'a' appends steps to a file
+            written with the same layout
+        :type file_mode: str
+        """
+        self.file_path = file_path
+        self.agent_id = np.asarray(agent_id, dtype=np.int64)
+        self.header = {'version': VERSION,
+                       'agent_type': agent_type,
+                       'num_agents': len(self.agent_id),
+                       'num_state_vars': num_state_vars,
+                       'state_dtype': np.dtype(state_dtype).str}
+        self.dtype = block_dtype(len(self.agent_id), num_state_vars,
+                                 state_dtype)
+        self._block = np.zeros(1, dtype=self.dtype)
+        self._block['agent_id'] = self.agent_id
+        if file_mode == 'a' and os.path.exists(file_path) and \
+           os.path.getsize(file_path) > 0:
+            header, _ = read_header(file_path)
+            if header != self.header:
+                raise ValueError('{} has a different layout'.
+                                 format(file_path))
+            self._file = open(file_path, 'ab')
+        elif file_mode in ('w', 'a'):
+            self._file = open(file_path, 'wb')
+            header = json.dumps(self.header, sort_keys=True).encode('utf-8')
+            self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        else:
+            raise ValueError('Unknown file mode: {}'.format(file_mode))
+
+    @classmethod
+    def for_network(cls, file_path, network_agent, agent_type='binary',
+                    file_mode='w'):
+        """Writer with the agents and state size of a network
+        """
+        agent_id, _, _, state = snapshot_network(network_agent)
+        state_dtype = np.uint8 if agent_type == 'binary' else np.float64
+        return cls(file_path, agent_id, state.shape[1], state_dtype,
+                   agent_type, file_mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        """Append the block of one step
+
+        :param num_update: number of updates of every agent
+        :type num_update: numpy.ndarray
+
+        :param state: state of every agent, one row per agent
+        :type state: numpy.ndarray
+
+        :param step_update_status: None or -1 for agents without a status
+        :type step_update_status: numpy.ndarray
+        """
+        block = self._block
+        block['time_step'] = time_step
+        block['num_update'] = num_update
+        block['state'] = np.reshape(state, block['state'].shape)
+        if step_update_status is None:
+            block['step_update_status'] = NO_STATUS
+        else:
+            block['step_update_status'] = step_update_status
+        self._file.write(block.tobytes())
+
+    def write_network(self, time_step, network_agent):
+        """Append the block of the agents of a network, see
+        :py:func:`snapshot_network`
+        """
+        _, num_update, step_update_status, state = \
+            snapshot_network(network_agent)
+        self.write_step(time_step, num_update, state, step_update_status)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class CsvStepWriter(object):
+    def __init__(self, file_path, agent_id, agent_type='binary',
+                 file_mode='w', compression=None, compression_level=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        """Writes the csv lines of
+        :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+        with the :py:class:`StepWriter` methods, the file is kept open
+
+        :param compression: compression of the file, see
+            :py:func:`open_text`
+        :type compression: str
+        """
+        self.file_path = file_path
+        self.agent_id = np.asarray(agent_id, dtype=np.int64)
+        self.agent_type = agent_type
+        self._file = open_text(file_path, file_mode, compression,
+                               compression_level, block_size)
+
+    @classmethod
+    def for_network(cls, file_path, network_agent, agent_type='binary',
+                    file_mode='w', **kwargs):
+        agent_id = [agent.agent_id for agent in network_agent.get_agents()]
+        return cls(file_path, agent_id, agent_type, file_mode, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        state = np.reshape(state, (len(self.agent_id), -1))
+        if step_update_status is None:
+            step_update_status = np.full(len(self.agent_id), NO_STATUS)
+        self._file.writelines(format_csv_lines(
+            time_step, self.agent_id, np.asarray(num_update),
+            np.asarray(step_update_status), state, self.agent_type))
+
+    def write_network(self, time_step, network_agent):
+        _, num_update, step_update_status, state = \
+            snapshot_network(network_agent)
+        self.write_step(time_step, num_update, state, step_update_status)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def export_csv(blocks, csv_path, agent_type, file_mode='w'):
+    """Write step blocks as the csv lines of
+    :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+    """
+    with open(csv_path, mode=file_mode, encoding='utf-8') as f:
+        for block in blocks:
+            f.writelines(format_csv_lines(
+                int(block['time_step']), block['agent_id'],
+                block['num_update'], block['step_update_status'],
+                block['state'], agent_type))
+
+
+def read_header(file_path, magic=MAGIC):
+    """Returns the header of a binary step file and the offset of the
+    first block
+
+    :rtype: tuple
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError('{} is not a step output file'.format(file_path))
+        header_size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    return (header, len(MAGIC) + 4 + header_size)
+
+
+class StepReader(object):
+    def __init__(self, file_path):
+        """Reads the blocks of a :py:class:`StepWriter` file, the file is
+        memory mapped so a step is read only when it is used
+        """
+        self.file_path = file_path
+        self.header, self.offset = read_header(file_path)
+        self.dtype = block_dtype(self.header['num_agents'],
+                                 self.header['num_state_vars'],
+                                 self.header['state_dtype'])
+        num_steps = (os.path.getsize(file_path) - self.offset) // \
+            self.dtype.itemsize
+        if num_steps > 0:
+            self.blocks = np.memmap(file_path, dtype=self.dtype, mode='r',
+                                    offset=self.offset, shape=(num_steps,))
+        else:
+            self.blocks = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, idx):
+        """Block of the idx-th step written, with the fields time_step,
+        agent_id, num_update, step_update_status and state
+        """
+        return self.blocks[idx]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.blocks[idx]
+
+    @property
+    def time_steps(self):
+        return np.asarray(self.blocks['time_step'])
+
+    def states(self):
+        """(steps x agents x state values) array of all the states
+        """
+        return np.asarray(self.blocks['state'])
+
+    def export_csv(self, csv_path, file_mode='w'):
+        """Write the steps as the csv lines of
+        :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+        """
+        export_csv(self, csv_path, self.header['agent_type'], file_mode)
+
+
+class AsyncStepRecorder(object):
+    def __init__(self, step_writer, num_buffers=2, backpressure='block',
+                 timeout=None):
+        """Writes steps with step_writer on a background thread
+
+        A step is copied into one of num_buffers preallocated buffers and
+        queued for the writer thread, which returns the buffer once the step
+        is written.  When every buffer is waiting to be written, the
+        backpressure setting decides what happens to the next step:
+
+        - 'block': wait for a buffer, up to timeout seconds (forever when
+          None), then raise queue.Full
+        - 'drop': skip the step, the number of skipped steps is kept in
+          num_dropped
+
+        The output is the same as writing with step_writer directly.  An
+        error in the writer thread is raised by the next call.
+
+        :param step_writer: :py:class:`StepWriter` or :py:class:`CsvStepWriter`
+        :type step_writer: StepWriter
+
+        :param num_buffers: number of steps that can wait to be written
+        :type num_buffers: int
+
+        :param backpressure: 'block' or 'drop'
+        :type backpressure: str
+
+        :param timeout: seconds to wait for a buffer with 'block'
+        :type timeout: float
+        """
+        assert num_buffers > 0, 'num_buffers needs to be greater than 0'
+        if backpressure not in ('block', 'drop'):
+            raise ValueError('Unknown backpressure: {}'.format(backpressure))
+        self.step_writer = step_writer
+        self.num_buffers = num_buffers
+        self.backpressure = backpressure
+        self.timeout = timeout
+        self.num_dropped = 0
+        self._buffers = None
+        self._free = queue.Queue()
+        for idx in range(num_buffers):
+            self._free.put(idx)
+        self._pending = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_steps,
+                                        name='AsyncStepRecorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _allocate(self, num_update, state):
+        # the status buffer is there even when the first step has no
+        # status, later steps can have one
+        self._buffers = [
+            {'num_update': np.empty_like(num_update),
+             'state': np.empty_like(state),
+             'step_update_status': np.full(num_update.shape, NO_STATUS,
+                                           dtype=np.int8)}
+            for _ in range(self.num_buffers)]
+
+    def _check_shapes(self, num_update, state, step_update_status):
+        """Raise a ValueError when a step does not fit the buffers sized
+        from the first step
+        """
+        step_buffer = self._buffers[0]
+        arrays = [('num_update', num_update), ('state', state),
+                  ('step_update_status', step_update_status)]
+        for name, array in arrays:
+            if array is not None and \
+               array.shape != step_buffer[name].shape:
+                raise ValueError(
+                    '{} has shape {}, the first step had {}'.format(
+                        name, array.shape, step_buffer[name].shape))
+
+    def _write_steps(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            time_step, idx = item
+            try:
+                if self._error is None:
+                    step_buffer = self._buffers[idx]
+                    self.step_writer.write_step(
+                        time_step, step_buffer['num_update'],
+                        step_buffer['state'],
+                        step_buffer['step_update_status'])
+            except Exception as e:
+                logger.error('Writing step {} failed: {}'.
+                             format(time_step, e))
+                self._error = e
+            finally:
+                self._free.put(idx)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        """Queue a step, the arrays are copied before this returns, see
+        :py:meth:`StepWriter.write_step`
+
+        :returns: False when the step was dropped
+        :rtype: bool
+        """
+        self._raise_error()
+        num_update = np.asarray(num_update)
+        state = np.asarray(state)
+        if step_update_status is not None:
+            step_update_status = np.asarray(step_update_status)
+        if self._buffers is None:
+            self._allocate(num_update, state)
+        # checked before a buffer is taken, so a bad step does not keep it
+        self._check_shapes(num_update, state, step_update_status)
+        try:
+            if self.backpressure == 'drop':
+                idx = self._free.get_nowait()
+            else:
+                idx = self._free.get(timeout=self.timeout)
+        except queue.Empty:
+            if self.backpressure == 'drop':
+                self.num_dropped += 1
+                logger.debug('Step {} dropped, writer behind'.
+                             format(time_step))
+                return False
+            raise queue.Full('No free step buffer after {} seconds'.
+                             format(self.timeout))
+        step_buffer = self._buffers[idx]
+        np.copyto(step_buffer['num_update'], num_update)
+        np.copyto(step_buffer['state'], state)
+        np.copyto(step_buffer['step_update_status'],
+                  NO_STATUS if step_update_status is None
+                  else step_update_status)
+        self._pending.put((time_step, idx))
+        return True
+
+    def write_network(self, time_step, network_agent):
+        """Queue the step info of the agents of a network, see
+        :py:func:`snapshot_network`
+        """
+        _, num_update, step_update_status, state = \
+            snapshot_network(network_agent)
+        return self.write_step(time_step, num_update, state,
+                               step_update_status)
+
+    def flush(self):
+        """Wait until the queued steps are written, then flush the writer
+        """
+        # every buffer is free once the writer thread is idle
+        taken = [self._free.get() for _ in range(self.num_buffers)]
+        for idx in taken:
+            self._free.put(idx)
+        self._raise_error()
+        self.step_writer.flush()
+
+    def close(self):
+        """Write the queued steps, stop the thread and close the writer
+        """
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        self.step_writer.close()
+        self._raise_error()
+
+
+class DeltaStepWriter(object):
+    def __init__(self, file_path, agent_id, num_state_vars=1,
+                 state_dtype=np.uint8, agent_type='binary',
+                 keyframe_interval=100):
+        """Step info file with only the agents that changed
+
+        Every keyframe_interval steps a keyframe with every agent is
+        written.  The other steps only hold the agents whose state or
+        num_update changed since the last step, or that have a
+        step_update_status, as (agent_id, num_update, step_update_status,
+        state) rows.  The agents not in a step have no step_update_status.
+
+        :param keyframe_interval: steps from one keyframe to the next
+        :type keyframe_interval: int
+
+        See :py:class:`StepWriter` for the other parameters
+        """
+        assert keyframe_interval > 0,\
+            'keyframe_interval needs to be greater than 0'
+        self.file_path = file_path
+        self.agent_id = np.asarray(agent_id, dtype=np.int64)
+        self.keyframe_interval = keyframe_interval
+        self.header = {'version': VERSION,
+                       'agent_type': agent_type,
+                       'num_agents': len(self.agent_id),
+                       'num_state_vars': num_state_vars,
+                       'state_dtype': np.dtype(state_dtype).str,
+                       'keyframe_interval': keyframe_interval}
+        self.state_dtype = np.dtype(state_dtype).newbyteorder('<')
+        self._row = dict((agent_id, idx) for idx, agent_id in
+                         enumerate(self.agent_id.tolist()))
+        self._num_update = np.zeros(len(self.agent_id), dtype=np.int64)
+        self._state = np.zeros((len(self.agent_id), num_state_vars),
+                               dtype=self.state_dtype)
+        self._num_steps = 0
+        self._file = open(file_path, 'wb')
+        header = json.dumps(self.header, sort_keys=True).encode('utf-8')
+        self._file.write(DELTA_MAGIC + struct.pack('<I', len(header)) +
+                         header)
+        self._file.write(self.agent_id.astype('<i8').tobytes())
+
+    @classmethod
+    def for_network(cls, file_path, network_agent, agent_type='binary',
+                    keyframe_interval=100):
+        """Writer with the agents and state size of a network
+        """
+        agent_id, _, _, state = snapshot_network(network_agent)
+        state_dtype = np.uint8 if agent_type == 'binary' else np.float64
+        return cls(file_path, agent_id, state.shape[1], state_dtype,
+                   agent_type, keyframe_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def keyframe_due(self):
+        return self._num_steps % self.keyframe_interval == 0
+
+    def _write_record(self, time_step, kind, rows, num_update, state,
+                      step_update_status):
+        self._file.write(RECORD_HEADER.pack(time_step, kind, len(rows)))
+        if kind == DELTA:
+            self._file.write(self.agent_id[rows].astype('<i8').tobytes())
+        self._file.write(num_update.astype('<i8').tobytes())
+        self._file.write(step_update_status.astype('i1').tobytes())
+        self._file.write(state.astype(self.state_dtype).tobytes())
+        self._num_update[rows] = num_update
+        self._state[rows] = state
+        self._num_steps += 1
+
+    def _write_rows(self, time_step, rows, num_update, state,
+                    step_update_status):
+        """Write the rows that changed out of the rows given
+        """
+        changed = (num_update != self._num_update[rows]) | \
+            (state != self._state[rows]).any(axis=1) | \
+            (step_update_status != NO_STATUS)
+        self._write_record(time_step, DELTA, rows[changed],
+                           num_update[changed], state[changed],
+                           step_update_status[changed])
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        """Write one step from the arrays of every agent, see
+        :py:meth:`StepWriter.write_step`
+        """
+        num_update = np.asarray(num_update, dtype=np.int64)
+        state = np.reshape(state, self._state.shape)
+        if step_update_status is None:
+            step_update_status = np.full(len(self.agent_id), NO_STATUS,
+                                         dtype=np.int8)
+        step_update_status = np.asarray(step_update_status, dtype=np.int8)
+        rows = np.arange(len(self.agent_id))
+        if self.keyframe_due:
+            self._write_record(time_step, KEYFRAME, rows, num_update, state,
+                               step_update_status)
+        else:
+            self._write_rows(time_step, rows, num_update, state,
+                             step_update_status)
+
+    def write_network(self, time_step, network_agent, agents=None):
+        """Write one step of the agents of a network
+
+        :param agents: the only agents that can have changed since the last
+            step, e.g. the agents sampled for the updates of the step, every
+            agent is read when None or when a keyframe is due
+        :type agents: list
+        """
+        if agents is None or self.keyframe_due:
+            _, num_update, step_update_status, state = \
+                snapshot_network(network_agent)
+            self.write_step(time_step, num_update, state, step_update_status)
+            return
+        # the agents sampled in several updates of a step are written once
+        agents = dict((self._row[agent.agent_id], agent) for agent in agents)
+        rows = sorted(agents)
+        _, num_update, step_update_status, state = snapshot_agents(
+            [agents[row] for row in rows], self._state.shape[1])
+        self._write_rows(time_step, np.array(rows, dtype=np.int64),
+                         num_update, state, step_update_status)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class DeltaStepReader(object):
+    def __init__(self, file_path):
+        """Reads a :py:class:`DeltaStepWriter` file, the positions of the
+        records are read once so any step can be rebuilt from the keyframe
+        before it
+        """
+        self.file_path = file_path
+        self.header, offset = read_header(file_path, magic=DELTA_MAGIC)
+        num_agents = self.header['num_agents']
+        num_state_vars = self.header['num_state_vars']
+        self.state_dtype = np.dtype(self.header['state_dtype'])
+        self.dtype = block_dtype(num_agents, num_state_vars, self.state_dtype)
+        self._row_size = 8 + 1 + num_state_vars * self.state_dtype.itemsize
+        self._records = []
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            self.agent_id = np.frombuffer(f.read(8 * num_agents), '<i8')
+            self._row = dict((agent_id, idx) for idx, agent_id in
+                             enumerate(self.agent_id.tolist()))
+            while True:
+                record_header = f.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    break
+                time_step, kind, count = RECORD_HEADER.unpack(record_header)
+                self._records.append((time_step, kind, count, f.tell()))
+                id_size = 8 * count if kind == DELTA else 0
+                f.seek(id_size + count * self._row_size, os.SEEK_CUR)
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def time_steps(self):
+        return np.array([record[0] for record in self._records],
+                        dtype=np.int64)
+
+    def _read_record(self, f, idx):
+        time_step, kind, count, offset = self._records[idx]
+        f.seek(offset)
+        if kind == DELTA:
+            rows = np.array([self._row[agent_id] for agent_id in
+                             np.frombuffer(f.read(8 * count), '<i8').tolist()],
+                            dtype=np.int64)
+        else:
+            rows = np.arange(count)
+        num_update = np.frombuffer(f.read(8 * count), '<i8')
+        step_update_status = np.frombuffer(f.read(count), 'i1')
+        state = np.frombuffer(
+            f.read(count * self.header['num_state_vars'] *
+                   self.state_dtype.itemsize), self.state_dtype).\
+            reshape(count, -1)
+        return (time_step, rows, num_update, step_update_status, state)
+
+    def _apply(self, block, record):
+        time_step, rows, num_update, step_update_status, state = record
+        block['time_step'] = time_step
+        block['step_update_status'] = NO_STATUS
+        block['num_update'][rows] = num_update
+        block['step_update_status'][rows] = step_update_status
+        block['state'][rows] = state
+
+    def _new_block(self):
+        block = np.zeros((), dtype=self.dtype)
+        block['agent_id'] = self.agent_id
+        return block
+
+    def __getitem__(self, idx):
+        """Block of the idx-th step written, the same fields as
+        :py:meth:`StepReader.__getitem__`
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('step index out of range')
+        keyframe = idx
+        while self._records[keyframe][1] != KEYFRAME:
+            keyframe -= 1
+        block = self._new_block()
+        with open(self.file_path, 'rb') as f:
+            for record_idx in range(keyframe, idx + 1):
+                self._apply(block, self._read_record(f, record_idx))
+        return block
+
+    def __iter__(self):
+        block = self._new_block()
+        with open(self.file_path, 'rb') as f:
+            for idx in range(len(self)):
+                self._apply(block, self._read_record(f, idx))
+                yield block.copy()
+
+    def export_csv(self, csv_path, file_mode='w'):
+        """Write the steps as the csv lines of
+        :py:meth:`mann.network_agent.NetworkAgent.write_network_agent_step_info`
+        """
+        export_csv(self, csv_path, self.header['agent_type'], file_mode)
+
+
+def step_aggregates(num_update, state, agent_type):
+    """Aggregates of one step
+
+    :returns: number of agents, total number of updates, then the fraction
+        of agents in state 1 for binary agents, or the mean of the positive
+        and of the negative bank for lens agents
+    :rtype: list
+    """
+    state = np.asarray(state, dtype=float).reshape(len(num_update), -1)
+    values = [len(num_update), int(np.sum(num_update))]
+    if agent_type == 'binary':
+        values.append(float(state[:, 0].mean()) if len(state) else 0.0)
+    elif agent_type == 'lens':
+        per_bank = state.shape[1] // 2
+        for bank in [state[:, :per_bank], state[:, per_bank:]]:
+            values.append(float(bank.mean()) if bank.size else 0.0)
+    else:
+        raise ValueError('Unknown agent type for step output: {}'.
+                         format(agent_type))
+    return values
+
+
+class AggregateStepWriter(object):
+    def __init__(self, file_path, agent_type='binary', file_mode='w',
+                 compression=None, compression_level=None):
+        """Writes one csv line of aggregates per step instead of a line per
+        agent, see :py:func:`step_aggregates`
+
+        The columns are time_step, num_agents, num_update (the total),
+        step_updates (the updates since the last line) and fraction_active
+        for binary agents, or mean_pos and mean_neg for lens agents.
+
+        :param compression: compression of the file, see
+            :py:func:`open_text`
+        :type compression: str
+        """
+        self.file_path = file_path
+        self.agent_type = agent_type
+        self._last_num_update = 0
+        self._file = open_text(file_path, file_mode, compression,
+                               compression_level)
+        if agent_type == 'binary':
+            columns = ['fraction_active']
+        else:
+            columns = ['mean_pos', 'mean_neg']
+        if file_mode == 'w':
+            self._file.write(','.join(['time_step', 'num_agents',
+                                       'num_update', 'step_updates'] +
+                                      columns) + '\n')
+
+    @classmethod
+    def for_network(cls, file_path, network_agent, agent_type='binary',
+                    file_mode='w', **kwargs):
+        return cls(file_path, agent_type, file_mode, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        values = step_aggregates(num_update, state, self.agent_type)
+        step_updates = values[1] - self._last_num_update
+        self._last_num_update = values[1]
+        values = [time_step] + values[:2] + [step_updates] + values[2:]
+        self._file.write(','.join(str(value) for value in values) + '\n')
+
+    def write_network(self, time_step, network_agent):
+        _, num_update, step_update_status, state = \
+            snapshot_network(network_agent)
+        self.write_step(time_step, num_update, state, step_update_status)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class RecordingPolicy(object):
+    def __init__(self, every=1, agent_id=None):
+        """Which steps and agents are recorded
+
+        :param every: record the steps whose time_step is a multiple of
+            every
+        :type every: int
+
+        :param agent_id: ids of the agents recorded, every agent when None
+        :type agent_id: list
+        """
+        assert every > 0, 'every needs to be greater than 0'
+        self.every = every
+        self.agent_id = None if agent_id is None else \
+            np.asarray(agent_id, dtype=np.int64)
+
+    @classmethod
+    def sampled(cls, agent_id, num_agents, every=1, seed=None):
+        """Policy recording num_agents agents drawn at random from agent_id,
+        kept in the order of agent_id
+
+        :param seed: seed or numpy RandomState
+        :type seed: int
+        """
+        if not isinstance(seed, np.random.RandomState):
+            seed = np.random.RandomState(seed)
+        agent_id = np.asarray(agent_id, dtype=np.int64)
+        picked = np.sort(seed.choice(len(agent_id), num_agents,
+                                     replace=False))
+        return cls(every, agent_id[picked])
+
+    def records(self, time_step):
+        return time_step % self.every == 0
+
+    def select(self, agent_id):
+        """Positions in agent_id of the recorded agents
+
+        :rtype: numpy.ndarray
+        """
+        agent_id = np.asarray(agent_id, dtype=np.int64)
+        if self.agent_id is None:
+            return np.arange(len(agent_id))
+        position = dict((value, idx) for idx, value in
+                        enumerate(agent_id.tolist()))
+        missing = [value for value in self.agent_id.tolist()
+                   if value not in position]
+        if missing:
+            raise ValueError('Agents not in the network: {}'.format(missing))
+        return np.array([position[value] for value in
+                         self.agent_id.tolist()], dtype=np.int64)
+
+    def recorded_agent_id(self, agent_id):
+        """Ids of the recorded agents, to create the wrapped writer with
+        """
+        return np.asarray(agent_id, dtype=np.int64)[self.select(agent_id)]
+
+
+class PolicyStepWriter(object):
+    def __init__(self, step_writer, policy, agent_id):
+        """Passes the steps and agents picked by a :py:class:`RecordingPolicy`
+        on to step_writer, skipped steps are not read at all
+
+        :param step_writer: writer created for
+            `policy.recorded_agent_id(agent_id)`, or an
+            :py:class:`AggregateStepWriter`
+        :type step_writer: StepWriter
+
+        :param policy: steps and agents to record
+        :type policy: RecordingPolicy
+
+        :param agent_id: ids of all the agents, in the order of the arrays
+            passed to :py:meth:`write_step`
+        :type agent_id: list
+        """
+        self.step_writer = step_writer
+        self.policy = policy
+        self.agent_id = np.asarray(agent_id, dtype=np.int64)
+        self.rows = policy.select(self.agent_id)
+
+    @classmethod
+    def for_network(cls, step_writer, policy, network_agent):
+        return cls(step_writer, policy,
+                   [agent.agent_id for agent in network_agent.get_agents()])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        """Write the recorded agents if the step is recorded
+
+        :returns: True when the step was recorded
+        :rtype: bool
+        """
+        if not self.policy.records(time_step):
+            return False
+        state = np.reshape(state, (len(self.agent_id), -1))
+        if step_update_status is not None:
+            step_update_status = np.asarray(step_update_status)[self.rows]
+        self.step_writer.write_step(time_step,
+                                    np.asarray(num_update)[self.rows],
+                                    state[self.rows], step_update_status)
+        return True
+
+    def write_network(self, time_step, network_agent):
+        """Write the recorded agents of a network if the step is recorded,
+        only those agents are read
+        """
+        if not self.policy.records(time_step):
+            return False
+        agents = network_agent.get_agents()
+        _, num_update, step_update_status, state = snapshot_agents(
+            [agents[row] for row in self.rows.tolist()])
+        self.step_writer.write_step(time_step, num_update, state,
+                                    step_update_status)
+        return True
+
+    def flush(self):
+        self.step_writer.flush()
+
+    def close(self):
+        self.step_writer.close()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+"""Content addressed store of trained LENS weight files
+
+Every run folder created by :py:mod:`mann.batch_sweep` trains the weights of
+every agent again, even when the training examples and the LENS parameters
+are the same as in an earlier run.  A :py:class:`WeightStore` keeps trained
+.wt files keyed by the hash of everything that goes into the training, so
+later runs can hard link the stored file instead of calling LENS.
+
+A fetched weight file is the same file as the store entry, so the entries
+are read only and a weight file is removed with
+:py:func:`detach_weight_file` before LENS trains new weights into it,
+otherwise `saveWeights` would overwrite the stored weights of every run that
+fetched them.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def detach_weight_file(weight_file_path):
+    """Remove weight_file_path before new weights are written to it, so a
+    file hard linked to a store entry is not written in place
+    """
+    if os.path.lexists(weight_file_path):
+        os.remove(weight_file_path)
+
+
+class WeightStore(object):
+    def __init__(self, root, max_bytes=None):
+        """
+        :param root: directory the weight files are stored in, shared by
+            all the runs of a sweep
+        :type root: str
+
+        :param max_bytes: size of the store, the least recently used files
+            are evicted when the store grows past this size, no limit if None
+        :type max_bytes: int
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    @staticmethod
+    def make_key(ex_content, lens_parameters, seed=None, in_file_path=None):
+        """Returns the key of a trained weight file
+
+        :param ex_content: contents of the training .ex file
+        :type ex_content: str
+
+        :param lens_parameters: parameters passed to LENS for the training,
+            e.g. criterion or the bm/bs/wm/ws/cs values
+        :type lens_parameters: dict
+
+        :param seed: random seed used for the training
+        :type seed: int
+
+        :param in_file_path: .in file used for the training, its contents
+            are part of the key
+        :type in_file_path: str
+
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(ex_content.encode('utf-8'))
+        for key in sorted(lens_parameters):
+            digest.update('\0{}={}'.format(
+                key, lens_parameters[key]).encode('utf-8'))
+        digest.update('\0seed={}'.format(seed).encode('utf-8'))
+        if in_file_path is not None:
+            with open(in_file_path, 'rb') as f:
+                digest.update(b'\0')
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + '.wt')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def fetch(self, key, weight_file_path):
+        """Put the stored weight file for key at weight_file_path
+
+        The file is hard linked, or copied when linking is not possible.
+        A hard linked file is read only, see :py:func:`detach_weight_file`
+
+        :returns: False if there is no weight file stored for key
+        :rtype: bool
+        """
+        stored_path = self.path_for(key)
+        if not os.path.exists(stored_path):
+            return False
+        directory = os.path.dirname(os.path.abspath(weight_file_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        detach_weight_file(weight_file_path)
+        try:
+            os.link(stored_path, weight_file_path)
+        except OSError:
+            shutil.copyfile(stored_path, weight_file_path)
+        # the modification time orders files for eviction
+        os.utime(stored_path, None)
+        logger.debug('Weight store hit {} -> {}'.
+                     format(key, weight_file_path))
+        return True
+
+    def store(self, key, weight_file_path):
+        """Add a trained weight file to the store under key
+        """
+        stored_path = self.path_for(key)
+        directory = os.path.dirname(stored_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # copy to a temporary file first, so a concurrent fetch never sees
+        # a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(weight_file_path, temp_path)
+        os.chmod(temp_path, READ_ONLY)
+        os.replace(temp_path, stored_path)
+        logger.debug('Weight store added {}'.format(key))
+        self.evict()
+
+    def size(self):
+        """Total size in bytes of the stored weight files
+        """
+        return sum(os.path.getsize(path) for path in self._stored_paths())
+
+    def _stored_paths(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.wt'):
+                    yield os.path.join(directory, name)
+
+    def evict(self):
+        """Remove the least recently used files until the store fits in
+        max_bytes
+        """
+        if self.max_bytes is None:
+            return
+        stored = []
+        for path in self._stored_paths():
+            try:
+                stored.append((os.path.getmtime(path),
+                               os.path.getsize(path), path))
+            except OSError:
+                # evicted by another process or thread
+                pass
+        stored.sort()
+        total = sum(size for _, size, _ in stored)
+        for _, size, path in stored:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            logger.debug('Weight store evicted {}'.format(path))
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+import random
+
+import networkx as nx
+import numpy
+import numpy.testing
+
+from mann import agent_population
+from mann import binary_engine
+from mann import network_agent
+
+from tests.test_binary_engine import create_network
+
+
+def create_population_network(num_agents=40, num_edges=160, seed=42):
+    """The network of create_network, with agents from a population"""
+    rng = random.Random(seed)
+    population = agent_population.AgentPopulation.binary(num_agents, 0, 2)
+    for view in population:
+        view.threshold = rng.choice([0.1, 0.2, 0.3])
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(population)
+    for _ in range(num_edges):
+        u, v = rng.sample(list(population), 2)
+        test_network.G.add_edge(u, v)
+    test_network.set_predecessors_for_each_node()
+    for seeded_agent in rng.sample(list(population), 3):
+        seeded_agent.seed_agent()
+    return population, test_network
+
+
+def test_binary_view_api():
+    population = agent_population.AgentPopulation.binary(3, 0.5, 1,
+                                                         first_agent_id=10)
+    view = population[1]
+    assert not hasattr(view, '__dict__')
+    assert view.agent_id == 11
+    assert view.get_key() == 11
+    assert view.state == 0
+    view.seed_agent()
+    assert population.state[1, 0] == 1
+    view.temp_new_state = 0
+    assert view.temp_new_state == 0
+    view.reset_step_variables()
+    assert view.temp_new_state is None
+    assert view.step_update_status is None
+    view.num_update += 1
+    assert population.num_update.tolist() == [0, 1, 0]
+
+
+def test_population_update_simultaneous():
+    for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+        test_network = create_network()
+        population, population_network = create_population_network()
+        random.seed(1)
+        for step in range(10):
+            test_network.update_simultaneous(10, update_algorithm)
+        random.seed(1)
+        for step in range(10):
+            population_network.update_simultaneous(10, update_algorithm)
+        assert population.state[:, 0].tolist() == \
+            [node.state for node in test_network.G.nodes()]
+        assert population.num_flipped.tolist() == \
+            [node.num_flipped for node in test_network.G.nodes()]
+
+
+def test_engine_shares_population_arrays():
+    population, population_network = create_population_network()
+    engine = binary_engine.BinaryEngine.from_population(population)
+    random.seed(1)
+    for step in range(10):
+        engine.update(10, 'threshold_watts')
+    assert engine.state.base is population.state
+    assert [view.state for view in population] == engine.state.tolist()
+    assert [view.num_update for view in population] == \
+        population.num_update.tolist()
+
+
+def test_lens_recurrent_view_numpy_update():
+    population = agent_population.AgentPopulation.lens_recurrent(2, 4)
+    population[0].state = [1, 1, 0, 0]
+    population[1].set_predecessors([population[0]])
+    lens_parameters = {'between_mean': -1, 'between_sd': 0.1,
+                       'within_mean': 0.5, 'within_sd': 0.1,
+                       'clamp_strength': 0.5}
+    population[1].create_weights_numpy(random_state=0, **lens_parameters)
+    population[1].update_agent_state('sequential', 'random_1', None,
+                                     lens_parameters=lens_parameters,
+                                     backend='numpy')
+    assert population.state.dtype == numpy.float64
+    assert population[1].state == population.state[1].tolist()
+    assert population.state[1, 0] > population.state[1, 2]
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+import random
+
+import numpy
+import numpy.testing
+
+from mann import batch_engine
+from mann import binary_engine
+
+from tests.test_binary_engine import create_network
+
+
+def test_pack_unpack_replicates():
+    bits = numpy.random.RandomState(0).randint(0, 2, size=(5, 70))
+    words = batch_engine.pack_replicates(bits)
+    assert words.shape == (5, 2)
+    assert words.dtype == numpy.uint64
+    assert int(words[0, 0]) & 1 == bits[0, 0]
+    numpy.testing.assert_array_equal(
+        batch_engine.unpack_replicates(words, 70), bits)
+
+
+def test_csr_column_sums():
+    indptr = numpy.array([0, 0, 2, 3])
+    indices = numpy.array([0, 2, 1])
+    values = numpy.array([[1, 0], [1, 1], [0, 1]])
+    numpy.testing.assert_array_equal(
+        batch_engine.csr_column_sums(indptr, indices, values),
+        [[0, 0], [1, 1], [1, 1]])
+
+
+def test_replicates_match_binary_engine():
+    num_replicates = 70
+    engine = batch_engine.ReplicateEngine.from_network(
+        create_network(), num_replicates, random_state=0)
+    engine.state = numpy.zeros((engine.num_agents, num_replicates))
+    engine.seed_random(2)
+    seeds = engine.state
+    sizes = engine.run(50, engine.num_agents)
+
+    for replicate in [0, 33, 64, 69]:
+        single = binary_engine.BinaryEngine.from_network(create_network())
+        single.state[:] = seeds[:, replicate]
+        for step in range(50):
+            single.update(len(single), 'threshold_watts')
+        assert sizes[replicate] == single.state.sum()
+        numpy.testing.assert_array_equal(engine.state[:, replicate],
+                                         single.state)
+        numpy.testing.assert_array_equal(engine.num_update[:, replicate],
+                                         single.num_update)
+
+
+def test_replicates_partial_sampling_match_binary_engine():
+    num_replicates, num_agents_update = 70, 10
+    engine = batch_engine.ReplicateEngine.from_network(
+        create_network(), num_replicates, random_state=3)
+    engine.state = numpy.zeros((engine.num_agents, num_replicates))
+    engine.seed_random(2)
+    seeds = engine.state
+    engine.run(30, num_agents_update)
+
+    # the same draws as the engine: the seeds, then one mask per step
+    random_state = numpy.random.RandomState(3)
+    batch_engine.sample_columns(engine.num_agents, num_replicates, 2,
+                                random_state)
+    masks = [batch_engine.sample_columns(engine.num_agents, num_replicates,
+                                         num_agents_update, random_state)
+             for step in range(30)]
+    for replicate in [0, 33, 64, 69]:
+        single = binary_engine.BinaryEngine.from_network(create_network())
+        single.state[:] = seeds[:, replicate]
+        for mask in masks:
+            single.update_simultaneous(numpy.flatnonzero(mask[:, replicate]),
+                                       'threshold_watts')
+        assert single.state.sum() > seeds[:, replicate].sum()
+        numpy.testing.assert_array_equal(engine.state[:, replicate],
+                                         single.state)
+        numpy.testing.assert_array_equal(engine.num_update[:, replicate],
+                                         single.num_update)
+
+
+def test_threshold_counts():
+    numpy.testing.assert_array_equal(
+        batch_engine.threshold_counts([0, 3, 10, 4, 5],
+                                      [0.1, 0.3, 0.3, 0.5, 2.0]),
+        [1, 1, 3, 2, 6])
+
+
+def test_parameter_batch_matches_binary_engine():
+    thresholds = [0.1, 0.2, 0.3, 0.5]
+    max_flips = [1, 2, 2, 3]
+    for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+        for update_type in ['simultaneous', 'sequential']:
+            batch = batch_engine.ParameterBatchEngine.from_network(
+                create_network(), thresholds, max_flips)
+            random.seed(7)
+            for step in range(15):
+                batch.update(10, update_algorithm, update_type=update_type)
+
+            for column, (threshold, flips) in enumerate(zip(thresholds,
+                                                             max_flips)):
+                single = binary_engine.BinaryEngine.from_network(
+                    create_network())
+                single.threshold[:] = threshold
+                single.max_flips[:] = flips
+                random.seed(7)
+                for step in range(15):
+                    single.update(10, update_algorithm,
+                                  update_type=update_type)
+                numpy.testing.assert_array_equal(batch.state[:, column],
+                                                 single.state)
+                numpy.testing.assert_array_equal(
+                    batch.num_update[:, column], single.num_update)
+                numpy.testing.assert_array_equal(
+                    batch.num_flipped[:, column], single.num_flipped)
+                numpy.testing.assert_array_equal(
+                    batch.step_update_status[:, column],
+                    single.step_update_status)
+            assert batch.cascade_sizes().shape == (4,)
@@ -0,0 +1,323 @@
+#! /usr/bin/env python
+import os
+import random
+import shutil
+import tempfile
+
+import networkx as nx
+import numpy
+
+from mann import agent_binary
+from mann import binary_engine
+from mann import graph_core
+from mann import network_agent
+
+
+def create_network(num_agents=40, num_edges=160, seed=42):
+    """Random binary network, the same network for the same seed"""
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    rng = random.Random(seed)
+    agents = [agent_binary.BinaryAgent(rng.choice([0.1, 0.2, 0.3]), 2)
+              for i in range(num_agents)]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    for _ in range(num_edges):
+        u, v = rng.sample(agents, 2)
+        test_network.G.add_edge(u, v)
+    test_network.set_predecessors_for_each_node()
+    for seeded_agent in rng.sample(agents, 3):
+        seeded_agent.seed_agent()
+    return test_network
+
+
+def run_python(update_algorithm, num_steps, step_file):
+    test_network = create_network()
+    random.seed(1)
+    for step in range(num_steps):
+        test_network.update_simultaneous(10, update_algorithm)
+        test_network.write_network_agent_step_info(step, step_file, 'a',
+                                                   'binary')
+    return test_network
+
+
+def run_engine(update_algorithm, num_steps, step_file):
+    test_network = create_network()
+    engine = binary_engine.BinaryEngine.from_network(test_network)
+    random.seed(1)
+    for step in range(num_steps):
+        engine.update(10, update_algorithm)
+        engine.write_step_info(step, step_file)
+    return engine
+
+
+def test_active_counts():
+    test_network = create_network()
+    engine = binary_engine.BinaryEngine.from_network(test_network)
+    for idx, node in enumerate(test_network.G.nodes()):
+        expected = sum(predecessor.state
+                       for predecessor in node.predecessors)
+        assert engine.active_counts()[idx] == expected
+        assert engine.in_degree[idx] == len(node.predecessors)
+
+
+def test_simultaneous_matches_network_agent():
+    test_dir = tempfile.mkdtemp()
+    for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+        python_file = os.path.join(test_dir, update_algorithm + '_py.csv')
+        engine_file = os.path.join(test_dir, update_algorithm + '_np.csv')
+        test_network = run_python(update_algorithm, 15, python_file)
+        engine = run_engine(update_algorithm, 15, engine_file)
+        with open(python_file) as f_python, open(engine_file) as f_engine:
+            assert f_python.read() == f_engine.read()
+
+        engine.sync_to_agents()
+        for engine_agent, python_agent in zip(engine.agents,
+                                              test_network.G.nodes()):
+            assert engine_agent.state == python_agent.state
+            assert engine_agent.num_update == python_agent.num_update
+            assert engine_agent.num_flipped == python_agent.num_flipped
+    shutil.rmtree(test_dir)
+
+
+def test_sequential_matches_agents():
+    for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+        test_network = create_network()
+        random.seed(3)
+        for step in range(10):
+            for selected_agent in test_network.sample_network(10):
+                if selected_agent.has_predecessor():
+                    selected_agent.update_agent_state('sequential',
+                                                      update_algorithm)
+
+        engine = binary_engine.BinaryEngine.from_network(create_network())
+        random.seed(3)
+        for step in range(10):
+            engine.update(10, update_algorithm, update_type='sequential')
+        assert engine.state.tolist() == \
+            [node.state for node in test_network.G.nodes()]
+        assert engine.num_flipped.tolist() == \
+            [node.num_flipped for node in test_network.G.nodes()]
+
+
+def test_successor_csr():
+    indptr = [0, 0, 1, 3]
+    indices = [0, 0, 1]
+    out_indptr, out_indices = binary_engine.successor_csr(
+        numpy.array(indptr), numpy.array(indices))
+    assert out_indptr.tolist() == [0, 2, 3, 3]
+    assert out_indices.tolist() == [1, 2, 2]
+
+
+def test_cascade_engine_matches_engine():
+    for num_agents_update in [10, 40]:
+        engine = binary_engine.BinaryEngine.from_network(create_network())
+        cascade = binary_engine.WattsCascadeEngine.from_network(
+            create_network())
+        random.seed(5)
+        states = []
+        for step in range(20):
+            engine.update(num_agents_update, 'threshold_watts')
+            states.append(engine.state.copy())
+        random.seed(5)
+        for step in range(20):
+            cascade.update(num_agents_update)
+            assert (cascade.state == states[step]).all()
+        assert (cascade.num_update == engine.num_update).all()
+        assert (cascade.counts == cascade.active_counts()).all()
+    assert cascade.is_settled()
+    assert cascade.cascade_size() == int(engine.state.sum())
+
+
+def test_frontier_scheduler_matches_engine():
+    for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+        for update_type in ['simultaneous', 'sequential']:
+            scheduler = binary_engine.FrontierScheduler(
+                binary_engine.BinaryEngine.from_network(create_network()))
+            random.seed(11)
+            stop_step = scheduler.run(200, 10, update_algorithm,
+                                      update_type=update_type)
+            assert scheduler.stop_reason == 'fixed_point'
+            assert stop_step < 199
+
+            engine = binary_engine.BinaryEngine.from_network(
+                create_network())
+            random.seed(11)
+            for step in range(stop_step + 1):
+                engine.update(10, update_algorithm, update_type=update_type)
+            for name in ['state', 'num_update', 'num_flipped',
+                         'step_update_status']:
+                assert (getattr(scheduler.engine, name) ==
+                        getattr(engine, name)).all()
+
+            # nothing changes after the fixed point
+            state = engine.state.copy()
+            num_flipped = engine.num_flipped.copy()
+            for step in range(20):
+                engine.update(len(engine), update_algorithm,
+                              update_type=update_type)
+            assert (engine.state == state).all()
+            assert (engine.num_flipped == num_flipped).all()
+
+
+def test_frontier_scheduler_sequential_random_seeds():
+    # an agent whose predecessor flips earlier in the same step has to be
+    # updated in that step
+    for seed in range(40):
+        for update_algorithm in ['threshold_watts', 'threshold_watts_flip']:
+            for num_agents_update in [5, 20]:
+                scheduler = binary_engine.FrontierScheduler(
+                    binary_engine.BinaryEngine.from_network(
+                        create_network(seed=seed)))
+                engine = binary_engine.BinaryEngine.from_network(
+                    create_network(seed=seed))
+                random.seed(seed)
+                for step in range(15):
+                    scheduler.update(num_agents_update, update_algorithm,
+                                     update_type='sequential')
+                random.seed(seed)
+                for step in range(15):
+                    engine.update(num_agents_update, update_algorithm,
+                                  update_type='sequential')
+                for name in ['state', 'num_update', 'num_flipped',
+                             'step_update_status']:
+                    assert (getattr(scheduler.engine, name) ==
+                            getattr(engine, name)).all(), \
+                        (seed, update_algorithm, num_agents_update, name)
+
+
+def create_blinking_network(max_flips):
+    """Ring of 4 agents with threshold 0, they flip on every update, and a
+    pair of agents that agree with their predecessor"""
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    ring = [agent_binary.BinaryAgent(0.0, max_flips) for _ in range(4)]
+    pair = [agent_binary.BinaryAgent(0.5, max_flips) for _ in range(2)]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(ring + pair)
+    for idx, agent in enumerate(ring):
+        test_network.G.add_edge(agent, ring[(idx + 1) % 4])
+    test_network.G.add_edge(pair[0], pair[1])
+    test_network.G.add_edge(pair[1], pair[0])
+    test_network.set_predecessors_for_each_node()
+    ring[0].seed_agent()
+    return test_network
+
+
+def test_frontier_scheduler_period_2():
+    scheduler = binary_engine.FrontierScheduler(
+        binary_engine.BinaryEngine.from_network(
+            create_blinking_network(float('inf'))))
+    random.seed(3)
+    stop_step = scheduler.run(50, 6, 'threshold_watts_flip',
+                              update_type='sequential')
+    assert scheduler.stop_reason == 'period_2'
+    assert stop_step == 2
+
+    # the states keep alternating in any order
+    engine = scheduler.engine
+    states = [engine.state.copy()]
+    for step in range(10):
+        engine.update(6, 'threshold_watts_flip', update_type='sequential')
+        states.append(engine.state.copy())
+    for step in range(2, 11):
+        assert (states[step] == states[step - 2]).all()
+        assert not (states[step] == states[step - 1]).all()
+
+    # with max_flips the ring stops flipping
+    scheduler = binary_engine.FrontierScheduler(
+        binary_engine.BinaryEngine.from_network(create_blinking_network(3)))
+    random.seed(3)
+    scheduler.run(50, 6, 'threshold_watts_flip', update_type='sequential')
+    assert scheduler.stop_reason == 'fixed_point'
+
+
+def test_frontier_scheduler_order_dependent_sweep():
+    # 2 agents copying each other: the result of a sweep depends on which
+    # agent goes first, it is not reported as an oscillation
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    agents = [agent_binary.BinaryAgent(0.5, float('inf')) for _ in range(2)]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_edge(agents[0], agents[1])
+    test_network.G.add_edge(agents[1], agents[0])
+    test_network.set_predecessors_for_each_node()
+    agents[0].seed_agent()
+    scheduler = binary_engine.FrontierScheduler(
+        binary_engine.BinaryEngine.from_network(test_network))
+    state = scheduler.engine.state.copy()
+    assert scheduler._sweep(state) is None
+    random.seed(0)
+    scheduler.run(20, 2, 'threshold_watts_flip', update_type='sequential')
+    assert scheduler.stop_reason == 'fixed_point'
+
+
+def test_compact_graph_predecessors():
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    rng = random.Random(5)
+    edges = [tuple(rng.sample(range(20), 2)) for _ in range(60)]
+    test_network = network_agent.NetworkAgent()
+    test_network.create_agents_from_edge_list(
+        20, edges, agent_type=('binary', 0.1, 2), add_reverse_edge=True)
+    test_network.set_predecessors_for_each_node()
+    # no networkx graph until G is used
+    assert test_network._G is None
+    agents = test_network.get_agents()
+    for idx, node in enumerate(agents):
+        # in the order of the first edge from each predecessor
+        expected = []
+        for u, v in edges:
+            for source, target in [(u, v), (v, u)]:
+                if target == idx and agents[source] not in expected:
+                    expected.append(agents[source])
+        assert list(node.predecessors) == expected
+        assert list(test_network.G.predecessors(node)) == expected
+    engine = binary_engine.BinaryEngine.from_network(test_network)
+    assert engine.indices is test_network.graph.in_indices
+    indptr, indices = binary_engine.predecessor_csr(engine.agents)
+    for idx in range(len(engine)):
+        assert sorted(engine.indices[engine.indptr[idx]:
+                                     engine.indptr[idx + 1]]) == \
+            indices[indptr[idx]:indptr[idx + 1]].tolist()
+
+
+def test_compact_graph_input_predecessors():
+    # an edge list and its CompactGraph give the same predecessors
+    for seed in range(10):
+        rng = random.Random(seed)
+        edges = [tuple(rng.sample(range(20), 2)) for _ in range(60)]
+        predecessors = []
+        for edge_list in [edges,
+                          graph_core.CompactGraph.from_edge_list(20, edges)]:
+            agent_binary.BinaryAgent.binary_agent_count = 0
+            test_network = network_agent.NetworkAgent()
+            test_network.create_agents_from_edge_list(
+                20, edge_list, agent_type=('binary', 0.1, 2),
+                add_reverse_edge=True)
+            test_network.set_predecessors_for_each_node()
+            predecessors.append([[pred.agent_id for pred in node.predecessors]
+                                 for node in test_network.get_agents()])
+        assert predecessors[0] == predecessors[1]
+
+
+def test_compact_graph_dropped_when_g_changes():
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    test_network = network_agent.NetworkAgent()
+    test_network.create_agents_from_edge_list(
+        3, [(0, 1), (1, 2)], agent_type=('binary', 0.1, 2))
+    agents = test_network.get_agents()
+    # editing G built from the compact graph
+    test_network.G.add_edge(agents[2], agents[0])
+    assert test_network.get_agents() == agents
+    assert test_network.graph is None
+    test_network.set_predecessors_for_each_node()
+    assert agents[0].predecessors == [agents[2]]
+
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    test_network.create_agents_from_edge_list(
+        3, [(0, 1), (1, 2)], agent_type=('binary', 0.1, 2))
+    assert test_network.graph is not None
+    # assigning G replaces the compact graph
+    test_network.G = nx.MultiDiGraph()
+    assert test_network.graph is None
+    assert test_network.get_agents() == []
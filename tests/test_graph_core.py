@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+import random
+
+import networkx as nx
+import numpy
+
+from mann import graph_core
+
+
+def random_edges(num_nodes=30, num_edges=200, seed=3):
+    rng = random.Random(seed)
+    return [tuple(rng.sample(range(num_nodes), 2)) for _ in range(num_edges)]
+
+
+def test_matches_networkx():
+    edges = random_edges()
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(range(30))
+    G.add_edges_from(edges)
+    graph = graph_core.CompactGraph.from_edge_list(30, edges)
+    assert graph.num_edges == G.number_of_edges() == 200
+    assert graph.in_indices.dtype == numpy.int32
+    for node in range(30):
+        # same order as networkx, the order of the first edge
+        assert graph.predecessors(node).tolist() == list(G.predecessors(node))
+        assert graph.successors(node).tolist() == list(G.successors(node))
+        for pred, multiplicity in zip(
+                graph.predecessors(node),
+                graph.in_multiplicity[graph.in_indptr[node]:
+                                      graph.in_indptr[node + 1]]):
+            assert G.number_of_edges(pred, node) == multiplicity
+
+
+def test_reverse_edge():
+    graph = graph_core.CompactGraph.from_edge_list(3, [(0, 1), (1, 2)],
+                                                   add_reverse_edge=True)
+    assert graph.predecessors(1).tolist() == [0, 2]
+    assert graph.successors(1).tolist() == [0, 2]
+    assert graph.num_edges == 4
+
+
+def test_with_reverse_edges_matches_edge_list():
+    for seed in range(20):
+        edges = random_edges(num_nodes=15, num_edges=40, seed=seed)
+        expected = graph_core.CompactGraph.from_edge_list(
+            15, edges, add_reverse_edge=True)
+        graph = graph_core.CompactGraph.from_edge_list(15, edges)
+        calculated = graph.with_reverse_edges()
+        for name in ['in_indptr', 'in_indices', 'in_multiplicity',
+                     'out_indptr', 'out_indices', 'out_multiplicity']:
+            numpy.testing.assert_array_equal(getattr(calculated, name),
+                                             getattr(expected, name))
+        assert list(calculated.edges()) == list(expected.edges())
+
+
+def test_networkx_round_trip():
+    edges = random_edges()
+    graph = graph_core.CompactGraph.from_edge_list(30, edges)
+    nodes = ['n{}'.format(idx) for idx in range(30)]
+    G = graph.to_networkx(nodes)
+    assert sorted(G.edges()) == \
+        sorted((nodes[u], nodes[v]) for u, v in edges)
+    for node in range(30):
+        assert list(G.predecessors(nodes[node])) == \
+            [nodes[pred] for pred in graph.predecessors(node)]
+    copy, copy_nodes = graph_core.CompactGraph.from_networkx(G)
+    assert copy_nodes == nodes
+    assert sorted(copy.edges()) == sorted(graph.edges())
+
+    undirected, _ = graph_core.CompactGraph.from_networkx(nx.path_graph(3))
+    assert undirected.num_edges == 4
+
+
+def test_bad_edge():
+    try:
+        graph_core.CompactGraph.from_edge_list(2, [(0, 2)])
+    except ValueError:
+        pass
+    else:
+        assert False, 'edge to a missing node accepted'
+
+
+def test_memory():
+    rng = numpy.random.RandomState(0)
+    sources = rng.randint(0, 100000, size=1000000)
+    targets = rng.randint(0, 100000, size=1000000)
+    graph = graph_core.CompactGraph(100000, sources, targets)
+    assert graph.nbytes < 30 * 1024 * 1024
@@ -309,19 +309,61 @@ def test_get_pos_neg_bank_values():
 
 
 @nose.with_setup(reset_LensAgent)
-def test_export_state_to_env():
+def test_update_passes_state_file():
+    reset_LensAgent()
+    agent.LensAgent.prototypes = [[0, 1] * 5]
     test_lens_agent = agent.LensAgent(10)
+    test_lens_agent.set_state([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+    out_file = os.path.join(here, 'lens', 'AgentState.out')
+    state_file = os.path.join(here, 'lens', 'AgentState000000.state')
+    assert test_lens_agent.get_state_file_path(out_file) == state_file
+    lens_calls = []
+
+    class LensCalled(Exception):
+        pass
+
+    def call_lens(lens_in_file_dir, lens_env={}, lens_worker=None):
+        with open(lens_env['state_file']) as f:
+            lens_calls.append((dict(lens_env), f.read(), lens_worker))
+        raise LensCalled()
+    test_lens_agent.call_lens = call_lens
+    predecessor = agent.LensAgent(10)
+    predecessor.write_to_ex = lambda file_dir, **kwargs: None
+    test_lens_agent.set_predecessors([predecessor])
+    worker = object()
+    try:
+        test_lens_agent.update_agent_state(lens_in_file='Update.in',
+                                           infl_ex_file='Infl.ex',
+                                           agent_state_out_file=out_file,
+                                           criterion=1, lens_worker=worker)
+    except LensCalled:
+        pass
+    else:
+        assert False
+    finally:
+        for path in (state_file, out_file):
+            if os.path.exists(path):
+                os.remove(path)
+    assert lens_calls == [({'a': '000000', 'state_file': state_file,
+                            'c': '1'},
+                           '0 1 2 3 4\n5 6 7 8 9\n', worker)]
+    assert not hasattr(test_lens_agent, 'get_env_for_pos_neg_bank_values')
 
-    set_state_values = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-    test_lens_agent.set_state(set_state_values)
-    assert test_lens_agent.get_state() == set_state_values
-    env = test_lens_agent.get_env_for_pos_neg_bank_values()
-    # print(env, file=sys.stderr)
-    print(env.get('p0'))
-    assert env.get('p0') == '0'
-    assert env.get('p4') == '4'
-    assert env.get('n0') == '5'
-    assert env.get('n4') == '9'
+
+@nose.with_setup(reset_LensAgent)
+def test_env_for_state_file():
+    reset_LensAgent()
+    agent.LensAgent.prototypes = [[0, 1] * 5]
+    test_lens_agent = agent.LensAgent(10)
+    test_lens_agent.set_state([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+    state_file = os.path.join(here, 'lens', 'AgentState.txt')
+    try:
+        env = test_lens_agent.get_env_for_state_file(state_file)
+        assert env == {'a': '000000', 'state_file': state_file}
+        with open(state_file) as f:
+            assert f.read() == '0 1 2 3 4\n5 6 7 8 9\n'
+    finally:
+        os.remove(state_file)
 
 
 @nose.with_setup(reset_LensAgent)
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+import os
+import shutil
+import tempfile
+
+from mann import agent
+from mann import agent_lens_recurrent
+from mann import lens_cache
+from mann import lens_worker
+
+update_in_file = '''loadExamples {ex}
+openNetOutputFile {out}
+train 1
+closeNetOutputFile
+exit
+'''
+
+
+def test_lru_eviction():
+    cache = lens_cache.LensResultCache(maxsize=2)
+    cache.put('a', [1, 2])
+    cache.put('b', [3, 4])
+    assert cache.get('a') == [1, 2]
+    cache.put('c', [5, 6])
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == [5, 6]
+    assert cache.info() == lens_cache.CacheInfo(hits=2, misses=1,
+                                                maxsize=2, currsize=2)
+
+
+def test_make_key():
+    env = {'a': '000001', 'bm': 1, 'bs': 1, 'wm': 1, 'ws': 1, 'cs': 0.5}
+    key = lens_cache.LensResultCache.make_key('wgt', 'I: 1 0;', env)
+    other_agent = dict(env, a='000002')
+    assert key == lens_cache.LensResultCache.make_key('wgt', 'I: 1 0;',
+                                                      other_agent)
+    other_clamp = dict(env, cs=0.2)
+    assert key != lens_cache.LensResultCache.make_key('wgt', 'I: 1 0;',
+                                                      other_clamp)
+    assert key != lens_cache.LensResultCache.make_key('wgt', 'I: 0 1;', env)
+    assert key != lens_cache.LensResultCache.make_key('wgt2', 'I: 1 0;', env)
+
+
+def test_update_agent_state_cache_hit():
+    lens_dir = tempfile.mkdtemp()
+    lens_parameters = {'between_mean': -1, 'between_sd': 0.1,
+                       'within_mean': 0.5, 'within_sd': 0.1,
+                       'clamp_strength': 0.5,
+                       'in_file_path': os.path.join(lens_dir, 'Update.in'),
+                       'ex_file_path': os.path.join(lens_dir, 'Infl.ex'),
+                       'new_state_path': os.path.join(lens_dir, 'Out.out')}
+    with open(lens_parameters['in_file_path'], 'w') as f:
+        f.write(update_in_file.format(ex=lens_parameters['ex_file_path'],
+                                      out=lens_parameters['new_state_path']))
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    predecessor = agent_lens_recurrent.LensAgentRecurrent(4)
+    predecessor.state = [1, 1, 0, 0]
+    test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+    test_agent.set_predecessors([predecessor])
+    cache = lens_cache.LensResultCache()
+    try:
+        test_agent.update_agent_state('sequential', 'random_1', None,
+                                      lens_parameters=lens_parameters,
+                                      result_cache=cache)
+        assert test_agent.state == [0.5, 0.5, 0, 0]
+        assert cache.info().misses == 1
+
+        # same inputs, LENS does not run and no output file is written
+        test_agent.state = [0, 0, 0, 0]
+        os.remove(lens_parameters['new_state_path'])
+        test_agent.update_agent_state('sequential', 'random_1', None,
+                                      lens_parameters=lens_parameters,
+                                      result_cache=cache)
+        assert test_agent.state == [0.5, 0.5, 0, 0]
+        assert cache.info().hits == 1
+        assert not os.path.exists(lens_parameters['new_state_path'])
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        shutil.rmtree(lens_dir)
+
+
+def test_weight_digest_follows_weight_file():
+    lens_dir = tempfile.mkdtemp()
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+    test_agent.weight_file_path = os.path.join(lens_dir, 'AgentWgt.wt')
+    try:
+        # no weight file yet, the id is used and not kept
+        assert test_agent.get_weight_digest() == 'agent000000'
+        with open(test_agent.weight_file_path, 'w') as f:
+            f.write('weights 1\n')
+        first = test_agent.get_weight_digest()
+        assert first == lens_cache.file_digest(test_agent.weight_file_path)
+
+        # retrained weights get a new digest
+        with open(test_agent.weight_file_path, 'w') as f:
+            f.write('weights 2\n')
+        test_agent.finish_weight_training({'weight_store': None})
+        assert test_agent.get_weight_digest() != first
+    finally:
+        shutil.rmtree(lens_dir)
@@ -30,3 +30,47 @@ def test_generate_lens_recurrent_attitude_list():
     # print(calculated, file=sys.stderr)
     # print(expected, file=sys.stderr)
     assert calculated == expected
+
+
+def test_generate_state_file_reader():
+    test_writer = lens_in_writer.LensInWriterHelper()
+    calculated = test_writer.generate_state_file_reader()
+    assert calculated.startswith('set state_file [open $env(state_file)]\n')
+    assert 'setObj Input:$u.output [lindex $pos_values $u]' in calculated
+    assert 'setObj InputMirror:$u.output [lindex $neg_values $u]' in \
+        calculated
+
+
+def test_generate_step_script():
+    test_writer = lens_in_writer.LensInWriterHelper()
+    calculated = test_writer.generate_step_script(
+        'Update.in', [('000001', 'Infl000001.ex', 'Out000001.out')])
+    expected = ('rename exit _mann_exit\n'
+                'proc exit {args} {return -code return}\n'
+                'set env(a) {000001}\n'
+                'set env(ex_file) {Infl000001.ex}\n'
+                'set env(out_file) {Out000001.out}\n'
+                'source {Update.in}\n'
+                '_mann_exit\n')
+    assert calculated == expected
+
+
+def test_generate_weight_training_script():
+    test_writer = lens_in_writer.LensInWriterHelper()
+    calculated = test_writer.generate_weight_training_script(
+        'WgtMake.in', [{'a': '000001', 'ex_file': 'Wgt000001.ex', 'seed': 7},
+                       {'a': '000002', 'ex_file': 'Wgt000002.ex'}])
+    expected = ('rename exit _mann_exit\n'
+                'proc exit {args} {return -code return}\n'
+                'set env(a) {000001}\n'
+                'set env(ex_file) {Wgt000001.ex}\n'
+                'set env(seed) {7}\n'
+                'deleteNets *\n'
+                'source {WgtMake.in}\n'
+                'unset -nocomplain env(seed)\n'
+                'set env(a) {000002}\n'
+                'set env(ex_file) {Wgt000002.ex}\n'
+                'deleteNets *\n'
+                'source {WgtMake.in}\n'
+                '_mann_exit\n')
+    assert calculated == expected
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+import networkx as nx
+import numpy as np
+
+from mann import agent_lens_recurrent
+from mann import lens_numpy
+from mann import network_agent
+
+lens_parameters = {'between_mean': -1.0, 'between_sd': 0.1,
+                   'within_mean': 0.5, 'within_sd': 0.1,
+                   'clamp_strength': 0.5}
+
+
+def test_create_weights():
+    weights = lens_numpy.create_weights(3, -1, 0, 0.5, 0, random_state=1)
+    assert weights.shape == (6, 6)
+    assert np.all(np.diag(weights) == 0)
+
+    within = weights[:3, :3][~np.eye(3, dtype=bool)]
+    assert np.allclose(within, 0.5)
+
+    # each unit is only connected to the same unit in the other bank
+    assert np.allclose(weights[:3, 3:], np.diag([-1, -1, -1]))
+    assert np.allclose(weights[3:, :3], np.diag([-1, -1, -1]))
+
+
+def test_create_weights_seed():
+    first = lens_numpy.create_weights(5, -1, 0.5, 0.5, 0.5, random_state=42)
+    second = lens_numpy.create_weights(5, -1, 0.5, 0.5, 0.5, random_state=42)
+    assert np.array_equal(first, second)
+
+
+def test_settle_full_clamp():
+    weights = lens_numpy.create_weights(2, -1, 0.1, 0.5, 0.1, random_state=1)
+    inputs = np.array([[1, 1, 0, 0], [0, 1, 0, 1]])
+    calculated = lens_numpy.settle(weights, inputs, clamp_strength=1.0)
+    assert np.allclose(calculated, [0, 1, 0, 1])
+
+
+def test_settle_range():
+    weights = lens_numpy.create_weights(5, -1, 0.1, 0.5, 0.1, random_state=1)
+    inputs = np.random.RandomState(1).randint(0, 2, size=(3, 10))
+    calculated = lens_numpy.settle(weights, inputs, clamp_strength=0.2)
+    assert calculated.shape == (10, )
+    assert np.all((calculated > 0) & (calculated < 1))
+
+
+def test_update_agent_state_numpy():
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    predecessors = [agent_lens_recurrent.LensAgentRecurrent(4)
+                    for i in range(2)]
+    for predecessor in predecessors:
+        predecessor.state = [1, 1, 0, 0]
+    test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+    test_agent.set_predecessors(predecessors)
+    test_agent.create_weight_file(None, None, None, backend='numpy',
+                                  random_state=1, **lens_parameters)
+    assert test_agent.weights.shape == (4, 4)
+
+    test_agent.update_agent_state('sequential', 'random_all', None,
+                                  backend='numpy',
+                                  lens_parameters=lens_parameters)
+    expected = lens_numpy.settle(test_agent.weights,
+                                 [[0, 0, 0, 0], [1, 1, 0, 0], [1, 1, 0, 0]],
+                                 lens_parameters['clamp_strength'])
+    assert np.allclose(test_agent.state, expected)
+    assert test_agent.state[0] > test_agent.state[2]
+    assert test_agent.num_update == 1
+
+
+def test_settle_batch_matches_settle():
+    weights = np.array([lens_numpy.create_weights(3, -1, 0.1, 0.5, 0.1,
+                                                  random_state=seed)
+                        for seed in range(4)])
+    inputs = np.random.RandomState(1).randint(0, 2, size=(4, 3, 6))
+    mask = np.ones((4, 3), dtype=bool)
+    mask[1, 2] = False
+    mask[3, 1:] = False
+    calculated = lens_numpy.settle_batch(weights, inputs, 0.3, mask=mask)
+    for idx in range(4):
+        expected = lens_numpy.settle(weights[idx], inputs[idx][mask[idx]],
+                                     0.3)
+        assert np.allclose(calculated[idx], expected)
+
+
+def test_network_update_batch():
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(4)]
+    agents[0].state = [1, 1, 0, 0]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    for u, v in [(0, 1), (1, 2), (2, 3), (3, 0)]:
+        test_network.G.add_edge(agents[u], agents[v])
+    test_network.set_predecessors_for_each_node()
+
+    updated, new_states = test_network.update_batch(
+        4, 'random_all', None, lens_parameters=lens_parameters)
+    assert new_states.shape == (4, 4)
+    for selected_agent, new_state in zip(updated, new_states):
+        assert np.allclose(selected_agent.state, new_state)
+    assert agents[1].state[0] > agents[1].state[2]
+    assert [a.num_update for a in agents] == [1, 1, 1, 1]
@@ -0,0 +1,38 @@
+#! /usr/bin/env python
+import os
+import shutil
+import tempfile
+
+import numpy.testing
+
+from mann import lens_in_writer
+from mann import lens_output
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+
+def test_tail_lines():
+    test_dir = tempfile.mkdtemp()
+    file_path = os.path.join(test_dir, 'lines.txt')
+    with open(file_path, 'w') as f:
+        f.write(''.join('{}\n'.format(i) for i in range(1000)))
+    assert lens_output.tail_lines(file_path, 3, block_size=7) == \
+        ['997', '998', '999']
+    assert lens_output.tail_lines(file_path, 2000) == \
+        [str(i) for i in range(1000)]
+    shutil.rmtree(test_dir)
+
+
+def test_read_final_state():
+    calculated = lens_output.read_final_state(
+        os.path.join(here, 'lens', 'AgentState_10PU_N_ex.out'), 10)
+    expected = [0.61267, 0.593237, 0.620111, 0.604982, 0.602024,
+                0.584436, 0.578927, 0.560431, 0.565787, 0.57802]
+    numpy.testing.assert_array_equal(calculated, expected)
+
+
+def test_generate_final_tick_output():
+    test_writer = lens_in_writer.LensInWriterHelper()
+    calculated = test_writer.generate_final_tick_output()
+    assert calculated.startswith('set out [open $env(out_file) w]\n')
+    assert 'foreach group {Input InputMirror} {\n' in calculated
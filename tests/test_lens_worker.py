@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+import os
+import shutil
+import tempfile
+import threading
+
+import nose
+
+from mann import agent
+from mann import agent_lens_recurrent
+from mann import fake_lens
+from mann import lens_worker
+
+update_in_file = '''#UPDATE AN AGENT
+set a $env(a)
+loadWeights weights/AgentWgt$a.wt
+loadExamples Infl.ex -s infl
+openNetOutputFile AgentState$a.out
+train 1
+closeNetOutputFile
+exit
+'''
+
+infl_ex = '''name: agent0-1
+I: 0 0 1 1;
+name: agent1
+I: 1 1 0 0;
+'''
+
+
+def make_lens_dir():
+    lens_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(lens_dir, 'weights'))
+    with open(os.path.join(lens_dir, 'Update.in'), 'w') as f:
+        f.write(update_in_file)
+    with open(os.path.join(lens_dir, 'Infl.ex'), 'w') as f:
+        f.write(infl_ex)
+    for a in ['000000', '000001']:
+        open(os.path.join(lens_dir, 'weights',
+                          'AgentWgt{}.wt'.format(a)), 'w').close()
+    return lens_dir
+
+
+def test_split_commands():
+    commands = fake_lens.split_commands(
+        '# comment; not a command\nputs a ; flush stdout\n'
+        'proc p {x} {\n  puts $x\n}\n')
+    assert commands == ['puts a', 'flush stdout', 'proc p {x} {\n  puts $x\n}']
+
+
+def test_worker_survives_exit_in_script():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        for a in ['000000', '000001']:
+            worker.call('Update.in', {'a': a})
+            assert worker.is_alive()
+        assert worker.env['a'] == '000001'
+
+    test_agent = agent.LensAgent.__new__(agent.LensAgent)
+    out_file = os.path.join(lens_dir, 'AgentState000001.out')
+    new_state = test_agent.get_new_state_values_from_out_file(out_file, 4)
+    assert new_state == [0.5, 0.5, 0.5, 0.5]
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_command_error():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        nose.tools.assert_raises(lens_worker.LensWorkerError,
+                                 worker.call, 'Update.in', {'a': '000002'})
+        # the worker keeps running after a failed command
+        worker.call('Update.in', {'a': '000000'})
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_update():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        worker.update(os.path.join('weights', 'AgentWgt000000.wt'),
+                      'Infl.ex', 'AgentState.out')
+    assert os.path.exists(os.path.join(lens_dir, 'AgentState.out'))
+    shutil.rmtree(lens_dir)
+
+
+def test_pool_concurrent_calls():
+    lens_dir = make_lens_dir()
+    errors = []
+
+    def run(pool, a):
+        try:
+            pool.call('Update.in', {'a': a})
+        except lens_worker.LensWorkerError as e:
+            errors.append(e)
+
+    with lens_worker.LensWorkerPool(
+            2, lens_command=lens_worker.FAKE_LENS_COMMAND,
+            cwd=lens_dir) as pool:
+        assert len(pool) == 2
+        threads = [threading.Thread(target=run, args=(pool, a))
+                   for a in ['000000', '000001'] * 3]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+    for a in ['000000', '000001']:
+        assert os.path.exists(
+            os.path.join(lens_dir, 'AgentState{}.out'.format(a)))
+    shutil.rmtree(lens_dir)
+
+
+def test_call_lens_with_worker():
+    lens_dir = make_lens_dir()
+    test_agent = agent.LensAgent.__new__(agent.LensAgent)
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        test_agent.call_lens('Update.in', lens_env={'a': '000000'},
+                             lens_worker=worker)
+    assert os.path.exists(os.path.join(lens_dir, 'AgentState000000.out'))
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_stops_at_first_error():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        nose.tools.assert_raises(
+            lens_worker.LensWorkerError, worker.send,
+            ['loadWeights missing.wt', 'openNetOutputFile After.out'])
+        assert worker.is_alive()
+    assert not os.path.exists(os.path.join(lens_dir, 'After.out'))
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_output_without_newline():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        output = worker.send(['puts stdout first',
+                              'puts -nonewline stdout partial'])
+        assert output == ['first', 'partial']
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_timeout_kills_worker():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(
+            lens_command=lens_worker.FAKE_LENS_COMMAND +
+            ('--command-delay', '5'), cwd=lens_dir, timeout=0.5) as worker:
+        nose.tools.assert_raises(
+            lens_worker.LensWorkerError, worker.update,
+            os.path.join('weights', 'AgentWgt000000.wt'), 'Infl.ex',
+            'AgentState.out')
+        assert not worker.is_alive()
+        nose.tools.assert_raises(lens_worker.LensWorkerError,
+                                 worker.send, ['puts stdout alive'])
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_unsets_env_of_previous_call():
+    lens_dir = make_lens_dir()
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        worker.call('Update.in', {'a': '000000', 'seed': 1})
+        worker.call('Update.in', {'a': '000001'})
+        assert worker.env == {'a': '000001'}
+        assert worker.send(['puts stdout $env(a)']) == ['000001']
+        nose.tools.assert_raises(lens_worker.LensWorkerError, worker.send,
+                                 ['puts stdout $env(seed)'])
+    shutil.rmtree(lens_dir)
+
+
+def test_worker_loads_network_once():
+    lens_dir = make_lens_dir()
+    with open(os.path.join(lens_dir, 'Network.in'), 'w') as f:
+        f.write('addNet net\n')
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        sent = []
+        send = worker.send
+
+        def record_send(commands):
+            sent.extend(commands)
+            return send(commands)
+        worker.send = record_send
+        for a in ['000000', '000001', '000000']:
+            worker.update(os.path.join('weights', 'AgentWgt{}.wt'.format(a)),
+                          'Infl.ex', 'AgentState{}.out'.format(a),
+                          lens_env={'a': a}, network_in_file='Network.in')
+        assert sent.count('source {Network.in}') == 1
+        assert worker.network_in_file == 'Network.in'
+    shutil.rmtree(lens_dir)
+
+
+def test_agent_update_uses_worker_network():
+    lens_dir = make_lens_dir()
+    lens_parameters = {'between_mean': -1, 'between_sd': 0.1,
+                       'within_mean': 0.5, 'within_sd': 0.1,
+                       'clamp_strength': 0.5,
+                       'in_file_path': os.path.join(lens_dir, 'Missing.in'),
+                       'network_in_file_path': os.path.join(lens_dir,
+                                                            'Network.in'),
+                       'ex_file_path': os.path.join(lens_dir, 'Infl.ex'),
+                       'new_state_path': os.path.join(lens_dir, 'Out.out')}
+    with open(lens_parameters['network_in_file_path'], 'w') as f:
+        f.write('addNet net\n')
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    predecessor = agent_lens_recurrent.LensAgentRecurrent(4)
+    predecessor.state = [1, 1, 0, 0]
+    test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+    test_agent.set_predecessors([predecessor])
+    test_agent.weight_file_path = os.path.join(lens_dir, 'weights',
+                                               'AgentWgt000001.wt')
+    with lens_worker.LensWorker(lens_command=lens_worker.FAKE_LENS_COMMAND,
+                                cwd=lens_dir) as worker:
+        for _ in range(2):
+            test_agent.state = [0, 0, 0, 0]
+            test_agent.update_agent_state('sequential', 'random_1', None,
+                                          lens_parameters=lens_parameters,
+                                          lens_worker=worker)
+            assert test_agent.state == [0.5, 0.5, 0, 0]
+        assert worker.network_in_file == \
+            lens_parameters['network_in_file_path']
+        assert worker.env['a'] == '000001'
+    shutil.rmtree(lens_dir)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+import os
+import shutil
+import tempfile
+
+import networkx as nx
+
+from mann import agent
+from mann import agent_lens_recurrent
+from mann import lens_worker
+from mann import lens_workspace
+from mann import network_agent
+
+update_in_file = '''loadExamples $env(ex_file)
+openNetOutputFile $env(out_file)
+train 1
+closeNetOutputFile
+exit
+'''
+
+
+def test_acquire_release_cleanup():
+    root = tempfile.mkdtemp()
+    manager = lens_workspace.LensWorkspaceManager(root=root)
+    first = manager.acquire()
+    second = manager.acquire()
+    assert first.path != second.path
+    assert os.path.dirname(first.path) == manager.path
+    assert first.env() == {'ex_file': first.ex_file_path,
+                           'out_file': first.out_file_path}
+
+    with open(first.out_file_path, 'w') as f:
+        f.write('1 0\n')
+    manager.release(first)
+    # the released workspace is emptied and handed out again
+    recycled = manager.acquire()
+    assert recycled.path == first.path
+    assert os.listdir(recycled.path) == []
+
+    manager.cleanup()
+    assert not os.path.exists(manager.path)
+    shutil.rmtree(root)
+
+
+def test_update_uses_workspaces():
+    lens_dir = tempfile.mkdtemp()
+    lens_parameters = {'between_mean': -1, 'between_sd': 0.1,
+                       'within_mean': 0.5, 'within_sd': 0.1,
+                       'clamp_strength': 0.5,
+                       'in_file_path': os.path.join(lens_dir, 'Update.in'),
+                       'ex_file_path': os.path.join(lens_dir, 'Infl.ex'),
+                       'new_state_path': os.path.join(lens_dir, 'Out.out')}
+    with open(lens_parameters['in_file_path'], 'w') as f:
+        f.write(update_in_file)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(3)]
+    agents[0].state = [1, 1, 0, 0]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    test_network.G.add_edge(agents[0], agents[1])
+    test_network.G.add_edge(agents[0], agents[2])
+    test_network.set_predecessors_for_each_node()
+    try:
+        with lens_workspace.LensWorkspaceManager(root=lens_dir) as manager:
+            test_network.update_simultaneous_lens(
+                3, 'random_1', None, lens_parameters=lens_parameters,
+                workspace_manager=manager)
+            assert agents[1].state == [0.5, 0.5, 0, 0]
+            assert agents[2].state == [0.5, 0.5, 0, 0]
+
+            agents[1].update_agent_state('sequential', 'random_1', None,
+                                         lens_parameters=lens_parameters,
+                                         workspace_manager=manager)
+            assert agents[1].state == [0.75, 0.75, 0, 0]
+        # nothing was written next to the .in file
+        assert os.listdir(lens_dir) == ['Update.in']
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        shutil.rmtree(lens_dir)
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+import itertools
+
+import numpy
+
+from mann import agent_binary
+from mann import network
+from mann import network_agent
+
+
+def edge_keys(graph):
+    sources, targets = graph.edge_arrays()
+    return list(zip(sources.tolist(), targets.tolist()))
+
+
+def test_gnp_compact_graph():
+    graph = network.gnp_compact_graph(6, 1, directed=True)
+    assert sorted(edge_keys(graph)) == \
+        list(itertools.permutations(range(6), 2))
+    graph = network.gnp_compact_graph(6, 1, directed=False)
+    assert sorted(edge_keys(graph)) == \
+        list(itertools.combinations(range(6), 2))
+
+    graph = network.gnp_compact_graph(2000, 0.01, seed=1)
+    assert all(u != v for u, v in edge_keys(graph))
+    assert graph.num_edges == graph.num_distinct_edges
+    expected = 2000 * 1999 * 0.01
+    assert abs(graph.num_edges - expected) < 5 * numpy.sqrt(expected)
+
+    assert edge_keys(network.gnp_compact_graph(100, 0.1, seed=3)) == \
+        edge_keys(network.gnp_compact_graph(100, 0.1, seed=3))
+
+
+def test_barabasi_albert_compact_graph():
+    graph = network.barabasi_albert_compact_graph(3000, 3, seed=2)
+    edges = edge_keys(graph)
+    assert len(edges) == 3 + (3000 - 4) * 3
+    assert graph.num_edges == graph.num_distinct_edges
+    assert all(v < u for u, v in edges)
+    assert all(graph.out_degree[4:] == 3)
+    degree = graph.in_degree + graph.out_degree
+    # preferential attachment gives hubs
+    assert degree.max() > 50
+
+
+def test_watts_strogatz_compact_graph():
+    graph = network.watts_strogatz_compact_graph(500, 6, 0, seed=4)
+    assert sorted(edge_keys(graph)) == \
+        sorted((u, (u + j) % 500) for u in range(500) for j in [1, 2, 3])
+    graph = network.watts_strogatz_compact_graph(500, 6, 0.5, seed=4)
+    edges = edge_keys(graph)
+    assert len(edges) == 1500
+    assert all(u != v for u, v in edges)
+    assert len(set(frozenset(edge) for edge in edges)) == 1500
+
+
+def test_compact_graph_as_edge_list():
+    agent_binary.BinaryAgent.binary_agent_count = 0
+    graph = network.barabasi_albert_compact_graph(50, 2, seed=5)
+    test_network = network_agent.NetworkAgent()
+    test_network.create_multidigraph_of_agents_from_edge_list(
+        50, graph, None, agent_type=('binary', 0.1, 2),
+        add_reverse_edge=True)
+    assert test_network.G.number_of_edges() == 2 * graph.num_edges
+    test_network.set_predecessors_for_each_node()
+    for node in test_network.G.nodes():
+        assert sorted(node.predecessors, key=lambda a: a.agent_id) == \
+            sorted(test_network.G.predecessors(node),
+                   key=lambda a: a.agent_id)
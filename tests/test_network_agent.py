@@ -0,0 +1,305 @@
+#! /usr/bin/env python
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import networkx as nx
+
+from mann import agent
+from mann import agent_lens_recurrent
+from mann import lens_worker
+from mann import network_agent
+
+weight_in_file = '''loadExamples $env(ex_file)
+train 1000
+saveWeights weights/AgentWgt$env(a).wt
+exit
+'''
+
+update_in_file = '''loadExamples $env(ex_file)
+openNetOutputFile $env(out_file)
+train 1
+closeNetOutputFile
+exit
+'''
+
+seeded_weight_in_file = '''seed $env(seed)
+addNet net
+loadExamples $env(ex_file)
+train 1000
+saveWeights weights/AgentWgt$env(a).wt
+exit
+'''
+
+lens_parameters = {'between_mean': -1, 'between_sd': 0.1,
+                   'within_mean': 0.5, 'within_sd': 0.1,
+                   'clamp_strength': 0.5}
+
+
+def test_create_weight_files_parallel():
+    test_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(test_dir, 'weights'))
+    with open(os.path.join(test_dir, 'WgtMake.in'), 'w') as f:
+        f.write(weight_in_file)
+    here = os.getcwd()
+    os.chdir(test_dir)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    try:
+        test_network = network_agent.NetworkAgent()
+        test_network.create_multidigraph_of_agents_from_edge_list(
+            6, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)], 'network.png',
+            agent_type=('lens', 4, 'recurrent_attitude'),
+            num_weight_workers=3,
+            weight_in_file='WgtMake.in', weight_dir='weights',
+            weight_ex_path='Wgt.ex', **lens_parameters)
+        for agent_id in range(6):
+            padded = '{0:06d}'.format(agent_id)
+            # each agent trained on its own examples file
+            assert os.path.exists('Wgt{}.ex'.format(padded))
+            with open(os.path.join('weights',
+                                   'AgentWgt{}.wt'.format(padded))) as f:
+                assert 'a {}\n'.format(padded) in f.read()
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        os.chdir(here)
+        shutil.rmtree(test_dir)
+
+
+def test_update_simultaneous_lens():
+    lens_dir = tempfile.mkdtemp()
+    parameters = dict(lens_parameters,
+                      in_file_path=os.path.join(lens_dir, 'Update.in'),
+                      ex_file_path=os.path.join(lens_dir, 'Infl.ex'),
+                      new_state_path=os.path.join(lens_dir, 'Out.out'))
+    with open(parameters['in_file_path'], 'w') as f:
+        f.write(update_in_file)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(3)]
+    agents[0].state = [1, 1, 0, 0]
+    agents[1].state = [0, 0, 1, 1]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    test_network.G.add_edge(agents[0], agents[1])
+    test_network.G.add_edge(agents[1], agents[2])
+    test_network.set_predecessors_for_each_node()
+    try:
+        updated = test_network.update_simultaneous_lens(
+            3, 'random_1', None, lens_parameters=parameters)
+        assert set(updated) == set(agents[1:])
+        assert agents[0].state == [1, 1, 0, 0]
+        assert agents[1].state == [0.5, 0.5, 0.5, 0.5]
+        # agent 2 read the state agent 1 had at the start of the step
+        assert agents[2].state == [0, 0, 0.5, 0.5]
+        assert all(a.temp_new_state is None for a in agents)
+        assert [a.num_update for a in agents] == [0, 1, 1]
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        shutil.rmtree(lens_dir)
+
+
+def test_update_simultaneous_single_lens_process():
+    lens_dir = tempfile.mkdtemp()
+    parameters = dict(lens_parameters,
+                      in_file_path=os.path.join(lens_dir, 'Update.in'),
+                      ex_file_path=os.path.join(lens_dir, 'Infl.ex'),
+                      new_state_path=os.path.join(lens_dir, 'Out.out'))
+    with open(parameters['in_file_path'], 'w') as f:
+        f.write(update_in_file)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(3)]
+    agents[0].state = [1, 1, 0, 0]
+    agents[1].state = [0, 0, 1, 1]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    test_network.G.add_edge(agents[0], agents[1])
+    test_network.G.add_edge(agents[1], agents[2])
+    test_network.set_predecessors_for_each_node()
+    try:
+        # later agents of a sequential step need the earlier new states
+        try:
+            test_network.update_sequential(3, 'random_1', None,
+                                           lens_parameters=parameters,
+                                           single_lens_process=True)
+        except ValueError:
+            pass
+        else:
+            assert False, 'sequential step run in a single LENS process'
+        test_network.update_simultaneous_lens(3, 'random_1', None,
+                                              lens_parameters=parameters,
+                                              single_lens_process=True)
+        assert agents[0].state == [1, 1, 0, 0]
+        assert agents[1].state == [0.5, 0.5, 0.5, 0.5]
+        assert agents[2].state == [0, 0, 0.5, 0.5]
+        assert [a.num_update for a in agents] == [0, 1, 1]
+        # one step script sourcing the update for both agents
+        with open(os.path.join(lens_dir, 'Step.in')) as f:
+            step_script = f.read()
+        assert step_script.count('source {') == 2
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        shutil.rmtree(lens_dir)
+
+
+class OneAgentCache(object):
+    """Result cache that only holds a result for one agent"""
+    def __init__(self, weight_digest, new_state):
+        self.weight_digest = weight_digest
+        self.new_state = new_state
+
+    def make_key(self, weight_digest, ex_payload, lens_env):
+        return weight_digest
+
+    def get(self, key):
+        return self.new_state if key == self.weight_digest else None
+
+    def put(self, key, result):
+        pass
+
+
+def test_update_lens_step_cache_hit_reads_step_start():
+    lens_dir = tempfile.mkdtemp()
+    parameters = dict(lens_parameters,
+                      in_file_path=os.path.join(lens_dir, 'Update.in'),
+                      ex_file_path=os.path.join(lens_dir, 'Infl.ex'),
+                      new_state_path=os.path.join(lens_dir, 'Out.out'))
+    with open(parameters['in_file_path'], 'w') as f:
+        f.write(update_in_file)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(3)]
+    agents[0].state = [1, 1, 0, 0]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    test_network.G.add_edge(agents[0], agents[1])
+    test_network.G.add_edge(agents[1], agents[2])
+    test_network.set_predecessors_for_each_node()
+    cache = OneAgentCache(agents[1].get_weight_digest(), [1, 1, 1, 1])
+    try:
+        # agents[1] is a cache hit, agents[2] goes through LENS after it
+        test_network.update_lens_step([agents[1], agents[2]], 'random_1',
+                                      None, lens_parameters=parameters,
+                                      result_cache=cache)
+        assert agents[1].state == [1, 1, 1, 1]
+        # agents[2] read the start of step state of agents[1]
+        assert agents[2].state == [0, 0, 0, 0]
+        # the cache hit counts as an update the same as a LENS run
+        assert [a.num_update for a in agents] == [0, 1, 1]
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        shutil.rmtree(lens_dir)
+
+
+def test_create_weight_files_batched():
+    test_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(test_dir, 'weights'))
+    with open(os.path.join(test_dir, 'WgtMake.in'), 'w') as f:
+        f.write(weight_in_file)
+    here = os.getcwd()
+    os.chdir(test_dir)
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    try:
+        test_network = network_agent.NetworkAgent()
+        test_network.create_multidigraph_of_agents_from_edge_list(
+            5, [(0, 1), (1, 2), (2, 3), (3, 4)], 'network.png',
+            agent_type=('lens', 4, 'recurrent_attitude'),
+            num_weight_batches=2,
+            weight_in_file='WgtMake.in', weight_dir='weights',
+            weight_ex_path='Wgt.ex', **lens_parameters)
+        # agents 0, 2, 4 in the first batch and 1, 3 in the second
+        with open('WgtMakeBatch000.in') as f:
+            assert f.read().count('source {WgtMake.in}') == 3
+        for agent_id in range(5):
+            padded = '{0:06d}'.format(agent_id)
+            with open(os.path.join('weights',
+                                   'AgentWgt{}.wt'.format(padded))) as f:
+                assert 'a {}\n'.format(padded) in f.read()
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        os.chdir(here)
+        shutil.rmtree(test_dir)
+
+
+def test_create_weight_files_batched_matches_per_agent():
+    here = os.getcwd()
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    weights = []
+    try:
+        for batch_kwargs in [{}, {'num_weight_batches': 2}]:
+            test_dir = tempfile.mkdtemp()
+            os.makedirs(os.path.join(test_dir, 'weights'))
+            with open(os.path.join(test_dir, 'WgtMake.in'), 'w') as f:
+                f.write(seeded_weight_in_file)
+            os.chdir(test_dir)
+            # the same agent states and so the same training examples
+            random.seed(1)
+            agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+            try:
+                test_network = network_agent.NetworkAgent()
+                test_network.create_multidigraph_of_agents_from_edge_list(
+                    5, [(0, 1), (1, 2), (2, 3), (3, 4)], 'network.png',
+                    agent_type=('lens', 4, 'recurrent_attitude'),
+                    weight_in_file='WgtMake.in', weight_dir='weights',
+                    weight_ex_path='Wgt.ex', weight_seed=7,
+                    **dict(lens_parameters, **batch_kwargs))
+                agent_weights = []
+                for agent_id in range(5):
+                    with open(os.path.join(
+                            'weights',
+                            'AgentWgt{0:06d}.wt'.format(agent_id))) as f:
+                        agent_weights.append(f.read())
+                weights.append(agent_weights)
+            finally:
+                os.chdir(here)
+                shutil.rmtree(test_dir)
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+    assert all(w.startswith('fake lens weights\nnet net ')
+               for w in weights[0])
+    assert weights[0] == weights[1]
+
+
+def test_update_simultaneous_lens_bounded_workers():
+    agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+    agents = [agent_lens_recurrent.LensAgentRecurrent(4) for i in range(9)]
+    test_network = network_agent.NetworkAgent()
+    test_network.G = nx.MultiDiGraph()
+    test_network.G.add_nodes_from(agents)
+    for agent_in in agents[1:]:
+        test_network.G.add_edge(agents[0], agent_in)
+    test_network.set_predecessors_for_each_node()
+
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def run_lens_update(lens_update, **kwargs):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return [1, 1, 0, 0]
+
+    for selected_agent in agents:
+        selected_agent.prepare_lens_update = \
+            lambda *args, **kwargs: None
+        selected_agent.run_lens_update = run_lens_update
+    cpu_count = os.cpu_count
+    os.cpu_count = lambda: 2
+    try:
+        updated = test_network.update_simultaneous_lens(9, 'random_1', None)
+    finally:
+        os.cpu_count = cpu_count
+    assert len(updated) == 8
+    # at most os.cpu_count() LENS calls at the same time
+    assert running[1] == 2
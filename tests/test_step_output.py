@@ -0,0 +1,396 @@
+#! /usr/bin/env python
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+
+import networkx as nx
+import numpy
+
+from mann import agent_lens_recurrent
+from mann import binary_engine
+from mann import network_agent
+from mann import step_output
+from tests.test_binary_engine import create_network
+
+
+def test_binary_round_trip_matches_csv():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(temp_dir, 'steps.csv')
+        step_path = os.path.join(temp_dir, 'steps.bin')
+        export_path = os.path.join(temp_dir, 'export.csv')
+
+        test_network = create_network()
+        random.seed(1)
+        for step in range(5):
+            test_network.update_simultaneous(10, 'threshold_watts')
+            test_network.write_network_agent_step_info(step, csv_path, 'a',
+                                                       'binary')
+
+        test_network = create_network()
+        random.seed(1)
+        with step_output.StepWriter.for_network(step_path,
+                                                test_network) as writer:
+            for step in range(5):
+                test_network.update_simultaneous(10, 'threshold_watts')
+                test_network.record_step_info(step, writer)
+
+        reader = step_output.StepReader(step_path)
+        assert len(reader) == 5
+        assert reader.time_steps.tolist() == list(range(5))
+        assert reader[4]['state'][:, 0].tolist() == \
+            [node.state for node in test_network.G.nodes()]
+        reader.export_csv(export_path)
+        with open(csv_path) as expected, open(export_path) as exported:
+            assert expected.read() == exported.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_engine_and_csv_writer():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(temp_dir, 'steps.csv')
+        step_path = os.path.join(temp_dir, 'steps.bin')
+        writer_path = os.path.join(temp_dir, 'writer.csv')
+
+        engine = binary_engine.BinaryEngine.from_network(create_network())
+        random.seed(2)
+        for step in range(3):
+            engine.update(10, 'threshold_watts_flip')
+            engine.write_step_info(step, csv_path)
+
+        engine = binary_engine.BinaryEngine.from_network(create_network())
+        agent_id = [agent.agent_id for agent in engine.agents]
+        writer = step_output.StepWriter(step_path, agent_id)
+        csv_writer = step_output.CsvStepWriter(writer_path, agent_id)
+        random.seed(2)
+        for step in range(3):
+            engine.update(10, 'threshold_watts_flip')
+            csv_writer.write_step(step, engine.num_update, engine.state,
+                                  engine.step_update_status)
+            engine.record_step_info(step, writer)
+        writer.close()
+        csv_writer.close()
+
+        # appending keeps the header
+        writer = step_output.StepWriter(step_path, agent_id, file_mode='a')
+        writer.write_step(3, engine.num_update, engine.state)
+        writer.close()
+        reader = step_output.StepReader(step_path)
+        assert len(reader) == 4
+        assert (reader[3]['step_update_status'] ==
+                step_output.NO_STATUS).all()
+        with open(csv_path) as expected, open(writer_path) as written:
+            assert expected.read() == written.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_lens_lines():
+    lines = step_output.format_csv_lines(
+        2, numpy.array([0, 1]), numpy.array([1, 0]), numpy.array([-1, -1]),
+        numpy.array([[0.5, 0.25], [0.0, 1.0]]), 'lens')
+    assert lines == ['2,0,1,0.5, 0.25\n', '2,1,0,0.0, 1.0\n']
+
+
+def test_lens_csv_matches_network_output():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        network_path = os.path.join(temp_dir, 'network.csv')
+        csv_path = os.path.join(temp_dir, 'steps.csv')
+        agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+        agents = [agent_lens_recurrent.LensAgentRecurrent(4)
+                  for _ in range(3)]
+        test_network = network_agent.NetworkAgent()
+        test_network.G = nx.MultiDiGraph()
+        test_network.G.add_nodes_from(agents)
+        # agent 1 updated, agents 0 and 2 still have their int states
+        agents[1].state = [0.5, 0.25, 0.0, 1.0]
+        with step_output.CsvStepWriter.for_network(
+                csv_path, test_network, agent_type='lens') as writer:
+            writer.write_network(0, test_network)
+        test_network.write_network_agent_step_info(
+            0, network_path, 'w', 'lens',
+            lens_agent_type='recurrent_attitude')
+        with open(network_path) as expected, open(csv_path) as written:
+            assert written.read() == expected.read()
+        with open(csv_path) as written:
+            assert written.readline() == '0,0,0,0, 0, 0, 0\n'
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_async_recorder_same_output():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        sync_path = os.path.join(temp_dir, 'sync.bin')
+        async_path = os.path.join(temp_dir, 'async.bin')
+        for path, recorder_class in [(sync_path, None),
+                                     (async_path,
+                                      step_output.AsyncStepRecorder)]:
+            test_network = create_network()
+            writer = step_output.StepWriter.for_network(path, test_network)
+            if recorder_class is not None:
+                writer = recorder_class(writer, num_buffers=2)
+            random.seed(3)
+            for step in range(10):
+                test_network.update_simultaneous(10, 'threshold_watts_flip')
+                test_network.record_step_info(step, writer)
+            writer.flush()
+            writer.close()
+        with open(sync_path, 'rb') as expected, \
+                open(async_path, 'rb') as written:
+            assert expected.read() == written.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+class SlowWriter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.time_steps = []
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        self.event.wait()
+        self.time_steps.append(time_step)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_async_recorder_backpressure():
+    state = numpy.zeros((3, 1), dtype=numpy.uint8)
+    num_update = numpy.zeros(3, dtype=numpy.int64)
+
+    writer = SlowWriter()
+    recorder = step_output.AsyncStepRecorder(writer, num_buffers=1,
+                                             backpressure='drop')
+    assert recorder.write_step(0, num_update, state)
+    assert not recorder.write_step(1, num_update, state)
+    assert recorder.num_dropped == 1
+    writer.event.set()
+    recorder.close()
+    assert writer.time_steps == [0]
+
+    writer = SlowWriter()
+    recorder = step_output.AsyncStepRecorder(writer, num_buffers=1,
+                                             timeout=0.01)
+    recorder.write_step(0, num_update, state)
+    try:
+        recorder.write_step(1, num_update, state)
+    except queue.Full:
+        pass
+    else:
+        assert False, 'blocked recorder did not time out'
+    writer.event.set()
+    recorder.close()
+    assert writer.time_steps == [0]
+
+
+class ListWriter(object):
+    def __init__(self):
+        self.statuses = []
+
+    def write_step(self, time_step, num_update, state,
+                   step_update_status=None):
+        self.statuses.append(step_update_status.tolist())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_async_recorder_status_after_first_step():
+    state = numpy.zeros((3, 1), dtype=numpy.uint8)
+    num_update = numpy.zeros(3, dtype=numpy.int64)
+    writer = ListWriter()
+    recorder = step_output.AsyncStepRecorder(writer, num_buffers=1)
+    recorder.write_step(0, num_update, state)
+    recorder.write_step(1, num_update, state, numpy.array([1, -1, 0]))
+    recorder.flush()
+    assert writer.statuses == [[-1, -1, -1], [1, -1, 0]]
+
+    # a step of the wrong shape is refused and keeps no buffer
+    try:
+        recorder.write_step(2, numpy.zeros(4, dtype=numpy.int64),
+                            numpy.zeros((4, 1), dtype=numpy.uint8))
+    except ValueError:
+        pass
+    else:
+        assert False, 'step of the wrong shape was queued'
+    recorder.write_step(3, num_update, state)
+    recorder.close()
+    assert len(writer.statuses) == 3
+
+
+def test_delta_writer_rebuilds_steps():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        step_path = os.path.join(temp_dir, 'steps.bin')
+        delta_path = os.path.join(temp_dir, 'delta.bin')
+        engine_delta_path = os.path.join(temp_dir, 'engine_delta.bin')
+        for path, writer_class in [
+                (step_path, step_output.StepWriter),
+                (delta_path, step_output.DeltaStepWriter)]:
+            test_network = create_network()
+            kwargs = {}
+            if writer_class is step_output.DeltaStepWriter:
+                kwargs = {'keyframe_interval': 4}
+            with writer_class.for_network(path, test_network,
+                                          **kwargs) as writer:
+                random.seed(4)
+                for step in range(10):
+                    test_network.update_simultaneous(5, 'threshold_watts_flip')
+                    test_network.record_step_info(step, writer)
+
+        engine = binary_engine.BinaryEngine.from_network(create_network())
+        with step_output.DeltaStepWriter(
+                engine_delta_path, [agent.agent_id for agent in engine.agents],
+                keyframe_interval=4) as writer:
+            random.seed(4)
+            for step in range(10):
+                engine.update(5, 'threshold_watts_flip')
+                engine.record_step_info(step, writer)
+
+        expected = step_output.StepReader(step_path)
+        for path in [delta_path, engine_delta_path]:
+            reader = step_output.DeltaStepReader(path)
+            assert len(reader) == 10
+            assert reader.time_steps.tolist() == list(range(10))
+            # only sampled agents that changed are written between keyframes
+            assert os.path.getsize(path) < os.path.getsize(step_path)
+            for idx in [9, 3, 4, 0]:
+                for name in ['agent_id', 'num_update', 'step_update_status',
+                             'state']:
+                    assert (reader[idx][name] == expected[idx][name]).all()
+            for block, expected_block in zip(reader, expected):
+                assert (block['state'] == expected_block['state']).all()
+                assert (block['step_update_status'] ==
+                        expected_block['step_update_status']).all()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_sampled_agents_bounded_without_recording():
+    test_network = create_network()
+    random.seed(2)
+    for step in range(50):
+        test_network.update_simultaneous(10, 'threshold_watts')
+    # agents sampled in several steps are kept once
+    assert len(test_network.step_sampled_agents) <= len(test_network.G)
+    assert set(test_network.step_sampled_agents) == \
+        set(agent.agent_id for agent in
+            test_network.step_sampled_agents.values())
+
+
+def test_compressed_csv():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(temp_dir, 'steps.csv')
+        test_network = create_network()
+        random.seed(5)
+        for step in range(4):
+            test_network.update_simultaneous(10, 'threshold_watts')
+            test_network.write_network_agent_step_info(step, csv_path, 'a',
+                                                       'binary')
+        with open(csv_path) as f:
+            expected = f.read()
+
+        for compression, extension in [('gzip', '.gz'), ('lzma', '.xz')]:
+            appended_path = os.path.join(temp_dir, 'appended' + extension)
+            writer_path = os.path.join(temp_dir, 'writer' + extension)
+            test_network = create_network()
+            writer = step_output.CsvStepWriter.for_network(
+                writer_path, test_network, compression=compression,
+                compression_level=1, block_size=4096)
+            random.seed(5)
+            for step in range(4):
+                test_network.update_simultaneous(10, 'threshold_watts')
+                writer.write_network(step, test_network)
+                test_network.write_network_agent_step_info(
+                    step, appended_path, 'a', 'binary',
+                    compression=compression)
+            writer.close()
+            for path in [appended_path, writer_path]:
+                steps = list(step_output.iter_csv_steps(path))
+                assert [time_step for time_step, _ in steps] == \
+                    list(range(4))
+                assert all(len(lines) == 40 for _, lines in steps)
+                assert ''.join(''.join(lines) for _, lines in steps) == \
+                    expected
+            assert os.path.getsize(writer_path) < len(expected) / 4
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_recording_policy():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        full_path = os.path.join(temp_dir, 'full.bin')
+        subset_path = os.path.join(temp_dir, 'subset.bin')
+        aggregate_path = os.path.join(temp_dir, 'aggregates.csv')
+
+        test_network = create_network()
+        agent_id = [agent.agent_id for agent in test_network.G.nodes()]
+        policy = step_output.RecordingPolicy.sampled(agent_id, 5, every=3,
+                                                     seed=0)
+        full = step_output.StepWriter.for_network(full_path, test_network)
+        subset = step_output.PolicyStepWriter.for_network(
+            step_output.StepWriter(subset_path,
+                                   policy.recorded_agent_id(agent_id)),
+            policy, test_network)
+        aggregates = step_output.PolicyStepWriter.for_network(
+            step_output.AggregateStepWriter(aggregate_path),
+            step_output.RecordingPolicy(every=2), test_network)
+        # resets the step variables after each step
+        discard = step_output.CsvStepWriter(os.devnull, agent_id)
+        random.seed(6)
+        for step in range(10):
+            test_network.update_simultaneous(10, 'threshold_watts')
+            for writer in [full, subset, aggregates]:
+                writer.write_network(step, test_network)
+            test_network.record_step_info(step, discard)
+        for writer in [full, subset, aggregates, discard]:
+            writer.close()
+
+        full = step_output.StepReader(full_path)
+        subset = step_output.StepReader(subset_path)
+        assert subset.time_steps.tolist() == [0, 3, 6, 9]
+        rows = policy.select(agent_id)
+        assert len(rows) == 5
+        for block in subset:
+            expected = full[int(block['time_step'])]
+            assert (block['agent_id'] == expected['agent_id'][rows]).all()
+            assert (block['state'] == expected['state'][rows]).all()
+            assert (block['num_update'] ==
+                    expected['num_update'][rows]).all()
+
+        with open(aggregate_path) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == 'time_step,num_agents,num_update,step_updates,' \
+            'fraction_active'
+        assert len(lines) == 6
+        for line in lines[1:]:
+            time_step, num_agents, num_update, _, active = line.split(',')
+            expected = full[int(time_step)]
+            assert int(num_agents) == 40
+            assert int(num_update) == expected['num_update'].sum()
+            assert float(active) == expected['state'].mean()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_lens_aggregates():
+    values = step_output.step_aggregates(
+        numpy.array([1, 2]), numpy.array([[1.0, 0.0], [0.5, 0.5]]), 'lens')
+    assert values == [2, 3, 0.75, 0.25]
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+import os
+import shutil
+import tempfile
+import time
+
+from mann import agent
+from mann import agent_lens_recurrent
+from mann import lens_worker
+from mann import weight_store
+
+weight_in_file = '''loadExamples Wgt.ex
+train 1000
+saveWeights weights/AgentWgt$env(a).wt
+exit
+'''
+
+
+def write_weight_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+
+
+def test_make_key():
+    key = weight_store.WeightStore.make_key('I: 1 0;', {'c': 3}, seed=1)
+    assert key == weight_store.WeightStore.make_key('I: 1 0;', {'c': 3},
+                                                    seed=1)
+    assert key != weight_store.WeightStore.make_key('I: 1 0;', {'c': 3},
+                                                    seed=2)
+    assert key != weight_store.WeightStore.make_key('I: 1 0;', {'c': 4},
+                                                    seed=1)
+    assert key != weight_store.WeightStore.make_key('I: 0 1;', {'c': 3},
+                                                    seed=1)
+
+
+def test_store_fetch_hardlink():
+    test_dir = tempfile.mkdtemp()
+    store = weight_store.WeightStore(os.path.join(test_dir, 'store'))
+    trained = os.path.join(test_dir, 'trained.wt')
+    write_weight_file(trained, 10)
+
+    assert not store.fetch('abc', os.path.join(test_dir, 'run1', 'a.wt'))
+    store.store('abc', trained)
+    assert 'abc' in store
+
+    fetched = os.path.join(test_dir, 'run1', 'a.wt')
+    assert store.fetch('abc', fetched)
+    assert os.path.samefile(fetched, store.path_for('abc'))
+    shutil.rmtree(test_dir)
+
+
+def test_evict_least_recently_used():
+    test_dir = tempfile.mkdtemp()
+    store = weight_store.WeightStore(os.path.join(test_dir, 'store'),
+                                     max_bytes=25)
+    trained = os.path.join(test_dir, 'trained.wt')
+    write_weight_file(trained, 10)
+    for key in ['aa1', 'bb2']:
+        store.store(key, trained)
+    old_time = time.time() - 100
+    os.utime(store.path_for('aa1'), (old_time, old_time))
+    os.utime(store.path_for('bb2'), (old_time + 1, old_time + 1))
+    store.fetch('aa1', os.path.join(test_dir, 'a.wt'))
+
+    store.store('cc3', trained)
+    assert 'aa1' in store
+    assert 'bb2' not in store
+    assert 'cc3' in store
+    assert store.size() == 20
+    shutil.rmtree(test_dir)
+
+
+def test_recurrent_create_weight_file_reuses_store():
+    test_dir = tempfile.mkdtemp()
+    store = weight_store.WeightStore(os.path.join(test_dir, 'store'))
+    parameters = {'between_mean': -1, 'between_sd': 0.1,
+                  'within_mean': 0.5, 'within_sd': 0.1,
+                  'clamp_strength': 0.5}
+    here = os.getcwd()
+    try:
+        for run, lens_command in [('run1', lens_worker.FAKE_LENS_COMMAND),
+                                  ('run2', ('false',))]:
+            # the second run can not call LENS, the weights must come from
+            # the store
+            agent.LensAgent.lens_command = lens_command
+            run_dir = os.path.join(test_dir, run)
+            os.makedirs(os.path.join(run_dir, 'weights'))
+            os.chdir(run_dir)
+            with open('WgtMake.in', 'w') as f:
+                f.write(weight_in_file)
+            agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+            test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+            test_agent.create_weight_file('WgtMake.in', 'weights', 'Wgt.ex',
+                                          weight_store=store, weight_seed=1,
+                                          **parameters)
+            assert os.path.exists(os.path.join('weights',
+                                               'AgentWgt000000.wt'))
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        os.chdir(here)
+    shutil.rmtree(test_dir)
+
+
+def test_retraining_fetched_weights_keeps_store_entry():
+    test_dir = tempfile.mkdtemp()
+    store = weight_store.WeightStore(os.path.join(test_dir, 'store'))
+    parameters = {'between_mean': -1, 'between_sd': 0.1,
+                  'within_mean': 0.5, 'within_sd': 0.1,
+                  'clamp_strength': 0.5}
+    here = os.getcwd()
+    agent.LensAgent.lens_command = lens_worker.FAKE_LENS_COMMAND
+    try:
+        os.makedirs(os.path.join(test_dir, 'run', 'weights'))
+        os.chdir(os.path.join(test_dir, 'run'))
+        with open('WgtMake.in', 'w') as f:
+            f.write(weight_in_file)
+        agent_lens_recurrent.LensAgentRecurrent.agent_count = 0
+        test_agent = agent_lens_recurrent.LensAgentRecurrent(4)
+        weight_path = os.path.join('weights', 'AgentWgt000000.wt')
+        # trained and stored, then fetched from the store
+        for _ in range(2):
+            test_agent.create_weight_file('WgtMake.in', 'weights', 'Wgt.ex',
+                                          weight_store=store, weight_seed=1,
+                                          **parameters)
+        stored = [path for path in store._stored_paths()]
+        assert len(stored) == 1
+        assert os.path.samefile(weight_path, stored[0])
+        with open(stored[0]) as f:
+            stored_weights = f.read()
+
+        # new parameters, LENS writes new weights to the agent's file
+        test_agent.create_weight_file(
+            'WgtMake.in', 'weights', 'Wgt.ex', weight_store=store,
+            weight_seed=1, **dict(parameters, between_mean=-2))
+        assert not os.path.samefile(weight_path, stored[0])
+        with open(stored[0]) as f:
+            assert f.read() == stored_weights
+        with open(weight_path) as f:
+            assert 'bm -2' in f.read()
+        # store entries are read only
+        assert os.stat(stored[0]).st_mode & 0o222 == 0
+    finally:
+        agent.LensAgent.lens_command = ('lens',)
+        os.chdir(here)
+    shutil.rmtree(test_dir)